@@ -59,6 +59,7 @@ from .dprocess import (
 )
 from .lprocess import (
     CalibHelper,
+    MemmapTimeSamples,
     TimeOutPresenter,
     TimeSamplesPhantom,
 )
@@ -105,6 +106,7 @@ __all__ = [
     'BeamformerPresenter',
     'CalibHelper',
     'DataTableMapper',
+    'MemmapTimeSamples',
     'MicGeomComponent',
     'MicGeomPresenter',
     'NumericInputMapper',
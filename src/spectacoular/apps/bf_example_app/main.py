@@ -9,6 +9,7 @@ Start from an installed package with:
     bf_example_app --show
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import acoular as ac
@@ -35,6 +36,7 @@ from bokeh.models.widgets import (
     NumberFormatter,
     RangeSlider,
     Select,
+    Slider,
     TableColumn,
     Toggle,
 )
@@ -252,7 +254,7 @@ beamformer_selector = Select(
 )
 
 # use additional classes for data evaluation/view
-bv.trait_widget_args.update({'num': {'width': 40}, 'freq': {'width': 100}})
+bv.trait_widget_args.update({'num': {'width': 40}, 'freq': {'width': 100}, 'precompute': {'width': 100, 'height': 50}})
 # get widgets to control settings
 ts_widgets = ts.get_widgets()
 mg_widgets = mic_layout.widgets
@@ -328,9 +330,39 @@ def freq_slider_callback(_attr, _old, _new):
 
 freq_slider.on_change('value', freq_slider_callback)
 
+# with precompute, the maps of all bands are shipped once and the slider selects them on the client
+band_slider = Slider(
+    start=20,
+    end=20000,
+    step=1.0,
+    value=bv.freq,
+    width=220,
+    height=50,
+    title='Band',
+    disabled=not bv.precompute,
+)
+band_slider.js_on_change('value', bv.get_freq_callback(title='Band {freq} Hz'))
+
+
+def band_slider_callback(_attr, _old, new):
+    """Keep the band center frequency of the presenter in sync with the slider."""
+    bv.freq = float(new)
+
+
+band_slider.on_change('value_throttled', band_slider_callback)
+bv.observe(lambda event: setattr(band_slider, 'disabled', not event.new), 'precompute')
+
 # create Button to trigger beamforming result calculation
 calc_button = Toggle(button_type='primary', width=125, height=50, label='Calculate')
-sp.set_calc_button_callback(bv.update, calc_button)
+# beamforming runs in a background thread, changed parameters stop a running calculation
+cancel_calc = sp.set_calc_button_callback(
+    bv.calc,
+    calc_button,
+    executor=ThreadPoolExecutor(max_workers=1),
+    publish_func=bv.publish,
+    pass_cancel_event=True,
+)
+bv.observe(lambda _event: cancel_calc(), 'source.digest, freq, num')
 
 
 def update_grid(_attr, _old, _new):
@@ -457,7 +489,9 @@ instruction_calculation = Div(
         ' <b>Select a desired beamforming method</b> via the "Beamforming Method" widget '
         'and <b>press the Calculate Button</b>. Depending on the method, this may take '
         'some time. You may also want to change the desired frequency and bandwith of '
-        'interest with the "freq" and "num" text field widgets.'
+        'interest with the "freq" and "num" text field widgets. With "precompute" '
+        'activated, the maps of all bands are calculated at once and the "Band" slider '
+        'switches between them without recalculation.'
     )
 )
 
@@ -478,7 +512,7 @@ instruction_sector_integration = Div(
 
 left_layout = layout(
     [
-        [Spacer(width=40), calc_button, *bv_widgets.values(), dynamic_slider],
+        [Spacer(width=40), calc_button, *bv_widgets.values(), dynamic_slider, band_slider],
         [bf_plot],
     ]
 )
@@ -47,10 +47,11 @@ line_opts = {
 }
 
 # build processing chain
-ts = sp.MaskedTimeSamples(file=Path(__file__).parent.parent / 'example_data.h5')
+ts = sp.MemmapTimeSamples(file=Path(__file__).parent.parent / 'example_data.h5')
 tv = sp.TimeSamplesPresenter(
     source=ts,
     _numsubsamples=1000,
+    use_pyramid=True,
     cdsource=ColumnDataSource(data={'xs': [], 'ys': [], 'ch': [], 'color': [], 'sizes': []}),
 )
 tio = ac.MaskedTimeOut(source=ts, invalid_channels=[])
@@ -204,12 +204,15 @@ tic3 = sp.TimeConsumer(
 # oscilloscope chain
 tic2 = sp.TimeConsumer(
     source=ts,
-    down=32,
+    down=128,
+    decimation="m4",  # 4 points per 128 samples, peaks are kept
     channels=[
         0,
     ],
     num=8192,
     rollover=32 * 4 * 96,
+    ring_buffer=True,
+    queue_size=4,
 )
 
 # set up devices choice
@@ -7,5 +7,13 @@
 Plugin classes for acoular to be used with spectacoular
 """
 
+from .process import (  # noqa: F401
+    BufferOverflowError,
+    ProcessConsumer,
+    SampleFanOut,
+    SharedRing,
+    SharedRingSource,
+)
 from .spectra import CSMInOut, PowerSpectraSetCSM  # noqa: F401
-from .tbeamform import BeamformerFreqTime  # noqa: F401
+from .tbeamform import BeamformerFreqTime, BeamformerTimeStream  # noqa: F401
+from .tprocess import WriteH5Batched, WriteH5Segmented, find_segments  # noqa: F401
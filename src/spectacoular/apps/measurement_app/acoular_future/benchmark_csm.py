@@ -0,0 +1,76 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Acoular Development Team.
+# ------------------------------------------------------------------------------
+"""
+Compare the moving-average CSM kernels for different numbers of microphones.
+
+Run with:
+
+    python -m spectacoular.apps.measurement_app.acoular_future.benchmark_csm
+"""
+
+import argparse
+from time import perf_counter
+
+import numba as nb
+import numpy as np
+
+from .fastFuncs import calcCSMmav, calcCSMmavBatch
+
+
+def timeit(func, repeat):
+    """Return the minimum run time of func in seconds."""
+    func()  # compile / warm up
+    times = []
+    for _ in range(repeat):
+        t0 = perf_counter()
+        func()
+        times.append(perf_counter() - t0)
+    return min(times)
+
+
+def benchmark(num_mics, num_freqs=513, num_blocks=8, repeat=5, dtype=np.complex128):
+    """Return run times of the scalar and the batched kernel for num_blocks FFT blocks."""
+    rng = np.random.default_rng(1)
+    spec = (
+        rng.standard_normal((num_blocks, num_freqs, num_mics))
+        + 1j * rng.standard_normal((num_blocks, num_freqs, num_mics))
+    ).astype(dtype)
+    csm = np.zeros((num_freqs, num_mics, num_mics), dtype=dtype)
+
+    def scalar():
+        for ft in spec:
+            calcCSMmav(csm, ft, 0.1)
+
+    def batched():
+        calcCSMmavBatch(csm, spec, 0.1)
+
+    return timeit(scalar, repeat), timeit(batched, repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--mics", type=int, nargs="+", default=[8, 32, 64, 128], help="numbers of microphones"
+    )
+    parser.add_argument("--freqs", type=int, default=513, help="number of frequency lines")
+    parser.add_argument("--blocks", type=int, default=8, help="number of FFT blocks per update")
+    parser.add_argument(
+        "--threads", type=int, default=0, help="number of threads, 0: numba default"
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="number of repetitions")
+    args = parser.parse_args()
+    if args.threads > 0:
+        nb.set_num_threads(args.threads)
+    print(f"{args.freqs} frequencies, {args.blocks} blocks, {nb.get_num_threads()} threads")
+    print(f"{'mics':>6} {'scalar/ms':>10} {'batched/ms':>11} {'speedup':>8}")
+    for num_mics in args.mics:
+        tscalar, tbatched = benchmark(num_mics, args.freqs, args.blocks, args.repeat)
+        print(
+            f"{num_mics:>6} {1e3 * tscalar:>10.2f} {1e3 * tbatched:>11.2f} "
+            f"{tscalar / tbatched:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
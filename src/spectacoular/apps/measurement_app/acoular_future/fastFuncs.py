@@ -2,6 +2,7 @@
 # Copyright (c) Acoular Development Team.
 # ------------------------------------------------------------------------------
 import numba as nb
+import numpy as np
 
 cachedOption = True  # if True: saves the numba func as compiled func in sub directory
 
@@ -52,3 +53,225 @@ def calcCSMmav(csm, SpecAllMics, alpha):
                     - csm[cntFreq, cntRow, cntColumn]
                 )
     return csm
+
+
+@nb.njit(
+    [
+        nb.complex128[:, :, :](nb.complex128[:, :, :], nb.complex128[:, :, :], nb.float64),
+        nb.complex64[:, :, :](nb.complex64[:, :, :], nb.complex64[:, :, :], nb.float64),
+    ],
+    cache=cachedOption,
+    parallel=True,
+    fastmath=True,
+)
+def calcCSMmavBatch(csm, SpecAllMics, alpha):
+    """Adds several spectra weighted to the Cross-Spectral-Matrix (CSM).
+    Gives the same result as calling :func:`calcCSMmav` for every ensemble
+    in order, but the ensembles are added as one rank-k update
+
+        csm = (1 - alpha)**k * csm + sum_j alpha * (1 - alpha)**(k - 1 - j) * S_j S_j^H
+
+    and the frequencies are processed in parallel. The number of threads can
+    be set with :func:`numba.set_num_threads`. Here only the upper triangular
+    matrix of the CSM is calculated.
+
+    Parameters
+    ----------
+    csm : complex128[nFreqs, nMics, nMics]
+        The cross spectral matrix which gets updated with the spectra of the ensembles.
+    SpecAllMics : complex128[nBlocks, nFreqs, nMics]
+        Spectra of the added ensembles at all Mics, oldest ensemble first.
+    alpha : Moving average weighting
+
+    Returns
+    -------
+    None : as the input csm gets overwritten.
+    """
+    nBlocks = SpecAllMics.shape[0]
+    nFreqs = csm.shape[0]
+    nMics = csm.shape[1]
+    decay = (1.0 - alpha) ** nBlocks
+    weights = np.empty(nBlocks)
+    for cntBlock in range(nBlocks):
+        weights[cntBlock] = alpha * (1.0 - alpha) ** (nBlocks - 1 - cntBlock)
+    for cntFreq in nb.prange(nFreqs):
+        # spectra of this frequency, weighted and conjugated for the columns
+        spec = np.empty((nBlocks, nMics), dtype=SpecAllMics.dtype)
+        specConj = np.empty((nBlocks, nMics), dtype=SpecAllMics.dtype)
+        for cntBlock in range(nBlocks):
+            for cntMic in range(nMics):
+                spec[cntBlock, cntMic] = SpecAllMics[cntBlock, cntFreq, cntMic]
+                specConj[cntBlock, cntMic] = (
+                    weights[cntBlock] * SpecAllMics[cntBlock, cntFreq, cntMic].conjugate()
+                )
+        for cntRow in range(nMics):
+            for cntColumn in range(cntRow, nMics):
+                csm[cntFreq, cntRow, cntColumn] *= decay
+            for cntBlock in range(nBlocks):
+                temp = spec[cntBlock, cntRow]
+                # upper triangular part of the row, contiguous and vectorizable
+                for cntColumn in range(cntRow, nMics):
+                    csm[cntFreq, cntRow, cntColumn] += temp * specConj[cntBlock, cntColumn]
+    return csm
+
+
+@nb.njit(
+    [
+        nb.complex128[:, :, :](nb.complex128[:, :, :], nb.complex128[:, :, :], nb.float64),
+        nb.complex64[:, :, :](nb.complex64[:, :, :], nb.complex64[:, :, :], nb.float64),
+    ],
+    cache=cachedOption,
+)
+def fillHermitian(csmUpper, csm, scale):
+    """Writes the scaled Hermitian CSM given by its upper triangular matrix.
+
+    Parameters
+    ----------
+    csmUpper : complex128[nFreqs, nMics, nMics]
+        CSM of which only the upper triangular matrix (including the main
+        diagonal) is used, e.g. as calculated by :func:`calcCSMmav`.
+    csm : complex128[nFreqs, nMics, nMics]
+        Preallocated output, gets overwritten with the full CSM.
+    scale : Factor applied to all elements
+
+    Returns
+    -------
+    None : as the output csm gets overwritten.
+    """
+    nFreqs = csm.shape[0]
+    nMics = csm.shape[1]
+    for cntFreq in range(nFreqs):
+        for cntRow in range(nMics):
+            for cntColumn in range(cntRow, nMics):
+                temp = scale * csmUpper[cntFreq, cntRow, cntColumn]
+                csm[cntFreq, cntColumn, cntRow] = temp.conjugate()
+                csm[cntFreq, cntRow, cntColumn] = temp
+    return csm
+
+
+@nb.njit(
+    [
+        nb.complex128[:, :](nb.complex128[:, :, :], nb.complex128[:, :], nb.float64),
+        nb.complex64[:, :](nb.complex64[:, :, :], nb.complex64[:, :], nb.float64),
+    ],
+    cache=cachedOption,
+)
+def packUpper(csmUpper, packed, scale):
+    """Writes the scaled upper triangular matrix of the CSM in packed format.
+
+    The packed format holds the elements of the upper triangular matrix
+    (including the main diagonal) row by row, in the order of
+    :func:`numpy.triu_indices`.
+
+    Parameters
+    ----------
+    csmUpper : complex128[nFreqs, nMics, nMics]
+        CSM of which only the upper triangular matrix is used.
+    packed : complex128[nFreqs, nMics*(nMics+1)/2]
+        Preallocated output, gets overwritten with the packed CSM.
+    scale : Factor applied to all elements
+
+    Returns
+    -------
+    None : as the output packed gets overwritten.
+    """
+    nFreqs = csmUpper.shape[0]
+    nMics = csmUpper.shape[1]
+    for cntFreq in range(nFreqs):
+        cntPacked = 0
+        for cntRow in range(nMics):
+            for cntColumn in range(cntRow, nMics):
+                packed[cntFreq, cntPacked] = scale * csmUpper[cntFreq, cntRow, cntColumn]
+                cntPacked += 1
+    return packed
+
+
+@nb.njit(
+    [
+        nb.complex128[:, :, :](nb.complex128[:, :], nb.complex128[:, :, :]),
+        nb.complex64[:, :, :](nb.complex64[:, :], nb.complex64[:, :, :]),
+    ],
+    cache=cachedOption,
+)
+def unpackHermitian(packed, csm):
+    """Writes the full Hermitian CSM given in packed format (see :func:`packUpper`).
+
+    Parameters
+    ----------
+    packed : complex128[nFreqs, nMics*(nMics+1)/2]
+        Packed upper triangular matrix of the CSM.
+    csm : complex128[nFreqs, nMics, nMics]
+        Preallocated output, gets overwritten with the full CSM.
+
+    Returns
+    -------
+    None : as the output csm gets overwritten.
+    """
+    nFreqs = csm.shape[0]
+    nMics = csm.shape[1]
+    for cntFreq in range(nFreqs):
+        cntPacked = 0
+        for cntRow in range(nMics):
+            for cntColumn in range(cntRow, nMics):
+                temp = packed[cntFreq, cntPacked]
+                csm[cntFreq, cntColumn, cntRow] = temp.conjugate()
+                csm[cntFreq, cntRow, cntColumn] = temp
+                cntPacked += 1
+    return csm
+
+
+@nb.njit(
+    [
+        nb.void(
+            nb.float32[:, ::1],
+            nb.int64[:, ::1],
+            nb.float32[:, ::1],
+            nb.float32[:, ::1],
+            nb.float32[:, ::1],
+            nb.int64,
+            nb.int64,
+        ),
+    ],
+    cache=cachedOption,
+    nogil=True,
+    fastmath=True,
+)
+def delayAndSum(history, offsets, weights0, weights1, out, gridStart, gridStop):
+    """Delay-and-sum of a block for the grid points gridStart ... gridStop-1.
+
+    The fractional delays are realized by linear interpolation between two
+    samples. The function releases the GIL, so that chunks of the grid can be
+    processed in parallel threads.
+
+    Parameters
+    ----------
+    history : float32[nMics, nSamples]
+        History of the time signals, channel by channel.
+    offsets : int64[gridSize, nMics]
+        Integer delays in samples for each grid point and each channel.
+    weights0 : float32[gridSize, nMics]
+        Weights of the sample at the integer delay (amplitude * (1 - fractional delay)).
+    weights1 : float32[gridSize, nMics]
+        Weights of the next sample (amplitude * fractional delay).
+    out : float32[gridSize, num]
+        Output, the rows gridStart ... gridStop-1 get overwritten.
+    gridStart, gridStop : Range of grid points to process
+
+    Returns
+    -------
+    None : as the output out gets overwritten.
+    """
+    nMics = offsets.shape[1]
+    num = out.shape[1]
+    # local accumulator and history slices let the inner loop vectorize
+    acc = np.zeros(num, dtype=np.float32)
+    for cntGrid in range(gridStart, gridStop):
+        acc[:] = 0.0
+        for cntMic in range(nMics):
+            offset = offsets[cntGrid, cntMic]
+            w0 = weights0[cntGrid, cntMic]
+            w1 = weights1[cntGrid, cntMic]
+            hist = history[cntMic, offset : offset + num + 1]
+            for n in range(num):
+                acc[n] += w0 * hist[n] + w1 * hist[n + 1]
+        out[cntGrid, :] = acc
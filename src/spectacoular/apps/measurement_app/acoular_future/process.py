@@ -0,0 +1,703 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Acoular Development Team.
+# ------------------------------------------------------------------------------
+
+import io
+import multiprocessing as mp
+import pickle
+import traceback
+from collections import deque
+from inspect import currentframe
+from multiprocessing import shared_memory
+from threading import Lock
+from warnings import warn
+
+import acoular as ac
+import numpy as np
+from traits.api import Any, Bool, Dict, Enum, Float, Instance, Int, Property, Str, cached_property
+
+
+class BufferOverflowError(OSError):
+    """Raised by :class:`SampleFanOut` if a consumer exceeds its buffer size."""
+
+
+class SampleFanOut(ac.InOut):
+    """
+    Distributes the blocks of a source to several consumers via one shared
+    ring buffer.
+
+    Drop-in replacement for :class:`~acoular.process.SampleSplitter`: consumers
+    are registered with :meth:`register_object` and pull their blocks by
+    calling :meth:`result`. Instead of one block queue per consumer, all
+    blocks are kept once in a ring buffer and every consumer only has a read
+    cursor. The blocks are handed out as read-only views, so the memory
+    needed does not grow with the number of consumers.
+
+    Consumers that process the same sub-chain (e.g.
+    ``TimePower(source=fan_out)`` with equal settings) can share its output via
+    :meth:`share`, so that the sub-chain is computed only once.
+    """
+
+    #: Maximum number of blocks a consumer may lag behind, unless given
+    #: per consumer in :meth:`register_object`, defaults to 100.
+    buffer_size = Int(100, desc="default maximum number of unread blocks")
+
+    #: Behaviour of registered consumers if their unread blocks exceed their
+    #: buffer size: "error" raises a :obj:`BufferOverflowError` in all consumers,
+    #: "warning" and "none" drop the oldest block (with or without warning).
+    buffer_overflow_treatment = Dict(
+        key_trait=Instance(ac.Generator), value_trait=Enum("error", "warning", "none")
+    )
+
+    #: Number of blocks dropped per consumer since its registration, readonly.
+    dropped = Property()
+
+    # internal identifier
+    digest = Property(depends_on=["source.digest"])
+
+    # read cursors (absolute block numbers) of the consumers
+    _cursors = Dict(key_trait=Instance(ac.Generator), value_trait=Int)
+
+    # maximum number of unread blocks per consumer
+    _sizes = Dict(key_trait=Instance(ac.Generator), value_trait=Int)
+
+    _dropped = Dict(key_trait=Instance(ac.Generator), value_trait=Int)
+
+    # maximum number of unread blocks per consumer since its registration
+    _max_unread = Dict(key_trait=Instance(ac.Generator), value_trait=Int)
+
+    # fan-outs of shared sub-chains, by digest
+    _shared = Dict()
+
+    # fan-out and registered object this fan-out is fed by, if created by :meth:`share`
+    _parent = Instance(ac.InOut)
+    _tap = Instance(ac.Generator)
+
+    _ring = Any()
+    _head = Int(0)
+    _num = Int(0)
+    _epoch = Int(0)
+    _done_epoch = Int(-1)
+    _source_generator = Any()
+    _buffer_overflow = Bool(False)
+    _lock = Instance(Lock, ())
+    _produce_lock = Instance(Lock, ())
+
+    @cached_property
+    def _get_digest(self):
+        return ac.internal.digest(self)
+
+    def _get_dropped(self):
+        with self._lock:
+            return dict(self._dropped)
+
+    def buffer_stats(self, obj):
+        """
+        Return the buffer statistics of a registered consumer.
+
+        Parameters
+        ----------
+        obj : :class:`~acoular.base.Generator`
+            Registered consumer.
+
+        Returns
+        -------
+        dict
+            "unread": number of blocks not yet read by the consumer,
+            "max_unread": maximum number of unread blocks since registration,
+            "max_lag": the same in samples,
+            "dropped": number of dropped blocks, see :attr:`dropped`.
+        """
+        with self._lock:
+            return {
+                "unread": self._head - self._cursors[obj],
+                "max_unread": self._max_unread[obj],
+                "max_lag": self._max_unread[obj] * self._num,
+                "dropped": self._dropped[obj],
+            }
+
+    def _ring_size(self):
+        return max(self._sizes.values(), default=self.buffer_size)
+
+    def _resize_ring(self):
+        size = self._ring_size()
+        ring = [None] * size
+        if self._ring is not None:
+            for block_num in range(max(0, self._head - min(size, len(self._ring))), self._head):
+                ring[block_num % size] = self._ring[block_num % len(self._ring)]
+        self._ring = ring
+
+    def register_object(self, *objects_to_register, buffer_size=None, buffer_overflow_treatment=None):
+        """
+        Register one or more consumers.
+
+        Parameters
+        ----------
+        objects_to_register : :class:`~acoular.base.Generator`
+            Objects whose :attr:`source` is this fan-out.
+        buffer_size : int, optional
+            Maximum number of unread blocks of the consumers,
+            defaults to :attr:`buffer_size`.
+        buffer_overflow_treatment : str, optional
+            "error" (default), "warning" or "none",
+            see :attr:`buffer_overflow_treatment`.
+
+        Raises
+        ------
+        OSError
+            If one of the objects is already registered.
+        """
+        with self._lock:
+            if self._parent is not None and not self._cursors:
+                self._parent.register_object(
+                    self._tap, buffer_size=buffer_size, buffer_overflow_treatment=buffer_overflow_treatment
+                )
+            for obj in objects_to_register:
+                if obj in self._cursors:
+                    msg = f"object {obj} is already registered."
+                    raise OSError(msg)
+                self._cursors[obj] = self._head
+                self._sizes[obj] = self.buffer_size if buffer_size is None else buffer_size
+                self._dropped[obj] = 0
+                self._max_unread[obj] = 0
+                self.buffer_overflow_treatment[obj] = buffer_overflow_treatment or "error"
+            self._resize_ring()
+
+    def remove_object(self, *objects_to_remove):
+        """
+        Unregister one or more consumers, or all consumers if none are given.
+
+        Raises
+        ------
+        KeyError
+            If one of the objects is not registered.
+        """
+        with self._lock:
+            if not objects_to_remove:
+                objects_to_remove = list(self._cursors)
+            for obj in objects_to_remove:
+                del self._cursors[obj]
+                del self._sizes[obj]
+                del self._dropped[obj]
+                del self._max_unread[obj]
+                del self.buffer_overflow_treatment[obj]
+            if self._parent is not None and not self._cursors:
+                self._parent.remove_object(self._tap)
+
+    def share(self, obj):
+        """
+        Return a fan-out that distributes the output of a sub-chain.
+
+        If a sub-chain with the same digest has been shared before, its
+        fan-out is returned and obj is not used. The sub-chain is registered
+        at this fan-out as long as consumers are registered at the returned
+        fan-out.
+
+        Parameters
+        ----------
+        obj : :class:`~acoular.base.Generator`
+            Last object of a processing chain that starts at this fan-out.
+
+        Returns
+        -------
+        :class:`SampleFanOut`
+        """
+        with self._lock:
+            if obj.digest not in self._shared:
+                tap = obj
+                while tap.source is not self:
+                    tap = tap.source
+                self._shared[obj.digest] = SampleFanOut(
+                    source=obj, buffer_size=self.buffer_size, _parent=self, _tap=tap
+                )
+            return self._shared[obj.digest]
+
+    def _start(self, num):
+        # called with self._lock held
+        self._source_generator = self.source.result(num)
+        self._epoch += 1
+        self._num = num
+        self._head = 0
+        self._ring = [None] * self._ring_size()
+        self._buffer_overflow = False
+        for obj in self._cursors:
+            self._cursors[obj] = 0
+
+    def _make_room(self):
+        # called with self._lock held, before block self._head is added
+        for obj, cursor in self._cursors.items():
+            if self._head - cursor >= self._sizes[obj]:
+                treatment = self.buffer_overflow_treatment[obj]
+                if treatment == "error":
+                    self._buffer_overflow = True
+                    return
+                if treatment == "warning":
+                    warn(f"overfilled buffer for object: {obj} data will get lost", UserWarning, stacklevel=1)
+                self._cursors[obj] = self._head - self._sizes[obj] + 1
+                self._dropped[obj] += self._cursors[obj] - cursor
+
+    def _produce(self, epoch):
+        # fetch the next block from the source, unless another consumer did
+        with self._produce_lock:
+            with self._lock:
+                if self._epoch != epoch or self._source_generator is None:
+                    return
+                head = self._head
+                generator = self._source_generator
+            try:
+                block = next(generator)
+            except StopIteration:
+                with self._lock:
+                    if self._epoch == epoch:
+                        self._done_epoch = epoch
+                        self._source_generator = None
+                return
+            block = np.asarray(block).view()
+            block.flags.writeable = False
+            with self._lock:
+                if self._epoch != epoch or self._head != head:
+                    return
+                self._make_room()
+                self._ring[head % len(self._ring)] = block
+                self._head = head + 1
+                for obj, cursor in self._cursors.items():
+                    self._max_unread[obj] = max(self._max_unread[obj], self._head - cursor)
+
+    def result(self, num):
+        """
+        Yield the blocks of the source to the calling consumer.
+
+        Parameters
+        ----------
+        num : int
+            Number of samples per block.
+
+        Yields
+        ------
+        :class:`numpy.ndarray`
+            Read-only blocks of shape (num, :attr:`num_channels`), shared by
+            all consumers. The last block may be shorter than num.
+
+        Raises
+        ------
+        OSError
+            If the calling object is not registered.
+        BufferOverflowError
+            If the unread blocks of a consumer with overflow treatment "error"
+            exceed its buffer size.
+        """
+        calling_obj = currentframe().f_back.f_locals["self"]
+        with self._lock:
+            if calling_obj not in self._cursors:
+                msg = f"calling object {calling_obj} is not registered."
+                raise OSError(msg)
+            if self._source_generator is None:
+                self._start(num)
+            epoch = self._epoch
+        while True:
+            with self._lock:
+                if self._buffer_overflow:
+                    msg = "Maximum size of block buffer is reached!"
+                    raise BufferOverflowError(msg)
+                cursor = self._cursors.get(calling_obj)
+                if self._epoch != epoch or cursor is None:
+                    return
+                if cursor < self._head:
+                    block = self._ring[cursor % len(self._ring)]
+                    self._cursors[calling_obj] = cursor + 1
+                elif self._done_epoch == epoch:
+                    return
+                else:
+                    block = None
+            if block is None:
+                self._produce(epoch)
+            else:
+                yield block
+
+
+class SharedRing:
+    """
+    Ring of blocks in shared memory for one writing and one reading process.
+
+    Must be passed to the other process as argument of
+    :class:`multiprocessing.Process`, the semaphores can not be pickled otherwise.
+    """
+
+    def __init__(self, ctx, num_slots, num_rows, num_channels, dtype=np.float64):
+        self.shape = (num_slots, num_rows, num_channels)
+        self.dtype = np.dtype(dtype)
+        size = int(np.prod(self.shape)) * self.dtype.itemsize + 8 * num_slots
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self.name = self._shm.name
+        self._free = ctx.Semaphore(num_slots)
+        self._filled = ctx.Semaphore(0)
+        self._write_index = self._read_index = 0
+        self._attach()
+
+    def _attach(self):
+        self._lengths = np.ndarray(self.shape[0], dtype=np.int64, buffer=self._shm.buf)
+        self._data = np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf, offset=8 * self.shape[0])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ("_shm", "_lengths", "_data"):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._shm = shared_memory.SharedMemory(name=self.name)
+        self._attach()
+
+    def put(self, block=None, timeout=None):
+        """
+        Write a block or, if block is None, mark the end of the data.
+
+        Waits for a free slot if the ring is full. Returns False if no slot
+        got free within timeout seconds.
+        """
+        if not self._free.acquire(timeout=timeout):
+            return False
+        slot = self._write_index % self.shape[0]
+        if block is None:
+            self._lengths[slot] = -1
+        else:
+            self._data[slot, : block.shape[0]] = block
+            self._lengths[slot] = block.shape[0]
+        self._write_index += 1
+        self._filled.release()
+        return True
+
+    def get(self, timeout=None):
+        """
+        Return a copy of the next block.
+
+        Returns None if no block arrived within timeout seconds and
+        raises :obj:`EOFError` at the end of the data.
+        """
+        if not self._filled.acquire(timeout=timeout):
+            return None
+        slot = self._read_index % self.shape[0]
+        length = self._lengths[slot]
+        block = self._data[slot, : max(length, 0)].copy()
+        self._read_index += 1
+        self._free.release()
+        if length < 0:
+            raise EOFError
+        return block
+
+    def close(self, unlink=False):
+        """Release the shared memory, also remove it if unlink is True."""
+        self._lengths = self._data = None
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+
+
+class SharedRingSource(ac.SamplesGenerator):
+    """
+    Yields the blocks written to a :class:`SharedRing` by another process.
+
+    The blocks are re-blocked to num samples.
+    """
+
+    #: :class:`SharedRing` that holds the blocks.
+    ring = Instance(SharedRing)
+
+    #: Sampling frequency of the data.
+    sample_freq = Float(1.0, desc="sampling frequency")
+
+    #: Number of channels of the data.
+    num_channels = Int(1, desc="number of channels")
+
+    # internal identifier
+    digest = Property(depends_on=["sample_freq", "num_channels", "num_samples"])
+
+    @cached_property
+    def _get_digest(self):
+        return ac.internal.digest(self)
+
+    def result(self, num):
+        """
+        Python generator that yields the blocks from the ring.
+
+        Parameters
+        ----------
+        num : integer
+            This parameter defines the size of the blocks to be yielded
+            (i.e. the number of samples per block).
+
+        Returns
+        -------
+        Samples in blocks of shape (num, :attr:`num_channels`).
+            The last block may be shorter than num.
+        """
+        parent = mp.parent_process()
+        parts = []
+        filled = 0
+        while True:
+            try:
+                block = self.ring.get(timeout=0.1)
+            except EOFError:
+                break
+            if block is None:
+                if parent is not None and not parent.is_alive():
+                    return
+                continue
+            parts.append(block)
+            filled += block.shape[0]
+            if filled >= num:
+                data = np.concatenate(parts) if len(parts) > 1 else parts[0]
+                end = filled - filled % num
+                for start in range(0, end, num):
+                    yield data[start : start + num]
+                parts = [data[end:]]
+                filled -= end
+        if filled:
+            yield np.concatenate(parts)
+
+
+class _ChainPickler(pickle.Pickler):
+    # pickles the feed of the chain by reference
+
+    def __init__(self, file, feed):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.feed = feed
+
+    def persistent_id(self, obj):
+        return "feed" if obj is self.feed else None
+
+
+class _ChainUnpickler(pickle.Unpickler):
+    # replaces the feed of the chain by a source
+
+    def __init__(self, file, source):
+        super().__init__(file)
+        self.source = source
+
+    def persistent_load(self, pid):
+        return self.source
+
+
+def _chain_objects(obj, feed):
+    # objects of the chain from its last object to, but without, the feed
+    objects = []
+    while obj is not feed:
+        objects.append(obj)
+        obj = obj.source
+    return objects
+
+
+def _parameters(obj):
+    # trait values of a chain object that are copied with it, except for its source
+    state = obj.__getstate__()
+    for key in ("source", "__traits_version__"):
+        state.pop(key, None)
+    return state
+
+
+def _pickle_parameters(obj, feed):
+    buf = io.BytesIO()
+    _ChainPickler(buf, feed).dump(_parameters(obj))
+    return buf.getvalue()
+
+
+def _split(block, num_rows):
+    # parts of a block that fit into the slots of a ring
+    return [block[start : start + num_rows] for start in range(0, block.shape[0], num_rows)]
+
+
+def _put_while_parent_alive(ring, block=None):
+    # write to a ring of the consumer process, returns False if the parent process has ended
+    parent = mp.parent_process()
+    while not ring.put(block, timeout=0.1):
+        if parent is not None and not parent.is_alive():
+            return False
+    return True
+
+
+def _run_chain(chain_pickle, source, out_ring, num, updates, errors):
+    # entry point of the consumer process, the traceback of an error is sent to errors
+    try:
+        chain = _ChainUnpickler(io.BytesIO(chain_pickle), source).load()
+        objects = _chain_objects(chain, source)
+        for block in chain.result(num):
+            # parameter changes take effect while the chain runs, as in this process
+            while not updates.empty():
+                index, parameters = updates.get()
+                objects[index].trait_set(**_ChainUnpickler(io.BytesIO(parameters), source).load())
+            for part in _split(block, out_ring.shape[1]):
+                if not _put_while_parent_alive(out_ring, part):
+                    return
+        _put_while_parent_alive(out_ring)
+    except BaseException:
+        errors.put(traceback.format_exc())
+        raise
+    finally:
+        source.ring.close()
+        out_ring.close()
+
+
+class _ConsumerProcess:
+    # process that runs a chain and its rings
+
+    def __init__(self, consumer, num):
+        ctx = mp.get_context(consumer.start_method)
+        feed = consumer.feed
+        buf = io.BytesIO()
+        _ChainPickler(buf, feed).dump(consumer.source)
+        self.digest = consumer.source.digest
+        self.objects = _chain_objects(consumer.source, feed)
+        self.parameters = [_pickle_parameters(obj, feed) for obj in self.objects]
+        self.updates = ctx.SimpleQueue()
+        self.errors = ctx.SimpleQueue()
+        # output blocks read while waiting for a free slot of the input ring
+        self.pending = deque()
+        self.finished = False
+        self.in_ring = SharedRing(ctx, consumer.num_slots, consumer.block_size, feed.num_channels)
+        self.out_ring = SharedRing(ctx, consumer.num_slots, num, consumer.num_channels)
+        source = SharedRingSource(
+            ring=self.in_ring,
+            sample_freq=feed.sample_freq,
+            num_channels=feed.num_channels,
+            num_samples=feed.num_samples,
+        )
+        self.process = ctx.Process(
+            target=_run_chain,
+            args=(buf.getvalue(), source, self.out_ring, num, self.updates, self.errors),
+            daemon=True,
+        )
+        self.process.start()
+
+    def update(self, consumer):
+        # send the changed parameters of the chain objects to the process,
+        # returns False if the objects of the chain were replaced
+        objects = _chain_objects(consumer.source, consumer.feed)
+        if len(objects) != len(self.objects) or any(a is not b for a, b in zip(objects, self.objects)):
+            return False
+        for index, obj in enumerate(objects):
+            parameters = _pickle_parameters(obj, consumer.feed)
+            if parameters != self.parameters[index]:
+                self.parameters[index] = parameters
+                self.updates.put((index, parameters))
+        self.digest = consumer.source.digest
+        return True
+
+    def check(self):
+        # raise an error if the process has ended with one, with the traceback of the process
+        if self.process.is_alive() or self.process.exitcode == 0:
+            return
+        msg = f"consumer process ended with exit code {self.process.exitcode}"
+        if not self.errors.empty():
+            msg = f"{msg}:\n{self.errors.get()}"
+        raise OSError(msg)
+
+    def drain(self, timeout=0):
+        # move the available output blocks to pending, sets finished at the end of the output
+        try:
+            while not self.finished and (out := self.out_ring.get(timeout=timeout)) is not None:
+                self.pending.append(out)
+                timeout = 0
+        except EOFError:
+            self.finished = True
+
+    def put(self, block=None):
+        # write a block, split to the size of the slots, or, if None, the end of the data;
+        # the output is drained meanwhile, the process may wait for a free output slot
+        parts = [None] if block is None else _split(block, self.in_ring.shape[1])
+        for part in parts:
+            while not self.in_ring.put(part, timeout=0.1):
+                self.drain()
+                if not self.process.is_alive():
+                    self.check()
+                    if self.finished:
+                        return
+                    msg = "consumer process ended before the end of the data"
+                    raise OSError(msg)
+
+    def stop(self):
+        if self.process.is_alive():
+            self.in_ring.put(timeout=0.1)
+            self.process.join(1.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+        self.in_ring.close(unlink=True)
+        self.out_ring.close(unlink=True)
+        self.updates.close()
+        self.errors.close()
+
+
+class ProcessConsumer(ac.InOut):
+    """
+    Runs a processing chain in a separate process.
+
+    The blocks of :attr:`feed` are passed to the process via a
+    :class:`SharedRing` in shared memory and the results are returned the
+    same way, so that CPU-heavy processing does not compete with the
+    threads of this process for the global interpreter lock. Instead of the
+    chain, this object must be registered at :attr:`feed`.
+
+    The chain is copied to the process when :meth:`result` is called. When
+    its digest changes, the changed parameters of the chain objects are sent
+    to the running process and take effect there while the chain runs, as
+    they would in this process. Only if objects of the chain are replaced,
+    the process is restarted with a new copy. If the process falls behind, the
+    shared ring is filled up and :attr:`feed` handles the overflow according
+    to the registration of this object.
+    """
+
+    #: Last object of the processing chain, which is run in the consumer
+    #: process. Its chain of sources must end with :attr:`feed`.
+    source = Instance(ac.Generator)
+
+    #: Object that provides the blocks in this process, usually a
+    #: :class:`SampleFanOut`.
+    feed = Instance(ac.Generator)
+
+    #: Number of samples per block that is read from :attr:`feed`, defaults to 1024.
+    block_size = Int(1024, desc="number of samples per block")
+
+    #: Number of blocks that fit into the shared rings, defaults to 16.
+    num_slots = Int(16, desc="number of blocks in the shared rings")
+
+    #: Start method of the process, see :func:`multiprocessing.get_context`.
+    start_method = Str("spawn", desc="start method of the consumer process")
+
+    def result(self, num):
+        """
+        Python generator that yields the output of the chain.
+
+        Parameters
+        ----------
+        num : integer
+            Number of samples per block of the chain's output.
+
+        Returns
+        -------
+        Samples in blocks of shape (num, :attr:`num_channels`).
+        """
+        process = _ConsumerProcess(self, num)
+        try:
+            for block in self.feed.result(self.block_size):
+                if self.source.digest != process.digest and not process.update(self):
+                    process.stop()
+                    process = _ConsumerProcess(self, num)
+                process.put(block)
+                process.drain()
+                while process.pending:
+                    yield process.pending.popleft()
+                if process.finished:
+                    return
+            process.put()
+            while not process.finished:
+                # the process state is read first, so that no output written before its end is missed
+                alive = process.process.is_alive()
+                process.drain(timeout=0.1)
+                while process.pending:
+                    yield process.pending.popleft()
+                if not alive:
+                    process.check()
+                    return
+        finally:
+            process.stop()
@@ -1,7 +1,10 @@
 # ------------------------------------------------------------------------------
 # Copyright (c) Acoular Development Team.
 # ------------------------------------------------------------------------------
+from warnings import warn
+
 import acoular as ac
+import numba as nb
 import numpy as np
 from spectacoular import BaseSpectacoular
 from traits.api import (
@@ -13,12 +16,15 @@ from traits.api import (
     cached_property,
     property_depends_on,
     CArray,
+    Enum,
     Float,
+    List,
+    observe,
 )
-from .fastFuncs import calcCSMmav
+from .fastFuncs import calcCSMmavBatch, fillHermitian, packUpper
 
 
-class CSMInOut(ac.SpectraOut, BaseSpectacoular):
+class CSMInOut(ac.spectra.BaseSpectra, ac.SpectraOut, BaseSpectacoular):
     """Provides the CSM of multichannel Spectra data.
 
     Returns CSM for every block over a Generator.
@@ -55,17 +61,67 @@ class CSMInOut(ac.SpectraOut, BaseSpectacoular):
     #: between :attr:`ind_low` and :attr:`ind_high` within the result, readonly.
     indices = Property(desc="index range")
 
+    #: Width of the frequency bands: 0 (default) yields the CSM of all
+    #: frequency lines, n > 0 yields the CSM summed over 1/n octave bands. In
+    #: this case, the FFT and the CSM are only computed for the frequency lines
+    #: inside the bands.
     band_width = Int(0)
 
+    #: Band center frequency, used if :attr:`band_width` > 0 and
+    #: :attr:`center_freqs` is empty.
     center_freq = Float(0)
 
+    #: Center frequencies of several bands that are tracked at once if
+    #: :attr:`band_width` > 0. If empty (default), :attr:`center_freq` is used.
+    center_freqs = List(Float, desc="band center frequencies")
+
     # SPL time weighting : SLOW: 1.0, FAST: 0.125 (default), arbitrary values possible
     weight_time = Float(0.125)
 
     #: Flag, if tru (default), current csm will be calculated with cumulated average of past CSMs
     accumulate = Bool(False, desc="CSM accumulation flag")
 
-    @property_depends_on("block_size, ind_low, ind_high, band_width")
+    #: Number of threads used to update the CSM, defaults to 0 (numba's
+    #: current setting, see :func:`numba.get_num_threads`).
+    num_threads = Int(0, desc="number of threads used to update the CSM")
+
+    #: Format of the yielded CSM: "full" yields blocks of shape
+    #: (numfreq, num_channels, num_channels), "packed" yields only the upper
+    #: triangular matrix (including the main diagonal) row by row in blocks
+    #: of shape (numfreq, num_channels*(num_channels+1)/2), in the order of
+    #: :func:`numpy.triu_indices`. Note that the yielded blocks are written to
+    #: preallocated buffers which are overwritten by the next block.
+    csm_format = Enum("full", "packed", desc="format of the yielded CSM")
+
+    # internal identifier
+    digest = Property(
+        depends_on=[
+            "source.digest",
+            "csm_format",
+            "precision",
+            "block_size",
+            "window",
+            "band_width",
+            "center_freq",
+            "center_freqs",
+            "weight_time",
+            "accumulate",
+        ],
+    )
+
+    # incremented if the bands change, running result generators then recompute their frequency lines
+    _bands_version = Int(0)
+
+    @cached_property
+    def _get_digest(self):
+        return ac.internal.digest(self)
+
+    @observe("band_width, center_freq, center_freqs, center_freqs:items")
+    def _update_bands_version(self, event):
+        del event
+        self._bands_version += 1
+
+    @property_depends_on("block_size, ind_low, ind_high, band_width, center_freqs")
     def _get_indices(self):
         try:
             if self.band_width == 0:
@@ -73,10 +129,48 @@ class CSMInOut(ac.SpectraOut, BaseSpectacoular):
                     self.ind_low : self.ind_high
                 ]
             else:
-                return np.array([0])
+                return np.arange(len(self.band_centers()))
         except IndexError:
             return range(0)
 
+    def band_centers(self):
+        """Return the center frequencies of the bands, see :attr:`center_freqs`."""
+        return np.array(self.center_freqs or [self.center_freq])
+
+    def band_lines(self):
+        """
+        Return the frequency lines inside the bands.
+
+        The band edges follow :func:`acoular.tools.helpers.synthetic`.
+
+        Returns
+        -------
+        lines : ndarray
+            Sorted indices of all frequency lines inside the bands.
+        bounds : ndarray
+            Array of shape (number of bands, 2), each band covers
+            lines[bounds[i, 0] : bounds[i, 1]].
+        """
+        centers = self.band_centers()
+        freqs = self.fftfreq_fine()
+        ind1 = np.searchsorted(freqs, centers * 2.0 ** (-0.5 / self.band_width))
+        ind2 = np.searchsorted(freqs, centers * 2.0 ** (0.5 / self.band_width))
+        for f, i1, i2 in zip(centers, ind1, ind2):
+            if i1 == i2:
+                warn(
+                    f"Queried frequency band around {f:g} Hz does not include any "
+                    "discrete FFT sample frequencies. Returning zeros.",
+                    Warning,
+                    stacklevel=2,
+                )
+        lines = np.unique(
+            np.concatenate([np.arange(i1, i2) for i1, i2 in zip(ind1, ind2)])
+        ).astype(int)
+        bounds = np.stack(
+            [np.searchsorted(lines, ind1), np.searchsorted(lines, ind2)], axis=1
+        )
+        return lines, bounds
+
     def fftfreq_fine(self):
         return abs(
             np.fft.fftfreq(self.block_size, 1.0 / self.sample_freq)[
@@ -96,7 +190,7 @@ class CSMInOut(ac.SpectraOut, BaseSpectacoular):
         if self.band_width == 0:
             return self.fftfreq_fine()
         else:
-            return np.array([self.center_freq])
+            return self.band_centers()
 
     def result(self, num=1):
         """
@@ -111,50 +205,92 @@ class CSMInOut(ac.SpectraOut, BaseSpectacoular):
 
         Returns
         -------
-        Samples in blocks of shape (numfreq, :attr:`num_channels`,:attr:`num_channels`).
-            The last block may be shorter than num.
+        Samples in blocks of shape (numfreq, :attr:`num_channels`,:attr:`num_channels`)
+            or (numfreq, :attr:`num_channels`*(:attr:`num_channels`+1)/2), see
+            :attr:`csm_format`. The blocks are overwritten by the next block.
+            If the bands change while the generator runs, the frequency lines
+            and buffers are recomputed with the next FFT block and the
+            average of the CSM starts anew.
         """
         bs = self.block_size
         block_sample_freq = self.sample_freq / bs
-        # init csm
-        numfreq = bs // 2 + 1
-        csm_shape = (numfreq, self.source.num_channels, self.source.num_channels)
-        csmBlock = np.zeros(csm_shape, dtype=self.precision)
+        nc = self.source.num_channels
         # calc the weight function
-        wind = self.window_(bs)
-        block_weight = np.dot(wind, wind)
-        wind = wind[:, np.newaxis]
-        # upper diagonal
-        csmUpper = np.zeros(csm_shape, dtype=self.precision)
-        # dsm dummy needed for single band workaround
+        window = self.window_(bs)
+        block_weight = np.dot(window, window)
+        scale = 2.0 / bs / block_weight
+
+        def setup():
+            # frequency lines and buffers of the current bands
+            version = self._bands_version
+            band_width = self.band_width
+            lines = bounds = dft = None
+            wind = window[:, np.newaxis]
+            if band_width == 0:
+                numfreq = bs // 2 + 1
+                numout = numfreq
+            else:
+                # only the frequency lines inside the bands are computed
+                lines, bounds = self.band_lines()
+                numfreq = lines.size
+                numout = bounds.shape[0]
+                if numfreq < np.log2(bs):
+                    # direct DFT of the few lines is cheaper than the FFT
+                    dft = (
+                        np.exp(-2j * np.pi * np.outer(lines, np.arange(bs)) / bs) * window
+                    ).astype(self.precision)
+            # preallocated output
+            if self.csm_format == "packed":
+                csmBlock = np.zeros((numout, nc * (nc + 1) // 2), dtype=self.precision)
+            else:
+                csmBlock = np.zeros((numout, nc, nc), dtype=self.precision)
+            # upper diagonal
+            csmUpper = np.zeros((numfreq, nc, nc), dtype=self.precision)
+            csmBands = np.zeros((numout, nc, nc), dtype=self.precision) if band_width > 0 else None
+            # spectra of the blocks that are added to the csm with the next update
+            ftBlocks = np.empty((num, numfreq, nc), dtype=self.precision)
+            return version, band_width, lines, bounds, dft, wind, csmBlock, csmUpper, csmBands, ftBlocks
+
+        version, band_width, lines, bounds, dft, wind, csmBlock, csmUpper, csmBands, ftBlocks = setup()
         block = 0
         alpha = 1.0  # initial value
         numblocks = 1  # num
+        if self.num_threads > 0:
+            nb.set_num_threads(min(self.num_threads, nb.config.NUMBA_NUM_THREADS))
         for temp in self.source.result(bs):
-            ft = np.fft.rfft(temp * wind, None, 0).astype(self.precision)
-            # calc csm
-            calcCSMmav(csmUpper, ft, alpha)  # calcCSM(csmUpper, ft)
+            if temp.shape[0] < bs:
+                break  # incomplete last block
+            if self._bands_version != version:
+                version, band_width, lines, bounds, dft, wind, csmBlock, csmUpper, csmBands, ftBlocks = setup()
+                # blocks of the old lines are discarded, the average starts anew
+                block -= block % num
+                alpha = 1.0
+                numblocks = 1
+            if band_width == 0:
+                ftBlocks[block % num] = np.fft.rfft(temp * wind, None, 0)
+            elif dft is not None:
+                np.matmul(dft, temp, out=ftBlocks[block % num])
+            else:
+                ftBlocks[block % num] = np.fft.rfft(temp * wind, None, 0)[lines]
 
             block += 1
 
             if block % num == 0:
-                # put together
-                csmLower = csmUpper.conj().transpose(0, 2, 1)
-                [
-                    np.fill_diagonal(csmLower[cntFreq, :, :], 0)
-                    for cntFreq in range(csmLower.shape[0])
-                ]
-                # fill csm
-                csmBlock = csmLower + csmUpper
-                if self.band_width == 0:
-                    yield csmBlock * (2.0 / bs / block_weight)
+                # calc csm, all blocks since the last yield share the same weighting
+                calcCSMmavBatch(csmUpper, ftBlocks, alpha)
+                if band_width > 0:
+                    # sum up the lines of each band
+                    for cntBand, (i1, i2) in enumerate(bounds):
+                        np.sum(csmUpper[i1:i2], axis=0, out=csmBands[cntBand])
+                    csmOut = csmBands
+                else:
+                    csmOut = csmUpper
+                # put together and scale without temporaries
+                if self.csm_format == "packed":
+                    packUpper(csmOut, csmBlock, scale)
                 else:
-                    yield ac.synthetic(
-                        csmBlock * (2.0 / bs / block_weight),
-                        self.fftfreq_fine(),
-                        self.center_freq,
-                        self.band_width,
-                    )
+                    fillHermitian(csmOut, csmBlock, scale)
+                yield csmBlock
                 if self.accumulate:
                     numblocks += num
                     alpha = 1.0 / numblocks
@@ -2,11 +2,15 @@
 # Copyright (c) Acoular Development Team.
 # ------------------------------------------------------------------------------
 
+from concurrent.futures import ThreadPoolExecutor
+
 import acoular as ac
+import numpy as np
 
 # imports from other packages
-from traits.api import Property, Trait, Bool, cached_property, Instance
+from traits.api import Property, Trait, Bool, cached_property, Instance, Int
 
+from .fastFuncs import delayAndSum, unpackHermitian
 from .spectra import CSMInOut, PowerSpectraSetCSM
 
 
@@ -22,6 +26,13 @@ class BeamformerFreqTime(ac.BeamformerTime, ac.TimeOut):
     #: Boolean flag, if 'True' (default), the main diagonal is removed before beamforming.
     r_diag = Bool(True, desc="removal of diagonal")
 
+    #: Boolean flag, if 'True' (default) and :attr:`beamformer` is a plain
+    #: :class:`~acoular.fbeamform.BeamformerBase`, the steering vectors of the
+    #: active frequencies are computed once per call of :meth:`result` and
+    #: every block is beamformed with one batched matrix product. Otherwise,
+    #: the CSM of every block is passed to :attr:`beamformer`.
+    streaming = Bool(True, desc="batched beamforming with precomputed steering vectors")
+
     #: :class:`~acoular.spectra.CSMInOut` object that provides the time-dependent
     #: cross spectral matrix and eigenvalues
     source = Trait(CSMInOut, desc="freq data object")
@@ -35,6 +46,43 @@ class BeamformerFreqTime(ac.BeamformerTime, ac.TimeOut):
     def _get_digest(self):
         return ac.internal.digest(self)
 
+    def _streaming_result(self, num):
+        bf = self.beamformer
+        freqs = self.source.fftfreq()
+        indices = np.asarray(self.source.indices)
+        # steering vectors of the active frequencies, shape (nfreqs, ngrid, nmics)
+        steer = np.array([bf.steer.steer_vector(f) for f in freqs[indices]])
+        steerConj = steer.conj()
+        nMics = steer.shape[2]
+        if not bf.r_diag:
+            normfactor = 1.0
+        elif bf.r_diag_norm == 0.0:
+            normfactor = nMics / (nMics - 1)
+        else:
+            normfactor = bf.r_diag_norm
+        # preallocated buffers
+        csmActive = np.empty((indices.size, nMics, nMics), dtype=complex)
+        prod = np.empty(steer.shape, dtype=complex)
+        diag = np.arange(nMics)
+        res = np.zeros((freqs.size, steer.shape[1]))
+        for csm in self.source.result(num):
+            if csm.ndim == 2:
+                # packed upper triangular CSM, see CSMInOut.csm_format
+                unpackHermitian(
+                    np.ascontiguousarray(csm[indices], dtype=complex), csmActive
+                )
+            else:
+                csmActive[:] = csm[indices]
+            if bf.r_diag:
+                csmActive[:, diag, diag] = 0.0
+            # h^H C h for all grid points and frequencies
+            np.matmul(steerConj, csmActive, out=prod)
+            prod *= steer
+            res[indices] = prod.sum(2).real * normfactor
+            if bf.r_diag:  # set (unphysical) negative output values to 0
+                np.maximum(res, 0.0, out=res)
+            yield res
+
     def result(self, num=1):
         """
         Python generator that yields the beamformer output block-wise.
@@ -50,7 +98,13 @@ class BeamformerFreqTime(ac.BeamformerTime, ac.TimeOut):
         Samples in blocks of shape (1, :attr:`num_channels`).
             :attr:`num_channels` is usually very large.
             The last block may be shorter than num.
+            With :attr:`streaming`, only the active frequencies of
+            :attr:`source` are computed and the yielded array is
+            overwritten by the next block.
         """
+        if self.streaming and type(self.beamformer) is ac.BeamformerBase:
+            yield from self._streaming_result(num)
+            return
         fdata = PowerSpectraSetCSM(
             block_size=self.source.block_size,
             sample_freq=self.source.sample_freq,
@@ -61,7 +115,175 @@ class BeamformerFreqTime(ac.BeamformerTime, ac.TimeOut):
         # self.beamformer.steer = self.steer
         # self.beamformer.r_diag = self.r_diag
         for csm in self.source.result(num):
-            fdata.csm = csm
+            if csm.ndim == 2:
+                # packed upper triangular CSM, see CSMInOut.csm_format
+                nc = int((np.sqrt(8 * csm.shape[1] + 1) - 1) / 2)
+                fdata.csm = unpackHermitian(
+                    csm, np.empty((csm.shape[0], nc, nc), dtype=csm.dtype)
+                )
+            else:
+                # copy, as the source reuses its output buffer
+                fdata.csm = csm.copy()
             fdata._fftfreq = self.source.fftfreq()
             fdata.indices = self.source.indices
             yield self.beamformer.result
+
+
+def _steer_amplitudes(steer_type, rm, r0):
+    """
+    Return the amplitudes of the time-domain steering vectors.
+
+    Parameters
+    ----------
+    steer_type : str
+        :attr:`~acoular.fbeamform.SteeringVector.steer_type`.
+    rm : ndarray
+        Distances of shape (number of grid points, number of mics).
+    r0 : ndarray
+        Distances of the grid points to the reference position.
+
+    Returns
+    -------
+    ndarray of shape (number of grid points, number of mics).
+    """
+    num_mics = rm.shape[1]
+    if steer_type == "classic":
+        return np.full(rm.shape, 1.0 / num_mics)
+    if steer_type == "inverse":
+        return rm / (r0[:, np.newaxis] * num_mics)
+    rm2 = (1.0 / rm**2).sum(1)[:, np.newaxis]
+    if steer_type == "true level":
+        return 1.0 / (rm * r0[:, np.newaxis] * rm2)
+    # true location
+    return np.sqrt(1.0 / num_mics) / (rm * np.sqrt(rm2))
+
+
+class BeamformerTimeStream(ac.TimeOut):
+    """
+    Provides a streaming time domain delay-and-sum beamformer with time signal
+    output for a spatially fixed grid.
+
+    Gives the same output as :class:`~acoular.tbeamform.BeamformerTime`
+    (without spatial weighting), but is tailored to live processing: integer
+    and fractional delay tables of the grid are computed once per call of
+    :meth:`result`, the incoming blocks are kept in a rolling history buffer
+    and the delay-and-sum is computed in single precision, optionally in
+    parallel threads over chunks of grid points.
+    """
+
+    #: Data source; :class:`~acoular.base.SamplesGenerator` or derived object.
+    source = Instance(ac.SamplesGenerator)
+
+    #: :class:`~acoular.fbeamform.SteeringVector` object that provides the
+    #: grid, the microphone geometry and the steering vector type.
+    steer = Instance(ac.SteeringVector, args=())
+
+    #: Number of output channels (= number of grid points).
+    num_channels = Property()
+
+    #: Number of threads that process chunks of grid points, defaults to 1.
+    num_workers = Int(1, desc="number of threads")
+
+    #: Number of grid points processed per task if :attr:`num_workers` > 1.
+    grid_chunk_size = Int(256, desc="number of grid points per task")
+
+    # internal identifier
+    digest = Property(
+        depends_on=["steer.digest", "source.digest"],
+    )
+
+    def _get_num_channels(self):
+        return self.steer.grid.size
+
+    @cached_property
+    def _get_digest(self):
+        return ac.internal.digest(self)
+
+    def delay_tables(self):
+        """
+        Return the delay tables of the grid.
+
+        Returns
+        -------
+        offsets : ndarray of int64
+            Integer delays in samples of shape (number of grid points, number of mics).
+        weights0, weights1 : ndarray of float32
+            Weights of the samples at the integer delays and of the next
+            samples, i.e. the amplitudes of the steering vector times
+            (1 - fractional delay) and times the fractional delay.
+        """
+        rm = self.steer.rm
+        delays = rm * (self.source.sample_freq / self.steer.env.c)
+        offsets = delays.astype(np.int64)
+        frac = delays - offsets
+        amp = _steer_amplitudes(self.steer.steer_type, rm, self.steer.r0)
+        weights0 = np.ascontiguousarray(amp * (1.0 - frac), dtype=np.float32)
+        weights1 = np.ascontiguousarray(amp * frac, dtype=np.float32)
+        return offsets, weights0, weights1
+
+    def result(self, num=2048):
+        """
+        Python generator that yields the time-domain beamformer output.
+
+        The output time signal starts for source signals that were emitted from
+        the grid at t=0.
+
+        Parameters
+        ----------
+        num : integer, defaults to 2048
+            This parameter defines the size of the blocks to be yielded
+            (i.e. the number of samples per block).
+
+        Returns
+        -------
+        Samples in blocks of shape (num, :attr:`num_channels`) and dtype float32.
+            :attr:`num_channels` is usually very large.
+            The last block may be shorter than num. The blocks are
+            transposed views of grid-major arrays.
+        """
+        offsets, weights0, weights1 = self.delay_tables()
+        nMics = offsets.shape[1]
+        ngrid = offsets.shape[0]
+        # history samples needed beyond the current block
+        maxDelay = int(offsets.max()) + 2
+        history = np.zeros((nMics, 2 * num + maxDelay), dtype=np.float32)
+        filled = 0
+        chunks = [
+            (g, min(g + self.grid_chunk_size, ngrid))
+            for g in range(0, ngrid, self.grid_chunk_size)
+        ]
+        pool = ThreadPoolExecutor(self.num_workers) if self.num_workers > 1 else None
+
+        def process(nout):
+            # grid-major output, yielded as a transposed view without copying
+            outBlock = np.empty((ngrid, nout), dtype=np.float32)
+            if pool is None:
+                delayAndSum(history, offsets, weights0, weights1, outBlock, 0, ngrid)
+            else:
+                for future in [
+                    pool.submit(
+                        delayAndSum, history, offsets, weights0, weights1, outBlock, g0, g1
+                    )
+                    for g0, g1 in chunks
+                ]:
+                    future.result()
+            return outBlock.T
+
+        try:
+            for block in self.source.result(num):
+                # sources may yield blocks larger than num, the history holds at most num new samples
+                for start in range(0, block.shape[0], num):
+                    part = block[start : start + num]
+                    ns = part.shape[0]
+                    history[:, filled : filled + ns] = part.T
+                    filled += ns
+                    if filled >= num + maxDelay:
+                        yield process(num)
+                        # keep the samples that are needed for the next block
+                        history[:, : filled - num] = history[:, num:filled]
+                        filled -= num
+            if filled > maxDelay:  # last block shorter
+                yield process(filled - maxDelay)
+        finally:
+            if pool is not None:
+                pool.shutdown()
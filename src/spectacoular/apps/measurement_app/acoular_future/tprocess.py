@@ -0,0 +1,447 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Acoular Development Team.
+# ------------------------------------------------------------------------------
+
+import json
+import os
+from datetime import datetime, timedelta
+from functools import partial
+from pathlib import Path
+from queue import Queue
+from threading import Thread
+from time import perf_counter
+
+import acoular as ac
+import numpy as np
+from acoular import h5files
+from traits.api import Bool, Enum, Float, Int, List, Range
+
+#: Compression libraries of the HDF5 backends, by :attr:`WriteH5Batched.compression`.
+COMPRESSION_LIBRARIES = {
+    "pytables": {"zlib": "zlib", "blosc": "blosc:lz4"},
+    "h5py": {"zlib": "gzip"},
+}
+
+
+def _h5library():
+    # HDF5 backend configured in acoular, 'tables' is an alias of 'pytables'
+    return "h5py" if ac.config.h5library == "h5py" else "pytables"
+
+
+def _h5file_class():
+    # file class of the configured backend, as used by ac.WriteH5
+    return h5files.H5FileH5py if _h5library() == "h5py" else h5files.H5FileTables
+
+
+class _BatchWriter:
+    # collects samples in two buffers and appends full buffers to
+    # self.node of self.f5h in a background thread
+
+    def __init__(self, batch_size, num_channels, dtype):
+        self.buffers = [np.empty((batch_size, num_channels), dtype=dtype) for _ in range(2)]
+        self.f5h = self.node = None
+        self.errors = []
+        self.bytes_written = 0
+        self.write_time = 0.0
+        self._free = Queue()  # indices of buffers that can be filled
+        self._full = Queue()  # (index, number of samples) of buffers to be written, or tasks
+        for i in range(len(self.buffers)):
+            self._free.put(i)
+        self._current, self._filled = self._free.get(), 0
+        self._thread = Thread(target=self._run, name="BatchWriter")
+        self._thread.start()
+
+    @property
+    def throughput(self):
+        # sustained write rate in MB/s
+        return self.bytes_written / self.write_time / 1e6 if self.write_time > 0 else 0.0
+
+    def _run(self):
+        while (item := self._full.get()) is not None:
+            if self.errors:  # skip everything after an error
+                if not callable(item):
+                    self._free.put(item[0])
+                continue
+            try:
+                if callable(item):
+                    item()
+                else:
+                    i, count = item
+                    t0 = perf_counter()
+                    self.f5h.append_data(self.node, self.buffers[i][:count])
+                    self.f5h.flush()
+                    self.write_time += perf_counter() - t0
+                    self.bytes_written += self.buffers[i][:count].nbytes
+                    self._free.put(i)
+            except Exception as error:  # noqa: BLE001
+                self.errors.append(error)
+                if not callable(item):
+                    self._free.put(item[0])
+
+    def add(self, data):
+        """Copy data to the buffers, wait for a free buffer if both are full."""
+        if self.errors:
+            raise self.errors[0]
+        batch_size = self.buffers[0].shape[0]
+        pos = 0
+        while pos < data.shape[0]:
+            count = min(data.shape[0] - pos, batch_size - self._filled)
+            self.buffers[self._current][self._filled : self._filled + count] = data[pos : pos + count]
+            self._filled += count
+            pos += count
+            if self._filled == batch_size:
+                self.flush()
+
+    def flush(self):
+        """Hand the current buffer to the writer thread, even if not full."""
+        if self._filled > 0:
+            self._full.put((self._current, self._filled))
+            self._current, self._filled = self._free.get(), 0
+
+    def call(self, func):
+        """Call func in the writer thread after all data added so far is written."""
+        self.flush()
+        self._full.put(func)
+
+    def close(self):
+        """Write the remaining data and stop the writer thread."""
+        self.flush()
+        self._full.put(None)
+        self._thread.join()
+
+
+class WriteH5Batched(ac.WriteH5):
+    """
+    Saves time signal data as a ``.h5`` (HDF5) file in large batches.
+
+    Unlike :class:`~acoular.tprocess.WriteH5`, which appends every block to the
+    file, the blocks are collected in one of two preallocated buffers of
+    :attr:`batch_size` samples. A full buffer is written by a background
+    thread in one piece, aligned to the HDF5 chunks, while the other buffer is
+    filled. The source only waits for the disk if both buffers are full.
+    """
+
+    #: Number of samples per HDF5 chunk, 0 (default) gives chunks of about 1 MiB.
+    chunk_size = Int(0, desc="number of samples per HDF5 chunk")
+
+    #: Number of samples written at once, rounded up to a multiple of the
+    #: chunk size, defaults to 2**16.
+    batch_size = Int(2**16, desc="number of samples per write")
+
+    #: Compression of the data: "none" (default, fastest), "zlib" or
+    #: "blosc" (PyTables only).
+    compression = Enum("none", "zlib", "blosc", desc="compression of the data")
+
+    #: Compression level, defaults to 1.
+    compression_level = Range(1, 9, 1, desc="compression level")
+
+    #: Number of bytes written by the last call of :meth:`result`, readonly.
+    bytes_written = Int(0, desc="number of bytes written")
+
+    #: Sustained write rate in MB/s of the last call of :meth:`result`
+    #: (bytes written divided by the time spent writing), readonly.
+    throughput = Float(0.0, desc="write rate in MB/s")
+
+    def get_chunk_size(self):
+        """Return the number of samples per HDF5 chunk."""
+        if self.chunk_size > 0:
+            return self.chunk_size
+        bytes_per_sample = self.num_channels * np.dtype(self.precision).itemsize
+        return int(2 ** max(0, round(np.log2(2**20 / bytes_per_sample))))
+
+    def get_batch_size(self):
+        """Return the number of samples per write, a multiple of the chunk size."""
+        chunk_size = self.get_chunk_size()
+        return max(1, -(-self.batch_size // chunk_size)) * chunk_size
+
+    def _create_time_data(self, f5h):
+        chunkshape = (self.get_chunk_size(), self.num_channels)
+        library = _h5library()
+        complib = None
+        if self.compression != "none":
+            complib = COMPRESSION_LIBRARIES[library].get(self.compression)
+            if complib is None:
+                msg = f"compression {self.compression} is not available with {library}"
+                raise ValueError(msg)
+        if library == "h5py":
+            f5h.create_dataset(
+                "time_data",
+                shape=(0, self.num_channels),
+                maxshape=(None, self.num_channels),
+                dtype=self.precision,
+                chunks=chunkshape,
+                compression=complib,
+                compression_opts=self.compression_level if complib else None,
+            )
+        else:
+            import tables
+
+            filters = None
+            if complib is not None:
+                filters = tables.Filters(complevel=self.compression_level, complib=complib)
+            f5h.create_earray(
+                f5h.root,
+                "time_data",
+                tables.Atom.from_dtype(np.dtype(self.precision)),
+                (0, self.num_channels),
+                filters=filters,
+                chunkshape=chunkshape,
+            )
+
+    def _open_file(self, name):
+        f5h = _h5file_class()(name, mode="w")
+        self._create_time_data(f5h)
+        node = f5h.get_data_by_reference("time_data")
+        f5h.set_node_attribute(node, "sample_freq", self.sample_freq)
+        self.add_metadata(f5h)
+        return f5h
+
+    def get_initialized_file(self):
+        """
+        Initialize the HDF5 file with a chunked (and compressed) array.
+
+        Returns
+        -------
+        :class:`h5py.File` or :class:`tables.File`
+            The initialized HDF5 file object ready for data insertion.
+        """
+        self.create_filename()
+        return self._open_file(self.file)
+
+    def _update_stats(self, writer):
+        self.bytes_written = writer.bytes_written
+        self.throughput = writer.throughput
+
+    def result(self, num):
+        """
+        Python generator that saves source output to an HDF5 file.
+
+        Parameters
+        ----------
+        num : integer
+            Number of samples per block.
+
+        Returns
+        -------
+        Samples in blocks of shape (num, :attr:`num_channels`), after they
+            are copied to the write buffer. The last block may be shorter than num.
+        """
+        self.write_flag = True
+        self.bytes_written = 0
+        self.throughput = 0.0
+        writer = _BatchWriter(self.get_batch_size(), self.num_channels, self.precision)
+        try:
+            writer.f5h = self.get_initialized_file()
+            writer.node = writer.f5h.get_data_by_reference("time_data")
+            scount = 0
+            stotal = self.num_samples_write
+            for data in self.source.result(num):
+                if not self.write_flag:
+                    break
+                anz = data.shape[0] if stotal == -1 else min(data.shape[0], stotal - scount)
+                writer.add(data[:anz])
+                self._update_stats(writer)
+                yield data
+                scount += anz
+                if stotal != -1 and scount >= stotal:
+                    break
+        finally:
+            # also writes the remaining samples if the generator is closed early
+            writer.close()
+            if writer.f5h is not None:
+                writer.f5h.close()
+            self._update_stats(writer)
+        if writer.errors:
+            raise writer.errors[0]
+
+
+class WriteH5Segmented(WriteH5Batched):
+    """
+    Saves time signal data as a series of ``.h5`` (HDF5) files.
+
+    A new file (segment) is started after :attr:`segment_duration` seconds or
+    :attr:`segment_bytes` bytes of data. Blocks crossing the limit are split,
+    so that no samples are lost at the boundaries. Recording can be paused
+    and resumed via :attr:`paused`; every resume starts a new segment, so
+    that each file holds contiguous data. The segments are named after
+    :attr:`~acoular.tprocess.WriteH5.file` with a running number and listed in
+    a JSON index file next to them, see :meth:`get_index_file` and
+    :func:`find_segments`.
+
+    Without a segment limit, the data is written to
+    :attr:`~acoular.tprocess.WriteH5.file` itself as by
+    :class:`WriteH5Batched` and no index is written, unless a resume after a
+    pause starts further segments.
+    """
+
+    #: Maximum duration of a segment in seconds, 0 (default): unlimited.
+    segment_duration = Float(0.0, desc="maximum duration of a segment in s")
+
+    #: Maximum size of the data of a segment in bytes, 0 (default): unlimited.
+    segment_bytes = Int(0, desc="maximum data size of a segment in bytes")
+
+    #: If True, the incoming data is discarded instead of written.
+    paused = Bool(False, desc="pause flag")
+
+    #: Entries of the finished segments of the last call of :meth:`result`, readonly.
+    segments = List(desc="finished segments")
+
+    def get_segment_size(self):
+        """Return the maximum number of samples per segment, 0: unlimited."""
+        sizes = []
+        if self.segment_duration > 0:
+            sizes.append(max(1, int(round(self.segment_duration * self.sample_freq))))
+        if self.segment_bytes > 0:
+            bytes_per_sample = self.num_channels * np.dtype(self.precision).itemsize
+            sizes.append(max(1, self.segment_bytes // bytes_per_sample))
+        return min(sizes, default=0)
+
+    def get_index_file(self):
+        """Return the name of the JSON index file of the segments."""
+        path = Path(self.file)
+        return str(path.with_name(f"{path.stem}_index.json"))
+
+    def get_segment_file(self, number):
+        """Return the file name of a segment, the first one is :attr:`file` if unlimited."""
+        path = Path(self.file)
+        if number == 0 and self.get_segment_size() == 0:
+            return str(path)
+        return str(path.with_name(f"{path.stem}_{number:04d}{path.suffix}"))
+
+    def _write_index(self):
+        index = {
+            "sample_freq": self.sample_freq,
+            "num_channels": self.num_channels,
+            "segments": self.segments,
+        }
+        index_file = self.get_index_file()
+        with open(index_file + ".tmp", "w") as f:
+            json.dump(index, f, indent=1)
+        os.replace(index_file + ".tmp", index_file)
+
+    def _open_segment(self, writer, name):
+        # called in the writer thread
+        writer.f5h = self._open_file(name)
+        writer.node = writer.f5h.get_data_by_reference("time_data")
+
+    def _close_segment(self, writer, entry):
+        # called in the writer thread
+        writer.f5h.close()
+        writer.f5h = writer.node = None
+        self.segments = [*self.segments, entry]
+        if self.get_segment_size() > 0 or len(self.segments) > 1:
+            self._write_index()
+
+    def result(self, num):
+        """
+        Python generator that saves source output to segmented HDF5 files.
+
+        Parameters
+        ----------
+        num : integer
+            Number of samples per block.
+
+        Returns
+        -------
+        Samples in blocks of shape (num, :attr:`num_channels`), after they
+            are copied to the write buffer (also if :attr:`paused`). The last
+            block may be shorter than num.
+        """
+        self.write_flag = True
+        self.bytes_written = 0
+        self.throughput = 0.0
+        self.segments = []
+        self.create_filename()
+        start_time = datetime.now()
+        segment_size = self.get_segment_size()
+        bytes_per_sample = self.num_channels * np.dtype(self.precision).itemsize
+        writer = _BatchWriter(self.get_batch_size(), self.num_channels, self.precision)
+        entry = None  # entry of the current segment
+        number = 0  # number of the next segment
+        total = 0  # number of samples since start, including paused ones
+
+        def end_segment():
+            entry["bytes"] = entry["num_samples"] * bytes_per_sample
+            writer.call(partial(self._close_segment, writer, entry))
+
+        try:
+            scount = 0
+            stotal = self.num_samples_write
+            for data in self.source.result(num):
+                if not self.write_flag:
+                    break
+                anz = data.shape[0] if stotal == -1 else min(data.shape[0], stotal - scount)
+                if self.paused:
+                    if entry is not None:
+                        end_segment()
+                        entry = None
+                    total += data.shape[0]
+                    yield data
+                    continue
+                pos = 0
+                while pos < anz:
+                    if entry is None:
+                        offset = timedelta(seconds=(total + pos) / self.sample_freq)
+                        name = self.get_segment_file(number)
+                        entry = {
+                            "file": Path(name).name,
+                            "start": (start_time + offset).isoformat(),
+                            "start_sample": total + pos,
+                            "num_samples": 0,
+                        }
+                        number += 1
+                        writer.call(partial(self._open_segment, writer, name))
+                    count = anz - pos
+                    if segment_size > 0:
+                        count = min(count, segment_size - entry["num_samples"])
+                    writer.add(data[pos : pos + count])
+                    entry["num_samples"] += count
+                    pos += count
+                    if entry["num_samples"] == segment_size:
+                        end_segment()
+                        entry = None
+                self._update_stats(writer)
+                yield data
+                total += data.shape[0]
+                scount += anz
+                if stotal != -1 and scount >= stotal:
+                    break
+        finally:
+            if entry is not None:
+                end_segment()
+            writer.close()
+            if writer.f5h is not None:  # after an error
+                writer.f5h.close()
+            self._update_stats(writer)
+        if writer.errors:
+            raise writer.errors[0]
+
+
+def find_segments(index_file, start=None, stop=None):
+    """
+    Return the segments of a recording that overlap a time interval.
+
+    Parameters
+    ----------
+    index_file : str
+        JSON index file written by :class:`WriteH5Segmented`.
+    start, stop : :class:`datetime.datetime`, optional
+        Begin and end of the interval, defaults to the whole recording.
+
+    Returns
+    -------
+    list of dict
+        Entries of the segments with keys "file" (full path), "start" (ISO
+        format), "start_sample", "num_samples" and "bytes".
+    """
+    with open(index_file) as f:
+        index = json.load(f)
+    directory = Path(index_file).parent
+    sample_freq = index["sample_freq"]
+    segments = []
+    for entry in index["segments"]:
+        seg_start = datetime.fromisoformat(entry["start"])
+        seg_stop = seg_start + timedelta(seconds=entry["num_samples"] / sample_freq)
+        if (start is None or seg_stop > start) and (stop is None or seg_start < stop):
+            segments.append({**entry, "file": str(directory / entry["file"])})
+    return segments
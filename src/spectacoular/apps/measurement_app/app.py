@@ -1,3 +1,5 @@
+import json
+import os
 import sys
 import acoular as ac
 import spectacoular as sp
@@ -5,6 +7,12 @@ from threading import Event
 from functools import partial
 from datetime import datetime
 from .threads import SamplesThread, EventThread
+from .acoular_future import (
+    BeamformerTimeStream,
+    ProcessConsumer,
+    SampleFanOut,
+    WriteH5Segmented,
+)
 from .layout import toggle_labels, plot_colors, button_height
 from acoular import MaskedTimeOut
 from pathlib import Path
@@ -51,19 +59,31 @@ def _get_channel_labels(source, ltype="Number"):
 
 
 class MeasurementControl:
-    def __init__(self, doc, source, logger, blocksize=1024, steer=None, cfreq=1000):
+    def __init__(
+        self,
+        doc,
+        source,
+        logger,
+        blocksize=1024,
+        steer=None,
+        cfreq=1000,
+        metrics_file=None,
+        metrics_period=1000,
+        beamforming_process=False,
+        compression="none",
+    ):
         self.modecolor = None
         self.clipcolor = None
         self.blocksize = blocksize
         self.doc = doc
         self.source = source
-        self.splitter = ac.SampleSplitter(source=self.source)
+        self.splitter = SampleFanOut(source=self.source)
         self.disp = sp.TimeOutPresenter(
             source=ac.Average(
                 source=ac.TimePower(source=self.splitter), num_per_average=blocksize
             )
         )
-        self.msm = ac.WriteH5(source=self.splitter)
+        self.msm = WriteH5Segmented(source=self.splitter, compression=compression)
         self.calib = sp.CalibHelper(
             source=ac.Average(
                 source=ac.TimePower(
@@ -73,20 +93,35 @@ class MeasurementControl:
             )
         )
         if steer is not None:
-            self.beamf = sp.TimeOutPresenter(
-                source=ac.Average(
-                    source=ac.TimePower(
-                        source=sp.FiltOctave(
-                            source=ac.BeamformerTime(
-                                source=MaskedTimeOut(source=self.splitter), steer=steer
-                            ),
-                            band=cfreq,
-                        )
-                    ),
-                    num_per_average=blocksize,
-                )
+            self.beamf_masked = MaskedTimeOut(source=self.splitter)
+            self.beamf_filter = sp.FiltOctave(
+                source=BeamformerTimeStream(
+                    source=self.beamf_masked,
+                    steer=steer,
+                    num_workers=os.cpu_count() or 1,
+                ),
+                band=cfreq,
             )
+            self.beamf_average = ac.Average(
+                source=ac.TimePower(source=self.beamf_filter),
+                num_per_average=blocksize,
+            )
+            # object registered at the splitter for beamforming
+            self.beamf_register = self.beamf_masked
+            if beamforming_process:
+                # beamforming in a separate process, fed via shared memory
+                self.beamf_register = ProcessConsumer(
+                    source=self.beamf_average,
+                    feed=self.splitter,
+                    block_size=blocksize,
+                    num_slots=4,
+                )
+                self.beamf = sp.TimeOutPresenter(source=self.beamf_register)
+            else:
+                self.beamf = sp.TimeOutPresenter(source=self.beamf_average)
         self.logger = logger
+        # consumer metrics are appended as JSON lines to this file, if given
+        self.metrics_file = metrics_file
 
         # create measurement toggle button
         self.display_toggle = Toggle(
@@ -122,6 +157,19 @@ class MeasurementControl:
         )
         # Others
         self.ti_msmtime = TextInput(value="10", title="Measurement Time [s]:")
+        self.ti_segment = TextInput(
+            value="0",
+            title="Segment Length [s]:",
+            description="Start a new file after this time, 0: one file",
+        )
+        self.pause_toggle = Toggle(
+            label=toggle_labels[("pause", False)],
+            active=False,
+            disabled=True,
+            button_type="warning",
+            sizing_mode="stretch_width",
+            height=button_height,
+        )
         self.ti_savename = TextInput(
             value="",
             title="Filename:",
@@ -139,15 +187,20 @@ class MeasurementControl:
         self.exit_button = Button(
             label="Exit", button_type="danger", sizing_mode="stretch_width"
         )
+        self.status = Div(text="", width=150)
 
         # threads
         self._disp_threads = []
         self._view_callback_id = None
+        self._samples_threads = []
+        self._reported_drops = {}
+        self.doc.add_periodic_callback(self.update_status, metrics_period)
 
         # widgets disable / enable lists depending on mode
         self.widgets_disable = {
             "msm": [
                 self.ti_msmtime,
+                self.ti_segment,
                 self.current_time_checkbox,
                 self.ti_savename,
                 self.display_toggle,
@@ -160,7 +213,7 @@ class MeasurementControl:
         }
 
         self.widgets_enable = {
-            "msm": [],
+            "msm": [self.pause_toggle],
             "display": [self.calib_toggle, self.msm_toggle, self.beamf_toggle],
             "calib": [],
             "beamf": [],
@@ -197,7 +250,7 @@ class MeasurementControl:
             self.ti_savename.disabled = True
 
     def savename_callback(self, attr, old, new):
-        self.msm.name = Path(ac.config.td_dir) / f"{new}.h5"
+        self.msm.file = str(Path(ac.config.td_dir) / f"{new}.h5")
 
     def exit_callback(arg):
         sleep(0.5)
@@ -226,7 +279,9 @@ class MeasurementControl:
                     "buffer_overflow_treatment": "none",
                 },
                 event=dispEvent,
+                name="display",
             )
+            self._samples_threads.append(amp_thread)
             self._disp_threads = [amp_thread, dispEventThread]
             for thread in self._disp_threads:
                 thread.start()
@@ -238,14 +293,30 @@ class MeasurementControl:
             self._disp_threads = []
             self.logger.info("stopped display")
 
+    def _msm_finished(self):
+        self._change_mode(self.msm_toggle, "msm", False)
+        self.pause_toggle.active = False
+        self.logger.info(
+            f"wrote {self.msm.bytes_written / 1e6:.1f} MB in "
+            f"{len(self.msm.segments)} segments ({self.msm.get_index_file()}) "
+            f"at {self.msm.throughput:.1f} MB/s"
+        )
+
+    def pausetoggle_handler(self, arg):
+        self.msm.paused = arg
+        self.pause_toggle.label = toggle_labels[("pause", arg)]
+        if self.msm_toggle.active:
+            self.logger.info("paused recording" if arg else "resumed recording")
+
     def msmtoggle_handler(self, arg):
         if arg:  # toggle button is pressed
             self.msm.num_samples_write = self.get_num_samples()
+            self.msm.segment_duration = float(self.ti_segment.value or 0)
             if self.current_time_checkbox.active == [0]:
                 self.ti_savename.value = current_time()
             msm_event = Event()
             msm_consumer = EventThread(
-                post_callback=partial(self._change_mode, self.msm_toggle, "msm", False),
+                post_callback=self._msm_finished,
                 pre_callback=partial(self._change_mode, self.msm_toggle, "msm", True),
                 doc=self.doc,
                 event=msm_event,
@@ -259,12 +330,14 @@ class MeasurementControl:
                     "buffer_overflow_treatment": "error",
                 },
                 event=msm_event,
+                name="measurement",
             )
+            self._samples_threads.append(self._msm_thread)
             self._msm_thread.start()
             msm_consumer.start()
             self.logger.info("recording...")
         if not arg:
-            self.msm.writeflag = False
+            self.msm.write_flag = False
             self._msm_thread.join()
             self.logger.info("finished recording")
 
@@ -290,7 +363,9 @@ class MeasurementControl:
                     "buffer_overflow_treatment": "none",
                 },
                 event=self._calibEvent,
+                name="calibration",
             )
+            self._samples_threads.append(self._calib_thread)
             self._calib_thread.start()
             self._calibEventThread.start()
             self.logger.info("calibrating...")
@@ -316,10 +391,12 @@ class MeasurementControl:
             self._bf_thread = SamplesThread(
                 gen=self.beamf.result(1),
                 splitter=self.splitter,
-                register=self.beamf.source.source.source.source.source,
+                register=self.beamf_register,
                 register_args={"buffer_size": 1, "buffer_overflow_treatment": "none"},
                 event=self._beamfEvent,
+                name="beamforming",
             )
+            self._samples_threads.append(self._bf_thread)
             self._bf_thread.start()
             self._beamfEventThread.start()
             self.logger.info("Beamforming...")
@@ -329,6 +406,47 @@ class MeasurementControl:
             self._beamfEventThread.join()
             self.logger.info("stopped beamforming")
 
+    def update_status(self):
+        """Show, log and export the metrics of the running consumer threads."""
+        lines = []
+        records = []
+        for thread in list(self._samples_threads):
+            if thread.ident is None:  # not started yet
+                continue
+            metrics = thread.metrics()
+            records.append(metrics)
+            name = metrics["name"]
+            dropped = metrics["dropped"] - self._reported_drops.get(thread, 0)
+            if dropped > 0:
+                self.logger.warning(f"{name}: dropped {dropped} blocks")
+                self._reported_drops[thread] = metrics["dropped"]
+            if thread.is_alive():
+                lines.append(
+                    f"{name}: {metrics['blocks_per_second']:.1f} blocks/s, "
+                    f"queue {metrics['queue_depth']}, "
+                    f"max lag {metrics['max_lag']} samples, "
+                    f"dropped {metrics['dropped']}"
+                )
+                continue
+            # finished
+            self._samples_threads.remove(thread)
+            self._reported_drops.pop(thread, None)
+            if thread.error is not None:
+                self.logger.error(f"{name}: {thread.error}")
+            elapsed = metrics["elapsed"]
+            self.logger.info(
+                f"{name}: {metrics['blocks']} blocks in {elapsed:.1f} s, "
+                f"max queue {metrics['max_queue_depth']} blocks "
+                f"({metrics['max_lag']} samples), dropped {metrics['dropped']}, "
+                f"overflowed {metrics['overflowed']}"
+            )
+        self.status.text = "<br>".join(lines)
+        if self.metrics_file and records:
+            time = datetime.now().isoformat()
+            with open(self.metrics_file, "a") as f:
+                for metrics in records:
+                    f.write(json.dumps({"time": time, **metrics}) + "\n")
+
     def get_widgets(self):
         return column(
             [
@@ -337,17 +455,21 @@ class MeasurementControl:
                 self.ti_savename,
                 self.current_time_checkbox,
                 self.ti_msmtime,
+                self.ti_segment,
                 self.display_toggle,
                 self.calib_toggle,
                 self.beamf_toggle,
                 self.msm_toggle,
+                self.pause_toggle,
                 self.update_period,
+                self.status,
             ],
             width=150,
         )
 
     def set_callbacks(self):
         self.msm_toggle.on_click(self.msmtoggle_handler)
+        self.pause_toggle.on_click(self.pausetoggle_handler)
         self.display_toggle.on_click(self.displaytoggle_handler)
         self.calib_toggle.on_click(self.calibtoggle_handler)
         self.beamf_toggle.on_click(self.beamftoggle_handler)
@@ -372,6 +494,7 @@ class PhantomControl(MeasurementControl):
         self,
         h5path=Path(__file__).parent / "data",
         initial_file="rotating.h5",
+        speed=1.0,
         **kwargs,
     ):
         self.sfreq = 25600
@@ -383,7 +506,8 @@ class PhantomControl(MeasurementControl):
         if not h5path.exists():
             h5path.mkdir()
         self.h5path = h5path
-        kwargs["source"] = sp.TimeSamplesPhantom()
+        kwargs["source"] = sp.TimeSamplesPhantom(speed=speed, prefetch=4)
+        self._reported_misses = 0
         super().__init__(**kwargs)
 
         self.select_file = Select(
@@ -407,6 +531,23 @@ class PhantomControl(MeasurementControl):
                 self.create_calibration_signal(h5f)
         self.source.file = Path(h5f)
 
+    def update_status(self):
+        super().update_status()
+        misses = self.source.deadline_misses
+        if misses < self._reported_misses:  # replay restarted
+            self._reported_misses = 0
+        if misses > self._reported_misses:
+            self.logger.warning(
+                f"replay: missed {misses - self._reported_misses} deadlines, "
+                f"max delay {self.source.max_delay * 1000:.1f} ms"
+            )
+            self._reported_misses = misses
+        if self.source.deadline_missed:
+            self.status.text += (
+                f"<br>replay ({self.source.speed:g}x): "
+                f"{misses} deadline misses"
+            )
+
     def create_three_sources_moving(self, h5f):
         n1 = ac.WNoiseGenerator(
             sample_freq=self.sfreq, num_samples=self.num_samples, seed=100
@@ -461,11 +602,14 @@ class PhantomControl(MeasurementControl):
                 self.ti_savename,
                 self.current_time_checkbox,
                 self.ti_msmtime,
+                self.ti_segment,
                 self.display_toggle,
                 self.calib_toggle,
                 self.beamf_toggle,
                 self.msm_toggle,
+                self.pause_toggle,
                 self.update_period,
+                self.status,
             ],
             width=150,
         )
@@ -525,11 +669,14 @@ class SoundDeviceControl(MeasurementControl):
                 self.ti_savename,
                 self.current_time_checkbox,
                 self.ti_msmtime,
+                self.ti_segment,
                 self.display_toggle,
                 self.calib_toggle,
                 self.beamf_toggle,
                 self.msm_toggle,
+                self.pause_toggle,
                 self.update_period,
+                self.status,
             ],
             width=150,
         )
@@ -554,19 +701,25 @@ class Calibration:
             TableColumn(
                 field="calibfactor", title="calibfactor", editor=NumberEditor()
             ),
+            TableColumn(field="state", title="state"),
         ]
         self.cal_table = DataTable(columns=columns, sizing_mode="stretch_both")
         self._calibtable_callback()
         self.control.calib.on_trait_change(self.calibtable_callback, "calibdata")
+        self.control.calib.on_trait_change(self.calibtable_callback, "channel_state")
 
     def _calibtable_callback(self):
         cal_fac = self.control.calib.calibfactor
         if cal_fac.size == 0:
             cal_fac = np.ones(self.control.calib.calibdata.shape[0])
+        states = self.control.calib.channel_state
+        if states.size != cal_fac.size:
+            states = np.zeros(cal_fac.size, dtype=int)
         self.cal_table.source.data = {
             "calibvalue": self.control.calib.calibdata[:, 0],
             "caliblevel": self.control.calib.calibdata[:, 1],
             "calibfactor": cal_fac,
+            "state": [self.control.calib.states[i] for i in states],
             "channel": np.arange(1, self.control.calib.calibdata.shape[0] + 1),
         }
 
@@ -25,6 +25,8 @@ toggle_labels = {
     ("calib", False): "Calibration",
     ("beamf", True): "Stop Beamforming",
     ("beamf", False): "Beamforming",
+    ("pause", True): "Resume",
+    ("pause", False): "Pause",
 }
 
 plot_colors = {
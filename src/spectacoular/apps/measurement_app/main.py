@@ -64,6 +64,30 @@ parser.add_argument(
     default=None,
     help="Name of microphone geometry file inside mics_dir",
 )
+parser.add_argument(
+    "--metrics_file",
+    type=str,
+    default=None,
+    help="File to which the consumer metrics are appended as JSON lines",
+)
+parser.add_argument(
+    "--beamforming_process",
+    action="store_true",
+    help="Run the beamforming in a separate process",
+)
+parser.add_argument(
+    "--speed",
+    type=float,
+    default=1.0,
+    help="Replay speed relative to real time of the phantom device",
+)
+parser.add_argument(
+    "--compression",
+    type=str,
+    default="none",
+    choices=["none", "zlib", "blosc"],
+    help="Compression of the recorded HDF5 files",
+)
 args, _ = parser.parse_known_args()
 
 
@@ -105,6 +129,9 @@ def server_doc(doc):
             doc=doc,
             logger=log.logger,
             blocksize=args.blocksize,
+            metrics_file=args.metrics_file,
+            beamforming_process=args.beamforming_process,
+            compression=args.compression,
             steer=ac.SteeringVector(grid=grid, mics=mics),
         )
 
@@ -118,8 +145,12 @@ def server_doc(doc):
             doc=doc,
             logger=log.logger,
             blocksize=args.blocksize,
+            metrics_file=args.metrics_file,
+            beamforming_process=args.beamforming_process,
+            compression=args.compression,
             steer=ac.SteeringVector(grid=grid, mics=mics),
             initial_file="calib.h5" if args.device == "calib" else "rotating.h5",
+            speed=args.speed,
         )
 
     # =============================================================================
@@ -274,7 +305,7 @@ def server_doc(doc):
         description="Select which input channels should not be used for beamforming",
         value=[],
     )
-    control.beamf.source.source.source.source.source.set_widgets(
+    control.beamf_masked.set_widgets(
         **{"invalid_channels": invalid_input_channels}
     )
     auto_level_toggle = Toggle(label="Auto Level", button_type="success", active=True)
@@ -292,13 +323,13 @@ def server_doc(doc):
     freqSlider = Slider(
         start=50, end=10000, value=4000, step=1, title="Frequency", disabled=False
     )
-    control.beamf.source.source.source.set_widgets(**{"band": freqSlider})  #
+    control.beamf_filter.set_widgets(**{"band": freqSlider})  #
     all_bf_valid = Button(
         label="All Valid", button_type="success", sizing_mode="stretch_width"
     )
 
     def _all_valid(event):
-        control.beamf.source.source.source.source.source.invalid_channels = []
+        control.beamf_masked.invalid_channels = []
 
     all_bf_valid.on_click(_all_valid)
 
@@ -411,7 +442,7 @@ def server_doc(doc):
     bf_max_level.on_change("value", dynamic_slider_callback)
 
     def snapshot_avg_callback(attr, old, new):
-        control.beamf.source.num_per_average = args.blocksize * new
+        control.beamf_average.num_per_average = args.blocksize * new
 
     snapshot_avg.on_change("value", snapshot_avg_callback)
 
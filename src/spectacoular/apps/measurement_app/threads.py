@@ -3,6 +3,9 @@
 # ------------------------------------------------------------------------------
 
 from threading import Thread
+from time import perf_counter
+
+from .acoular_future import BufferOverflowError
 
 
 class EventThread(Thread):
@@ -25,25 +28,94 @@ class EventThread(Thread):
 class SamplesThread(Thread):
     """
     event is set when thread finishes
+
+    The live metrics of the consumer are available via :meth:`metrics`.
+    Buffer overflows of the splitter end the thread, the error is kept in
+    :attr:`error`. Other errors are kept in :attr:`error` as well, but
+    re-raised and not counted as overflow.
     """
 
-    def __init__(self, gen, splitter, register, register_args, event=None):
-        Thread.__init__(self)
+    def __init__(self, gen, splitter, register, register_args, event=None, name=None):
+        Thread.__init__(self, name=name)
         self.splitter = splitter
         self.register = register
         self.register_args = register_args
         self.gen = gen
         self.event = event
         self.breakThread = False
+        self.blocks = 0
+        self.overflowed = 0
+        self.error = None
+        self._buffer_stats = {}
+        self._t_start = self._t_stop = None
+        self._last = (None, 0)
+
+    def _get_buffer_stats(self):
+        buffer_stats = getattr(self.splitter, "buffer_stats", None)
+        if buffer_stats is not None:
+            try:
+                self._buffer_stats = buffer_stats(self.register)
+            except KeyError:  # not (or no longer) registered
+                pass
+        return self._buffer_stats
 
     def run(self):
         if self.event:
             self.event.clear()
         self.splitter.register_object(self.register, **self.register_args)
-        for sample in self.gen:
-            if self.breakThread:
-                break
-        if self.event:
-            self.event.set()
-        self.splitter.remove_object(self.register)
+        self._t_start = perf_counter()
+        try:
+            for sample in self.gen:
+                self.blocks += 1
+                if self.breakThread:
+                    break
+        except BufferOverflowError as error:
+            self.overflowed += 1
+            self.error = error
+        except Exception as error:
+            self.error = error
+            raise
+        finally:
+            self._t_stop = perf_counter()
+            self._get_buffer_stats()
+            if self.event:
+                self.event.set()
+            self.splitter.remove_object(self.register)
         return
+
+    def metrics(self):
+        """
+        Return the live metrics of the consumer.
+
+        "blocks_per_second" is the rate since the previous call.
+
+        Returns
+        -------
+        dict
+            "name", "blocks", "elapsed" (s), "blocks_per_second",
+            "queue_depth" (unread blocks), "max_queue_depth",
+            "max_lag" (samples), "dropped" and "overflowed" (blocks).
+        """
+        if self._t_start is None:
+            now = elapsed = 0.0
+        else:
+            now = perf_counter() if self._t_stop is None else self._t_stop
+            elapsed = now - self._t_start
+        blocks = self.blocks
+        t_last, blocks_last = self._last
+        if t_last is None:
+            t_last = self._t_start
+        rate = (blocks - blocks_last) / (now - t_last) if t_last is not None and now > t_last else 0.0
+        self._last = (now, blocks)
+        buffer_stats = self._get_buffer_stats() if self._t_stop is None else self._buffer_stats
+        return {
+            "name": self.name,
+            "blocks": blocks,
+            "elapsed": elapsed,
+            "blocks_per_second": rate,
+            "queue_depth": buffer_stats.get("unread", 0),
+            "max_queue_depth": buffer_stats.get("max_unread", 0),
+            "max_lag": buffer_stats.get("max_lag", 0),
+            "dropped": buffer_stats.get("dropped", 0),
+            "overflowed": self.overflowed,
+        }
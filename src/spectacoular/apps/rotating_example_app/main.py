@@ -5,6 +5,7 @@
 Example that demonstrates different beamforming algorithms
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import acoular as ac
 import spectacoular as sp
@@ -131,7 +132,15 @@ dynamicSlider.on_change("value", dynamicSlider_callback)
 
 # create Button to trigger beamforming result calculation
 calcButton = Toggle(label="Calculate", button_type="primary")
-sp.set_calc_button_callback(bv.update, calcButton)
+# beamforming runs in a background thread, changed parameters stop a running calculation
+cancelCalc = sp.set_calc_button_callback(
+    bv.calc,
+    calcButton,
+    executor=ThreadPoolExecutor(max_workers=1),
+    publish_func=bv.publish,
+    pass_cancel_event=True,
+)
+bv.observe(lambda event: cancelCalc(), "source.digest, freq, num")
 
 # MicGeomPlot
 mgPlot = figure(title="Microphone Geometry", tools="hover,pan,wheel_zoom,reset")
@@ -11,6 +11,7 @@
 """
 
 import threading
+from collections import deque
 
 from acoular import TimeOut
 
@@ -18,8 +19,11 @@ import numpy as np
 from bokeh.models import ColumnDataSource
 from traits.api import (
     Array,
+    Bool,
     Callable,
+    Enum,
     Float,
+    Instance,
     Int,
     List,
     Property,
@@ -37,12 +41,36 @@ class TimeConsumer(TimeOut):
     tables.
 
     :meth:`consume` runs in an extra non-GUI :attr:`thread` and fetches blocks
-    of data with length :attr:`num` from :attr:`source`. These blocks are stored
-    in :attr:`data`, and :meth:`update` is then registered as a callback for the
-    GUI event loop. :meth:`update` sends the data, downsampled by a factor
-    :attr:`down`, to :attr:`ds`, which holds an overall length of
-    :attr:`rollover` samples. The elapsed time in seconds is stored in
-    :attr:`elapsed`.
+    of data with length :attr:`num` from :attr:`source`. These blocks are put
+    into a queue that holds up to :attr:`queue_size` blocks, and :meth:`update`
+    is then registered as a callback for the GUI event loop. :meth:`update`
+    takes all pending blocks from the queue, joins them in :attr:`data` and
+    sends the data, downsampled by a factor :attr:`down`, to :attr:`ds`, which
+    holds an overall length of :attr:`rollover` samples. The elapsed time in
+    seconds is stored in :attr:`elapsed`.
+
+    If the queue is full, :attr:`overflow_treatment` decides whether
+    :meth:`consume` waits for the next :meth:`update` or discards a block. The
+    number of discarded blocks and of blocks that were joined with others are
+    counted in :attr:`dropped` and :attr:`coalesced`.
+
+    With :attr:`decimation` set to ``'m4'``, each group of :attr:`down`
+    samples is treated as one pixel column of the plot and reduced to its
+    first, minimum, maximum and last value instead of taking every
+    :attr:`down`-th sample. Peaks are thus shown exactly and no aliasing
+    occurs, while at most four points per group are sent. Samples of an
+    incomplete group are carried over to the next update. As all channels
+    share one time column, minimum and maximum are shown at fixed times
+    within their group, so the time of a peak is off by less than one group
+    (:attr:`down` samples).
+
+    If :attr:`ring_buffer` is set, :attr:`ds` instead holds one preallocated
+    column of length :attr:`rollover` per channel (``float32``) that is used as
+    a ring buffer. Each update then only patches the region that was written,
+    so memory and the amount of data sent to the browser stay constant over the
+    whole session. Because the columns are not ordered in time, the sample
+    following the newest one is set to ``NaN`` to separate the newest from the
+    oldest data in line glyphs.
     """
 
     #: Bokeh's ColumnDataSource, updated from result loop
@@ -57,6 +85,11 @@ class TimeConsumer(TimeOut):
     #: downsampling factor for output
     down = Int(8)
 
+    #: decimation method: ``'stride'`` takes every :attr:`down`-th sample,
+    #: ``'m4'`` keeps first, minimum, maximum and last value of each group of
+    #: :attr:`down` samples
+    decimation = Enum('stride', 'm4')
+
     #: total length of columns in ds
     rollover = Int(8192)
 
@@ -66,19 +99,58 @@ class TimeConsumer(TimeOut):
     #: elapsed time in data
     elapsed = Float(0)
 
-    #: flag for update / consume
+    #: flag for update / consume, set when the queue was emptied
     updated = Trait(threading.Event)
 
-    #: transport between consume / update
+    #: data of the last update
     data = Array
 
-    @on_trait_change('channels,source.num_channels')
+    #: maximum number of blocks waiting in the queue between consume / update
+    queue_size = Int(1)
+
+    #: treatment of new blocks if the queue is full: ``'block'`` waits for the
+    #: next update, ``'drop_oldest'`` discards the oldest queued block, and
+    #: ``'drop_newest'`` discards the new block
+    overflow_treatment = Enum('block', 'drop_oldest', 'drop_newest')
+
+    #: number of blocks discarded because the queue was full
+    dropped = Int(0)
+
+    #: number of blocks that were joined with a preceding block in one update
+    coalesced = Int(0)
+
+    # queue between consume / update
+    _queue = Instance(deque, ())
+
+    # flag, if an update is already scheduled
+    _pending = Bool(False)
+
+    # number of dropped blocks, counted in the consume thread
+    _num_dropped = Int(0)
+
+    # samples of an incomplete group for M4 decimation
+    _carry = Array(value=np.empty((0, 0)))
+
+    #: if True, :attr:`ds` holds preallocated ring buffers that are patched
+    #: in place instead of being streamed to
+    ring_buffer = Bool(False)
+
+    # write position in the ring buffers of :attr:`ds`
+    _index = Int(0)
+
+    @on_trait_change('channels,source.num_channels,ring_buffer,rollover')
     def init_ds(self):
         """Initialize the ``ColumnDataSource`` with channel columns."""
         data = {}
-        data['t'] = []
-        for ch in self.ch_names():
-            data[ch] = []
+        if self.ring_buffer:
+            data['t'] = np.full(self.rollover, np.nan)
+            for ch in self.ch_names():
+                data[ch] = np.full(self.rollover, np.nan, dtype=np.float32)
+        else:
+            data['t'] = []
+            for ch in self.ch_names():
+                data[ch] = []
+        self._index = 0
         if not self.ds:
             self.ds = ColumnDataSource()
         self.ds.data = data  # ColumnDataSource wants all columns at once
@@ -99,27 +171,164 @@ class TimeConsumer(TimeOut):
 
         """
         self.elapsed = 0.0
+        self.dropped = self.coalesced = self._num_dropped = 0
+        self._queue.clear()
+        self._pending = False
+        self._carry = np.empty((0, len(self.channels)))
         self.updated = threading.Event()
         self.updated.set()
         doc.add_next_tick_callback(self.init_ds)
+        queue = self._queue
         for temp in self.source.result(self.num):
             if not getattr(self.thread, 'do_run', True):
                 break
-            self.updated.wait()
-            self.data = temp
-            self.updated.clear()
-            doc.add_next_tick_callback(self.update)
+            if len(queue) >= self.queue_size:
+                if self.overflow_treatment == 'drop_newest':
+                    self._num_dropped += 1
+                    continue
+                if self.overflow_treatment == 'drop_oldest':
+                    try:
+                        queue.popleft()
+                        self._num_dropped += 1
+                    except IndexError:  # queue was emptied by update in the meantime
+                        pass
+                else:
+                    while len(queue) >= self.queue_size and getattr(self.thread, 'do_run', True):
+                        self.updated.clear()
+                        if len(queue) >= self.queue_size:  # re-check to not miss a set() from update
+                            self.updated.wait(0.1)
+            queue.append(temp)
+            if not self._pending:
+                self._pending = True
+                doc.add_next_tick_callback(self.update)
+
+    def get_blocks(self):
+        """Take all pending blocks from the queue.
+
+        This method is called from the GUI event loop by :meth:`update` and
+        also updates :attr:`dropped` and :attr:`coalesced`.
+
+        Returns
+        -------
+        list of numpy.ndarray
+            The queued blocks in the order they were consumed.
+        """
+        self._pending = False
+        blocks = []
+        while True:
+            try:
+                blocks.append(self._queue.popleft())
+            except IndexError:
+                break
+        self.updated.set()
+        self.dropped = self._num_dropped
+        if blocks:
+            self.coalesced += len(blocks) - 1
+        return blocks
 
     def update(self):
         """Update the data source from the GUI event loop."""
-        if not self.updated.is_set():
-            newdata = {}
-            newdata['t'] = self.down * np.arange(self.num / self.down) / self.sample_freq + self.elapsed
-            self.elapsed += self.num / self.sample_freq
-            for i, ch in zip(self.channels, self.ch_names(), strict=False):
-                newdata[ch] = self.data[:: self.down, i]
-            self.ds.stream(newdata, rollover=self.rollover)
-            self.updated.set()
+        blocks = self.get_blocks()
+        if blocks:
+            self.data = blocks[0] if len(blocks) == 1 else np.concatenate(blocks)
+            newdata = self.decimate_m4() if self.decimation == 'm4' else self.decimate_stride()
+            self.elapsed += self.data.shape[0] / self.sample_freq
+            if self.ring_buffer:
+                self.patch_ring(newdata)
+            else:
+                self.ds.stream(newdata, rollover=self.rollover)
+
+    def decimate_stride(self):
+        """Take every :attr:`down`-th sample of :attr:`data`.
+
+        Returns
+        -------
+        dict
+            Time and channel columns for :attr:`ds`.
+        """
+        newdata = {}
+        newdata['t'] = self.down * np.arange(self.data.shape[0] / self.down) / self.sample_freq + self.elapsed
+        for i, ch in zip(self.channels, self.ch_names(), strict=False):
+            newdata[ch] = self.data[:: self.down, i]
+        return newdata
+
+    def decimate_m4(self):
+        """Reduce groups of :attr:`down` samples of :attr:`data` to four values.
+
+        Each group yields its first, minimum, maximum and last value, with
+        minimum and maximum in the order they occur in the channel. The values
+        are placed at equally spaced times within the group, so that all
+        channels share one time column. This is an approximation: the times
+        of minimum and maximum are not those of the actual samples but may
+        differ by up to :attr:`down` - 1 samples. Groups with no more than
+        four samples are passed unchanged.
+
+        Returns
+        -------
+        dict
+            Time and channel columns for :attr:`ds`.
+        """
+        down = self.down
+        if self._carry.ndim != 2 or self._carry.shape[1] != len(self.channels):
+            self._carry = np.empty((0, len(self.channels)))  # not consumed yet or channels changed
+        ncarry = self._carry.shape[0]
+        data = np.concatenate([self._carry, self.data[:, self.channels]])
+        ngroups = data.shape[0] // down
+        self._carry = data[ngroups * down :].copy()
+        groups = data[: ngroups * down].reshape(ngroups, down, -1)
+        if down <= 4:
+            offsets = np.arange(down)
+            sig = groups.reshape(ngroups * down, -1)
+        else:
+            offsets = np.linspace(0, down - 1, 4)
+            imin = groups.argmin(1)[:, np.newaxis]
+            imax = groups.argmax(1)[:, np.newaxis]
+            vmin = np.take_along_axis(groups, imin, 1)[:, 0]
+            vmax = np.take_along_axis(groups, imax, 1)[:, 0]
+            min_first = (imin <= imax)[:, 0]
+            sig = np.stack(
+                [
+                    groups[:, 0],
+                    np.where(min_first, vmin, vmax),
+                    np.where(min_first, vmax, vmin),
+                    groups[:, -1],
+                ],
+                axis=1,
+            ).reshape(4 * ngroups, -1)
+        samples = (down * np.arange(ngroups)[:, np.newaxis] + offsets).ravel()
+        newdata = {}
+        newdata['t'] = (samples - ncarry) / self.sample_freq + self.elapsed
+        for i, ch in enumerate(self.ch_names()):
+            newdata[ch] = sig[:, i]
+        return newdata
+
+    def patch_ring(self, newdata):
+        """Write new rows to the ring buffers of :attr:`ds`.
+
+        Only the written region of each column is sent to the browser, split
+        into two slices if the write wraps around the end of the buffer.
+
+        Parameters
+        ----------
+        newdata : dict
+            New rows for the ``'t'`` and channel columns. Only the last
+            :attr:`rollover` rows are kept.
+        """
+        size = self.rollover
+        start = self._index
+        patches = {}
+        for key, values in newdata.items():
+            values = np.asarray(values[-size:], dtype=np.float64 if key == 't' else np.float32)
+            stop = start + values.shape[0]
+            if stop <= size:
+                patches[key] = [(slice(start, stop), values)]
+            else:
+                split = size - start
+                patches[key] = [(slice(start, size), values[:split]), (slice(0, stop - size), values[split:])]
+        self._index = stop % size
+        for ch in self.ch_names():
+            patches[ch].append((self._index, np.nan))  # gap between newest and oldest samples
+        self.ds.patch(patches)
 
     def result(self, num):
         """Yield the output block-wise.
@@ -136,8 +345,8 @@ class TimeBandsConsumer(TimeConsumer):
     frequency bands, such as octave spectra.
 
     It works like :class:`TimeConsumer`, but ignores :attr:`down` and
-    :attr:`rollover`. Instead, only the first sample of each block is taken
-    from the input. :attr:`ds` has a column for each input channel with one
+    :attr:`rollover`. Instead, only the first sample of the latest block is
+    taken from the input. :attr:`ds` has a column for each input channel with one
     frequency-band value in each row. :attr:`bands` gives the bands, and
     :attr:`lfunc` can be used to convert them to human-readable label strings.
     """
@@ -181,12 +390,13 @@ class TimeBandsConsumer(TimeConsumer):
 
     def update(self):
         """Update the data source from the GUI event loop."""
-        if not self.updated.is_set():
+        blocks = self.get_blocks()
+        if blocks:
+            self.data = blocks[-1]  # only the latest bands are shown
             newdata = {}
             newdata['t'] = self.lfunc(self.bands)
-            self.elapsed += self.num / self.sample_freq
+            self.elapsed += sum(block.shape[0] for block in blocks) / self.sample_freq
             data = self.data[0].reshape((self.numbands, -1))
             for i, ch in zip(self.channels, self.ch_names(), strict=False):
                 newdata[ch] = data[:, i]
             self.ds.data = newdata
-            self.updated.set()
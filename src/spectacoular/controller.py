@@ -3,12 +3,40 @@
 # ------------------------------------------------------------------------------
 """Implement controller classes and functions."""
 
+import threading
+from concurrent.futures import CancelledError
+from time import perf_counter
+
 from bokeh.models import CustomJS
 
 
-def set_calc_button_callback(calc_func, calc_button, label='Calculate', active_label='Calculating ...'):
+def set_calc_button_callback(
+    calc_func,
+    calc_button,
+    label='Calculate',
+    active_label='Calculating ...',
+    executor=None,
+    publish_func=None,
+    progress_interval=250,
+    pass_cancel_event=False,
+):
     """Set a Bokeh button inactive and change its label during calculation.
 
+    By default, ``calc_func`` is executed within the Bokeh callback, which
+    blocks the document until the calculation has finished. If an
+    ``executor`` is given, ``calc_func`` is submitted to it instead and the
+    document stays responsive. The elapsed time is shown in the button label
+    and the result of ``calc_func`` is passed to ``publish_func`` on the next
+    tick of the document. A running calculation can be cancelled with the
+    returned function, e.g. when parameters change mid-run.
+
+    Cancelling only discards the result, unless ``calc_func`` takes part:
+    with ``pass_cancel_event`` set, it receives a :class:`threading.Event`
+    that is set on cancellation and may stop early by raising
+    :class:`concurrent.futures.CancelledError`. A calculation requested while
+    a cancelled one is still running is started when the latter has ended;
+    only the latest request waits, so stale calculations do not pile up.
+
     Parameters
     ----------
     calc_func : callable
@@ -20,10 +48,27 @@ def set_calc_button_callback(calc_func, calc_button, label='Calculate', active_l
     active_label : str, optional
         Label of the button when it is active. The default is
         ``'Calculating ...'``.
+    executor : concurrent.futures.Executor, optional
+        Executor that runs ``calc_func``, e.g. a
+        :class:`~concurrent.futures.ThreadPoolExecutor`. If a process pool is
+        used, ``calc_func`` and its result must be picklable. The default is
+        None (run ``calc_func`` within the Bokeh callback).
+    publish_func : callable, optional
+        Callable function that receives the result of ``calc_func`` and is
+        executed within the Bokeh document, e.g. to update a
+        ``ColumnDataSource``. The default is None.
+    progress_interval : int, optional
+        Interval in milliseconds in which the elapsed time in the button
+        label is updated when an ``executor`` is used. The default is 250.
+    pass_cancel_event : bool, optional
+        If True, ``calc_func`` is called with a :class:`threading.Event` as
+        argument that is set when the calculation is cancelled. The default
+        is False.
 
     Returns
     -------
-    None.
+    callable
+        Function without arguments that cancels a running calculation.
 
     """
     js_callback = CustomJS(
@@ -40,13 +85,82 @@ def set_calc_button_callback(calc_func, calc_button, label='Calculate', active_l
     """,
     )
 
+    # generation of the current calculation, results of older generations are discarded;
+    # busy is the future that occupies the executor (possibly a cancelled one) and
+    # queued is set if a calculation waits for it to end
+    state = {'generation': 0, 'future': None, 'progress': None, 'event': None, 'busy': None, 'queued': False}
+
+    def reset():
+        doc = calc_button.document
+        if state['progress'] is not None and doc is not None:
+            doc.remove_periodic_callback(state['progress'])
+        state['future'] = state['progress'] = None
+        calc_button.label = label
+        calc_button.active = False
+
+    def cancel():
+        # may be called from any thread, the button is reset on the next tick of the document
+        if state['future'] is None and not state['queued']:
+            return
+        generation = state['generation'] = state['generation'] + 1
+        state['queued'] = False
+        if state['event'] is not None:
+            state['event'].set()
+        if state['future'] is not None:
+            state['future'].cancel()
+        calc_button.document.add_next_tick_callback(lambda: reset() if generation == state['generation'] else None)
+
+    def start():
+        doc = calc_button.document
+        generation = state['generation']
+        state['queued'] = False
+        event = state['event'] = threading.Event()
+        args = (event,) if pass_cancel_event else ()
+        future = state['future'] = state['busy'] = executor.submit(calc_func, *args)
+        future.add_done_callback(lambda future: doc.add_next_tick_callback(lambda: finish(future, generation)))
+
+    def finish(future, generation):
+        if state['busy'] is future:
+            state['busy'] = None
+            if state['queued']:
+                start()
+        if generation != state['generation'] or future.cancelled():
+            return
+        reset()
+        try:
+            result = future.result()  # re-raises exceptions of calc_func
+        except CancelledError:
+            return
+        if publish_func is not None:
+            publish_func(result)
+
+    def submit():
+        doc = calc_button.document
+        state['generation'] += 1
+        begin = perf_counter()
+
+        def progress():
+            calc_button.label = f'{active_label} {perf_counter() - begin:.1f} s'
+
+        state['progress'] = doc.add_periodic_callback(progress, progress_interval)
+        if state['busy'] is None:
+            start()
+        else:  # wait for the cancelled calculation to end instead of queueing behind it
+            state['future'] = None
+            state['queued'] = True
+
     def calc(attr, old, new):
         del attr, old, new
-        if calc_button.active:
+        if calc_button.active and executor is not None:
+            submit()
+        elif calc_button.active:
             try:
-                calc_func()
+                result = calc_func(threading.Event()) if pass_cancel_event else calc_func()
+                if publish_func is not None:
+                    publish_func(result)
             finally:
                 calc_button.active = False
 
     calc_button.js_on_change('active', js_callback)
     calc_button.on_change('active', calc)
+    return cancel
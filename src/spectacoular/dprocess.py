@@ -13,6 +13,11 @@
     TimeSamplesPresenter
 """
 
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError
+from hashlib import md5
+from pathlib import Path
 from typing import ClassVar
 
 from acoular import (
@@ -22,14 +27,18 @@ from acoular import (
     MicGeom,
     PointSpreadFunction,
     TimeSamples,
+    config,
 )
 
 from .factory import BaseSpectacoular
 
 import numpy as np
-from bokeh.models import ColumnDataSource
-from bokeh.models.widgets import DataTable, NumericInput
-from traits.api import Bool, Float, Instance, Int, List, Trait, observe
+from bokeh.models import ColumnDataSource, CustomJS
+from bokeh.models.widgets import DataTable, NumericInput, Toggle
+from traits.api import Any, Bool, Float, Instance, Int, List, Str, Trait, observe
+
+#: Ratio of the bin sizes of two consecutive levels of a min/max pyramid.
+PYRAMID_RATIO = 4
 
 
 class BasePresenter(BaseSpectacoular):
@@ -113,24 +122,36 @@ class MicGeomPresenter(BasePresenter):
             self.update()
 
     def update(self, **optional_items):
-        """Update the ``cdsource`` attribute with microphone geometry data."""
+        """Update the ``cdsource`` attribute with microphone geometry data.
+
+        If the number of microphones is unchanged, only the changed entries of
+        the columns are sent with :meth:`patch`. Otherwise, all columns are
+        rebuilt.
+        """
         nmics_total = self.source.pos_total.shape[1]
         if self.source.num_mics > 0:
-            pos = self.source.pos_total.copy()
+            pos_total = self.source.pos_total.copy()  # copies, so that later changes can be detected
+            pos = pos_total.copy()
             pos[:, self.source.invalid_channels] = np.nan
-            self.cdsource.data.update(
-                {
-                    'x': self.source.pos_total[0, :],
-                    'y': self.source.pos_total[1, :],
-                    'z': self.source.pos_total[2, :],
-                    'xi': pos[0, :],  # invalid channels are set to np.nan
-                    'yi': pos[1, :],  # invalid channels are set to np.nan
-                    'zi': pos[2, :],  # invalid channels are set to np.nan
-                    'channels': [str(_) for _ in range(nmics_total)],
-                    'alpha': np.ones(nmics_total),
-                    **optional_items,
-                }
-            )
+            columns = {
+                'x': pos_total[0, :],
+                'y': pos_total[1, :],
+                'z': pos_total[2, :],
+                'xi': pos[0, :],  # invalid channels are set to np.nan
+                'yi': pos[1, :],  # invalid channels are set to np.nan
+                'zi': pos[2, :],  # invalid channels are set to np.nan
+            }
+            if len(self.cdsource.data.get('channels', [])) == nmics_total:
+                self.patch(**columns, **optional_items)
+            else:
+                self.cdsource.data.update(
+                    {
+                        **columns,
+                        'channels': [str(_) for _ in range(nmics_total)],
+                        'alpha': np.ones(nmics_total),
+                        **optional_items,
+                    }
+                )
         else:
             self.cdsource.data = {
                 'x': [],
@@ -143,6 +164,40 @@ class MicGeomPresenter(BasePresenter):
                 **optional_items,
             }
 
+    def patch(self, **columns):
+        """Patch the changed entries of the given columns of :attr:`cdsource`.
+
+        The new values are compared with the current column values (NaN values
+        are considered equal) and each contiguous run of changed entries is
+        sent as one slice patch. Columns that do not exist yet or have a
+        different length are replaced.
+
+        Parameters
+        ----------
+        **columns : array_like
+            New values of the columns, keyed by column name.
+        """
+        data = self.cdsource.data
+        patches = {}
+        for name, new in columns.items():
+            new = np.asarray(new)
+            old = np.asarray(data.get(name, []))
+            if old.shape != new.shape:
+                data[name] = new
+                continue
+            if new.dtype.kind == 'f' and old.dtype.kind == 'f':
+                changed = np.flatnonzero((old != new) & ~(np.isnan(old) & np.isnan(new)))
+            else:
+                changed = np.flatnonzero(old != new)
+            if changed.size == 0:
+                continue
+            bounds = np.flatnonzero(np.diff(changed) > 1)
+            starts = changed[np.r_[0, bounds + 1]]
+            stops = changed[np.r_[bounds, changed.size - 1]] + 1
+            patches[name] = [(slice(i, j), new[i:j]) for i, j in zip(starts, stops, strict=True)]
+        if patches:
+            self.cdsource.patch(patches)
+
 
 class BeamformerPresenter(BasePresenter):
     """Provide data for visualization of beamformed data.
@@ -170,14 +225,48 @@ class BeamformerPresenter(BasePresenter):
     #: Trait to set the band center frequency to be considered.
     freq = Float(None, desc='Band center frequency. ')
 
+    #: Memory budget of the result cache in MB. Results of already visited
+    #: (:attr:`freq`, :attr:`num`) combinations are served from the cache,
+    #: least recently used results are evicted. Set to 0 to disable caching.
+    cache_size = Float(64.0, desc='memory budget of the result cache in MB')
+
+    # least recently used cache of (bfdata, pdata) tuples, keyed by (source digest, freq, num)
+    _cache = Instance(OrderedDict, ())
+
+    # guards _cache, which is accessed from executor threads
+    _cache_lock = Instance(threading.Lock, ())
+
+    #: If True, maps of all bands defined by :attr:`num` (FFT lines or
+    #: 1/:attr:`num` octave bands) are computed in one pass and stored in a
+    #: float32 cube. :meth:`calc` then returns the band closest to
+    #: :attr:`freq` from the cube and :meth:`publish` ships the cube once with
+    #: :attr:`cube_cdsource`, so that :meth:`get_freq_callback` can select
+    #: bands on the client.
+    precompute = Bool(False, desc='precompute maps of all frequency bands')
+
+    #: ColumnDataSource holding the precomputed cube of sound pressure level
+    #: maps (flat float32 array), the band center frequencies and the map shape.
+    cube_cdsource = Instance(ColumnDataSource, kw={'data': {'cube': [], 'freqs': [], 'shape': []}})
+
+    # precomputed (cube, band center frequencies), cube has shape (nbands, ny, nx)
+    _cube = Any()
+
+    # (source digest, num) the cube was computed for
+    _cube_key = Any()
+
+    # key of the cube in cube_cdsource
+    _shipped_cube_key = Any()
+
     trait_widget_mapper: ClassVar[dict[str, type]] = {
         'num': NumericInput,
         'freq': NumericInput,
+        'precompute': Toggle,
     }
 
     trait_widget_args: ClassVar[dict[str, dict[str, bool]]] = {
         'num': {'disabled': False},
         'freq': {'disabled': False},
+        'precompute': {'disabled': False},
     }
 
     @observe('source.digest, freq, num')
@@ -186,15 +275,204 @@ class BeamformerPresenter(BasePresenter):
         if self.auto_update:
             self.update()
 
+    @observe('source.digest, cache_size')
+    def _clear_cache(self, event):
+        del event
+        with self._cache_lock:
+            self._cache.clear()
+
     def update(self, **optional_items):
         """Update the keys and values of :attr:`cdsource`."""
-        res = self.source.synthetic(float(self.freq), int(self.num))
-        if res.size > 0:
+        self.publish(self.calc(), **optional_items)
+
+    def calc(self, cancel_event=None):
+        """Calculate the beamforming result for :attr:`freq` and :attr:`num`.
+
+        This method does not touch :attr:`cdsource` and can be run outside of
+        the Bokeh document, e.g. with
+        :func:`~spectacoular.controller.set_calc_button_callback` and an
+        executor. Results are cached, see :attr:`cache_size`.
+
+        Parameters
+        ----------
+        cancel_event : threading.Event, optional
+            If given, the frequency lines are calculated in steps and the
+            calculation stops once the event is set.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            Transposed beamforming result as sound pressure level and as
+            squared sound pressure.
+
+        Raises
+        ------
+        concurrent.futures.CancelledError
+            If ``cancel_event`` was set.
+        """
+        freq, num = float(self.freq), int(self.num)
+        if self.precompute:
+            cube, freqs = self.calc_cube(cancel_event)
+            band = np.argmin(np.abs(np.log(freqs / freq))) if freq > 0 else 0
+            bfdata = cube[band]
+            return bfdata, 4e-10 * 10 ** (bfdata.astype(np.float64) / 10)
+        key = (self.source.digest, freq, num)
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        if num > 0:
+            fftfreq = self.source.freq_data.fftfreq()
+            lines = np.searchsorted(fftfreq, freq * 2.0 ** (np.array([-0.5, 0.5]) / num))
+            self._calc_lines(*lines, cancel_event)
+        res = self.source.synthetic(freq, num)
+        result = (L_p(res).T, res.T)
+        budget = self.cache_size * 2**20
+        with self._cache_lock:
+            # the source may have changed during the calculation, then the result is not cached
+            if self.source.digest == key[0] and sum(a.nbytes for a in result) <= budget:
+                self._cache[key] = result
+                while sum(a.nbytes for item in self._cache.values() for a in item) > budget:
+                    self._cache.popitem(last=False)
+        return result
+
+    def _calc_lines(self, start, stop, cancel_event, step=8):
+        """Calculate the frequency lines start to stop of the source in steps of ``step`` lines."""
+        if cancel_event is None:
+            return
+        for i in range(start, stop, step):
+            if cancel_event.is_set():
+                raise CancelledError
+            # a slice of the lazy result triggers the calculation of the missing lines
+            self.source.result[i : min(i + step, stop)]
+        if cancel_event.is_set():
+            raise CancelledError
+
+    def calc_cube(self, cancel_event=None):
+        """Calculate sound pressure level maps of all frequency bands.
+
+        The beamforming result of all required frequency lines is evaluated
+        in one batch and the bands are summed up at once from its cumulative
+        sum. For
+        :attr:`num` = 0, each FFT line of the source is a band; otherwise
+        1/:attr:`num` octave bands with center frequencies
+        1000 Hz * 2 ** (k / :attr:`num`) are used that contain at least one FFT
+        line. Band edges follow
+        :meth:`~acoular.fbeamform.BeamformerBase.synthetic`.
+
+        Parameters
+        ----------
+        cancel_event : threading.Event, optional
+            If given, the frequency lines are calculated in steps and the
+            calculation stops once the event is set.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            Float32 cube of transposed sound pressure level maps of shape
+            (number of bands, ny, nx) and the band center frequencies.
+
+        Raises
+        ------
+        concurrent.futures.CancelledError
+            If ``cancel_event`` was set.
+        """
+        num = int(self.num)
+        key = (self.source.digest, num)
+        with self._cache_lock:
+            if self._cube_key == key:
+                return self._cube
+        freq = self.source.freq_data.fftfreq()
+        indices = np.asarray(self.source.freq_data.indices)
+        if num == 0:
+            freqs = freq[indices]
+            self._calc_lines(indices[0], indices[-1] + 1, cancel_event)
+            # a slice of the lazy result triggers one batched calculation of all missing lines
+            bands = self.source.result[indices[0] : indices[-1] + 1][indices - indices[0]]
+        else:
+            fmin, fmax = freq[indices[0]], freq[indices[-1]]
+            k = np.arange(np.floor(num * np.log2(fmin / 1000)), np.ceil(num * np.log2(fmax / 1000)) + 1)
+            freqs = 1000 * 2.0 ** (k / num)
+            ind1 = np.searchsorted(freq, freqs * 2.0 ** (-0.5 / num))
+            ind2 = np.searchsorted(freq, freqs * 2.0 ** (0.5 / num))
+            valid = ind1 < ind2
+            freqs, ind1, ind2 = freqs[valid], ind1[valid], ind2[valid]
+            lo, hi = ind1.min(), ind2.max()
+            self._calc_lines(lo, hi, cancel_event)
+            res = self.source.result[lo:hi]
+            csum = np.concatenate((np.zeros((1, res.shape[1])), np.cumsum(res, axis=0)))
+            bands = csum[ind2 - lo] - csum[ind1 - lo]
+        shape = self.source.steer.grid.shape
+        cube = np.ascontiguousarray(np.swapaxes(L_p(bands).reshape(len(freqs), *shape), 1, 2), dtype=np.float32)
+        with self._cache_lock:
+            if self.source.digest != key[0]:  # source changed during the calculation
+                return cube, freqs
+            self._cube = (cube, freqs)
+            self._cube_key = key
+        return self._cube
+
+    def get_freq_callback(self, title=None):
+        """Return a callback that selects the band closest to a widget value on the client.
+
+        The callback replaces the image and the squared sound pressure in
+        :attr:`cdsource` with the band of :attr:`cube_cdsource` closest to the
+        value of the widget it is attached to, e.g. a ``Slider``, without a
+        round trip to the server. Requires :attr:`precompute` to be True.
+
+        Parameters
+        ----------
+        title : str, optional
+            Format of the widget title, where ``{freq}`` is replaced by the
+            selected band center frequency. The default is None (title is
+            not changed).
+
+        Returns
+        -------
+        bokeh.models.CustomJS
+            Callback to be attached with ``widget.js_on_change('value', callback)``.
+        """
+        return CustomJS(
+            args={'cube_source': self.cube_cdsource, 'source': self.cdsource, 'title': title},
+            code="""
+    if (cube_source.data.cube.length == 0) {
+        return;
+    }
+    const [data, freqs, shape] = ['cube', 'freqs', 'shape'].map((name) => cube_source.data[name][0]);
+    const f = cb_obj.value;
+    let band = 0;
+    for (let i = 1; i < freqs.length; i++) {
+        if (Math.abs(Math.log(freqs[i] / f)) < Math.abs(Math.log(freqs[band] / f))) {
+            band = i;
+        }
+    }
+    const [ny, nx] = [shape[1], shape[2]];
+    const rows = [];
+    const prows = [];
+    for (let j = 0; j < ny; j++) {
+        const row = new Float32Array(data.buffer, data.byteOffset + 4 * (band * ny + j) * nx, nx);
+        rows.push(row);
+        prows.push(Float64Array.from(row, (level) => 4e-10 * 10 ** (level / 10)));
+    }
+    source.data = {...source.data, bfdata: [rows], pdata: [prows]};
+    if (title != null) {
+        cb_obj.title = title.replace('{freq}', freqs[band].toFixed(0));
+    }
+    """,
+        )
+
+    def publish(self, result, **optional_items):
+        """Update the keys and values of :attr:`cdsource` with a result of :meth:`calc`."""
+        bfdata, pdata = result
+        if self.precompute and self._cube_key is not None and self._shipped_cube_key != self._cube_key:
+            cube, freqs = self._cube
+            self.cube_cdsource.data = {'cube': [cube.ravel()], 'freqs': [freqs], 'shape': [list(cube.shape)]}
+            self._shipped_cube_key = self._cube_key
+        if pdata.size > 0:
             dx = self.source.steer.grid.x_max - self.source.steer.grid.x_min
             dy = self.source.steer.grid.y_max - self.source.steer.grid.y_min
             self.cdsource.data = {
-                'bfdata': [L_p(res).T],
-                'pdata': [(res).T],
+                'bfdata': [bfdata],
+                'pdata': [pdata],
                 'x': [self.source.steer.grid.x_min],
                 'y': [self.source.steer.grid.y_min],
                 'dw': [dx],
@@ -264,6 +542,27 @@ class TimeSamplesPresenter(BasePresenter):
     # Number of samples to appear in the plot, best practice is to use the width of the plot
     _numsubsamples = Int(-1)
 
+    #: If True, subsampled views are served from a min/max pyramid of the
+    #: source data. The pyramid is built once and cached in
+    #: :attr:`acoular.config.cache_dir` if the source data comes from a file.
+    use_pyramid = Bool(False, desc='serve subsampled views from a cached min/max pyramid')
+
+    #: Number of samples per bin in the finest level of the min/max pyramid.
+    #: Views with fewer samples per plot point are read from the source data.
+    pyramid_base = Int(1024, desc='number of samples per bin in the finest pyramid level')
+
+    #: Number of samples read at once when subsampled views are computed
+    #: from the source data or the min/max pyramid is built. The value is
+    #: rounded up to a multiple of the chunk size of the HDF5 dataset. If
+    #: zero or negative, the whole span is read at once.
+    chunk_size = Int(2**18, desc='number of samples read at once to compute subsampled views')
+
+    # levels of the min/max pyramid, arrays of shape (nbins, 2, num_channels)
+    _pyramid = List(Any)
+
+    # identifier of the data the pyramid was built for
+    _pyramid_key = Str()
+
     trait_widget_mapper: ClassVar[dict[str, type]] = {
         'channels': DataTable,
     }
@@ -287,21 +586,19 @@ class TimeSamplesPresenter(BasePresenter):
         if plotlen > 0 and plotlen < self.source.num_samples:
             used_samples = self.source.num_samples // plotlen * plotlen
             newstop = start + used_samples
-            sigraw = self.source.data[start:newstop, self.channels].reshape(plotlen, -1, num_selected)
-            sig = np.reshape(
-                np.array([sigraw.min(1), sigraw.max(1)]),
-                (2 * plotlen, num_selected),
-                order='F',
-            )  # use min/max of each plot block
-            samples = list(np.linspace(start, newstop, 2 * plotlen))
+            sig = self._pyramid_minmax(start, newstop, plotlen) if self.use_pyramid else None
+            if sig is None:
+                sig = self._chunked_minmax(start, newstop, plotlen)  # use min/max of each plot block
+            samples = np.linspace(start, newstop, 2 * plotlen)
             # sig = sigraw[:,0,:] # only use first sample
-            # samples = list(np.linspace(start, newstop, plotlen))
+            # samples = np.linspace(start, newstop, plotlen)
         else:
-            samples = list(range(self.source.num_samples))
+            samples = np.arange(self.source.num_samples, dtype=np.float64)
             sig = self.source.data[start:stop, self.channels]
 
-        ys = [list(_) for _ in sig.T]
-        xs = [samples for _ in range(num_selected)]
+        # contiguous float32 rows and one shared x array are sent with Bokeh's binary array protocol
+        ys = list(np.ascontiguousarray(np.asarray(sig).T, dtype=np.float32))
+        xs = [samples] * num_selected
         if self.source.num_samples > 0 and num_selected > 0:
             self.cdsource.data = {
                 'xs': xs,
@@ -311,3 +608,132 @@ class TimeSamplesPresenter(BasePresenter):
             }
         else:
             self.cdsource.data = {'xs': [], 'ys': [], 'ch': [], **optional_items}
+
+    def _file_chunk_rows(self):
+        """Return the number of rows per chunk of the source dataset (1 if not chunked)."""
+        data = self.source.data
+        chunks = getattr(data, 'chunkshape', None) or getattr(data, 'chunks', None)
+        return int(chunks[0]) if chunks else 1
+
+    def _read_rows(self, align):
+        """Return the number of rows per read, a multiple of ``align`` not smaller than :attr:`chunk_size`."""
+        if self.chunk_size <= 0:
+            return self.source.data.shape[0] + align
+        return int(-(-self.chunk_size // align) * align)
+
+    def _chunked_minmax(self, start, stop, plotlen):
+        """Return min/max values of ``plotlen`` equally sized bins between ``start`` and ``stop``.
+
+        The source data is read in blocks of :attr:`chunk_size` samples that
+        are aligned to the chunks of the HDF5 dataset, so that only
+        O(:attr:`chunk_size` + ``plotlen``) values are held in memory.
+
+        Returns
+        -------
+        numpy.ndarray
+            Interleaved min/max values of shape (2 * ``plotlen``, number of
+            selected channels).
+        """
+        data = self.source.data
+        binlen = (stop - start) // plotlen
+        rows = self._read_rows(self._file_chunk_rows())
+        mins = np.full((plotlen, len(self.channels)), np.inf)
+        maxs = np.full((plotlen, len(self.channels)), -np.inf)
+        i = start
+        while i < stop:
+            j = min((i // rows + 1) * rows, stop)
+            block = np.asarray(data[i:j, self.channels])
+            first = (i - start) // binlen
+            # block offsets at which a new bin begins
+            idx = np.concatenate(([0], np.arange(-(-(i - start) // binlen) * binlen + start - i, j - i, binlen)))
+            idx = np.unique(idx)
+            last = first + idx.size
+            np.minimum(mins[first:last], np.minimum.reduceat(block, idx, axis=0), out=mins[first:last])
+            np.maximum(maxs[first:last], np.maximum.reduceat(block, idx, axis=0), out=maxs[first:last])
+            i = j
+        return np.reshape(np.array([mins, maxs]), (2 * plotlen, len(self.channels)), order='F')
+
+    def _get_pyramid_key(self):
+        data = self.source.data
+        ident = (
+            f'{self.source.basename}{data.shape}{self.source.sample_freq}{self.pyramid_base}'
+            f'{np.asarray(data[0]).tobytes()}{np.asarray(data[-1]).tobytes()}'
+        )
+        return md5(ident.encode('UTF-8')).hexdigest()
+
+    def _build_pyramid(self):
+        """Build all levels of the min/max pyramid from the source data in chunks."""
+        data = self.source.data
+        base = self.pyramid_base
+        nsamples = data.shape[0]
+        level = np.empty((-(-nsamples // base), 2, data.shape[1]), dtype=np.float32)
+        rows = self._read_rows(np.lcm(self._file_chunk_rows(), base))
+        for i in range(0, nsamples, rows):
+            block = np.asarray(data[i : i + rows])
+            idx = np.arange(0, block.shape[0], base)
+            level[i // base : i // base + idx.size, 0] = np.minimum.reduceat(block, idx, axis=0)
+            level[i // base : i // base + idx.size, 1] = np.maximum.reduceat(block, idx, axis=0)
+        levels = [level]
+        while level.shape[0] > PYRAMID_RATIO:
+            idx = np.arange(0, level.shape[0], PYRAMID_RATIO)
+            level = np.stack(
+                [np.minimum.reduceat(level[:, 0], idx, axis=0), np.maximum.reduceat(level[:, 1], idx, axis=0)],
+                axis=1,
+            )
+            levels.append(level)
+        return levels
+
+    def _load_pyramid(self):
+        """Load the min/max pyramid for the current source data, build it if necessary."""
+        key = self._get_pyramid_key()
+        if key == self._pyramid_key:
+            return
+        cache = config.global_caching != 'none' and bool(self.source.file)
+        cachepath = Path(config.cache_dir) / f'{self.source.basename}_{key}_pyramid'
+        if cache and cachepath.exists() and config.global_caching != 'overwrite':
+            levels = [np.load(file, mmap_mode='r') for file in sorted(cachepath.glob('level*.npy'))]
+        else:
+            levels = self._build_pyramid()
+            if cache and config.global_caching != 'readonly':
+                cachepath.mkdir(parents=True, exist_ok=True)
+                for i, level in enumerate(levels):
+                    np.save(cachepath / f'level{i:02d}.npy', level)
+        self._pyramid = levels
+        self._pyramid_key = key
+
+    def _pyramid_minmax(self, start, stop, plotlen):
+        """Return min/max values of ``plotlen`` bins between ``start`` and ``stop`` from the pyramid.
+
+        The coarsest level whose bins are not larger than the requested bins is
+        used, so that only O(``plotlen``) values are read. Bins of the level
+        that partially overlap a requested bin are fully included, so that no
+        peaks are lost.
+
+        Returns
+        -------
+        numpy.ndarray or None
+            Interleaved min/max values of shape (2 * ``plotlen``, number of
+            selected channels), or None if the requested bins are smaller than
+            :attr:`pyramid_base`.
+        """
+        binlen = (stop - start) / plotlen
+        if binlen < self.pyramid_base:
+            return None
+        self._load_pyramid()
+        k = 0  # index of the coarsest level with bins not larger than binlen
+        while k + 1 < len(self._pyramid) and self.pyramid_base * PYRAMID_RATIO ** (k + 1) <= binlen:
+            k += 1
+        size = self.pyramid_base * PYRAMID_RATIO**k
+        level = self._pyramid[k]
+        first = start // size
+        last = min(-(-stop // size), level.shape[0])
+        sub = np.asarray(level[first:last])[:, :, self.channels]
+        bounds = (start + np.arange(plotlen) * binlen).astype(int)
+        idx = bounds // size - first
+        mins = np.minimum.reduceat(sub[:, 0], idx, axis=0)
+        maxs = np.maximum.reduceat(sub[:, 1], idx, axis=0)
+        # bins that straddle a plot bin boundary also count for the preceding plot bin
+        straddle = np.flatnonzero(bounds[1:] % size)
+        mins[straddle] = np.minimum(mins[straddle], sub[idx[straddle + 1], 0])
+        maxs[straddle] = np.maximum(maxs[straddle], sub[idx[straddle + 1], 1])
+        return np.reshape(np.array([mins, maxs]), (2 * plotlen, len(self.channels)), order='F')
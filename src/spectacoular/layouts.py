@@ -153,7 +153,7 @@ class MicGeomComponent(BaseSpectacoular):
             alpha[inv] = 0
             widget.options = [str(i) for i in range(nmics)]
             widget.value = [str(i) for i in inv]
-            self.presenter.cdsource.data['alpha'] = alpha
+            self.presenter.patch(alpha=alpha)
 
         _update_invalid_channels()
         if self.presenter is not None:
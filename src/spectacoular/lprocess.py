@@ -8,6 +8,7 @@ Some of these classes might move to the Acoular module in the future.
 .. autosummary::
     :toctree: generated/
 
+    MemmapTimeSamples
     TimeSamplesPhantom
     TimeOutPresenter
     CalibHelper
@@ -16,7 +17,9 @@ Some of these classes might move to the Acoular module in the future.
 
 from datetime import UTC, datetime
 from pathlib import Path
-from time import sleep, time
+from queue import Full, Queue
+from threading import Event, Thread
+from time import perf_counter, sleep, time
 from typing import ClassVar
 
 import acoular as ac
@@ -31,12 +34,14 @@ from bokeh.models.widgets import (
     DataTable,
     NumberEditor,
     NumericInput,
+    Select,
     TableColumn,
     TextInput,
 )
 from traits.api import (
     Bool,
     CArray,
+    Enum,
     File,
     Float,
     Instance,
@@ -47,23 +52,132 @@ from traits.api import (
     on_trait_change,
 )
 
+# per-channel states of CalibHelper in 'multi' mode
+_IDLE, _TRACKING, _CALIBRATED, _TIMEOUT = range(4)
+
 invch_columns = [
     TableColumn(field='invalid_channels', title='invalid_channels', editor=NumberEditor()),
 ]
 
 
-class TimeSamplesPhantom(ac.MaskedTimeSamples, BaseSpectacoular):
+def _memmap_dataset(file, node):
+    """Return a read-only memory map of a contiguous HDF5 dataset or None if not possible."""
+    if not ac.config.have_h5py:
+        return None
+    import h5py
+
+    with h5py.File(file, 'r') as f:
+        dataset = f[node]
+        # chunked datasets are scattered in the file, filters require chunks
+        if dataset.chunks is not None or dataset.external or dataset.size == 0:
+            return None
+        offset = dataset.id.get_offset()
+        if offset is None:  # storage not allocated
+            return None
+        dtype, shape = dataset.dtype, dataset.shape
+    return np.memmap(file, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+
+def _as_slice(index):
+    """Return an equally spaced index array as slice, other indices unchanged."""
+    if isinstance(index, slice) or len(index) == 0:
+        return index
+    step = index[1] - index[0] if len(index) > 1 else 1
+    if step > 0 and np.all(np.diff(index) == step):
+        return slice(index[0], index[-1] + 1, step)
+    return index
+
+
+class MemmapTimeSamples(ac.MaskedTimeSamples, BaseSpectacoular):
+    """Access time data of uncompressed HDF5 files through a memory map.
+
+    If the time data of the file is stored contiguously, :attr:`data` is a
+    read-only :class:`numpy.memmap` of the dataset and :meth:`result` yields
+    views of it without reading or copying, the operating system caches the
+    pages. Equally spaced valid channels are selected with a slice, so that
+    the blocks stay views. Chunked or compressed datasets and files that
+    cannot be mapped because h5py is not installed are read as usual.
+    """
+
+    #: Indicates if :attr:`data` is a memory map of the file. (read-only)
+    memory_mapped = Bool(False, desc='indicates if the data is memory mapped')
+
+    def _load_timedata(self):
+        super()._load_timedata()
+        data = _memmap_dataset(self.file, 'time_data')
+        self.memory_mapped = data is not None
+        if self.memory_mapped:
+            self.data = data
+
+    def result(self, num=128):
+        """
+        Python generator that yields the output block-wise.
+
+        Parameters
+        ----------
+        num : integer, defaults to 128
+            This parameter defines the size of the blocks to be yielded
+            (i.e. the number of samples per block) .
+
+        Returns
+        -------
+        Samples in blocks of shape (num, num_channels).
+            The last block may be shorter than num.
+        """
+        i, stop, _ = slice(self.start, self.stop).indices(self.num_samples_total)
+        if i >= stop:
+            msg = 'no samples available'
+            raise OSError(msg)
+        channels = _as_slice(self.channels)
+        while i < stop:
+            yield self.data[i : min(i + num, stop), channels]
+            i += num
+
+
+class TimeSamplesPhantom(MemmapTimeSamples):
     """Propagate signal-processing blocks with a user-defined time delay.
 
     This class delivers existing blocks of data at a configurable time
     interval. It can be used to simulate a measurement while reading the data
     from file.
+
+    The blocks are scheduled at absolute deadlines, so that the time spent
+    in downstream processing does not add up. A block that is due while the
+    previous one is still processed is counted as a deadline miss and
+    delivered immediately.
+
+    If :attr:`prefetch` is set, a background thread reads the data ahead in
+    large chunks aligned to the chunks of the HDF5 dataset and the blocks are
+    served as slices of these chunks, so that file access does not delay
+    the delivery of the blocks.
     """
 
     #: Defines the delay with which the individual data blocks are propagated.
     #: Defaults to 1/sample_freq
     time_delay = Float(desc='Time interval between individual blocks of data')
 
+    #: Playback speed relative to real time, e.g. 10 for ten times faster
+    #: delivery of the blocks. Zero delivers the blocks without delay.
+    speed = Float(1.0, desc='playback speed relative to real time')
+
+    #: Indicates if a deadline was missed during the last call of :meth:`result`.
+    deadline_missed = Bool(False, desc='indicates if a deadline was missed')
+
+    #: Number of missed deadlines during the last call of :meth:`result`.
+    deadline_misses = Int(0, desc='number of missed deadlines')
+
+    #: Maximum delay in s of a block with respect to its deadline during the
+    #: last call of :meth:`result`.
+    max_delay = Float(0.0, desc='maximum delay of a block in s')
+
+    #: Number of chunks that are read ahead in a background thread. If zero,
+    #: the blocks are read from the data when they are due.
+    prefetch = Int(0, desc='number of chunks read ahead')
+
+    #: Number of samples per read-ahead chunk. The value is rounded up to a
+    #: multiple of the chunk size of the HDF5 dataset and the block size.
+    read_size = Int(2**16, desc='number of samples per read-ahead chunk')
+
     #: Indicates if samples are collected, helper trait to break result loop
     collect_samples = Bool(default_value=True, desc='Indicates if result function is running')
 
@@ -77,6 +191,8 @@ class TimeSamplesPhantom(ac.MaskedTimeSamples, BaseSpectacoular):
         'invalid_channels': DataTable,
         'num_channels': NumericInput,
         'time_delay': NumericInput,
+        'speed': NumericInput,
+        'prefetch': NumericInput,
     }
     trait_widget_args: ClassVar[dict[str, dict[str, object]]] = {
         'file': {'disabled': False},
@@ -92,6 +208,8 @@ class TimeSamplesPhantom(ac.MaskedTimeSamples, BaseSpectacoular):
         },
         'num_channels': {'disabled': True, 'mode': 'int'},
         'time_delay': {'disabled': False, 'mode': 'float'},
+        'speed': {'disabled': False, 'mode': 'float'},
+        'prefetch': {'disabled': False, 'mode': 'int'},
     }
 
     def result(self, num=128):
@@ -109,16 +227,97 @@ class TimeSamplesPhantom(ac.MaskedTimeSamples, BaseSpectacoular):
         Samples in blocks of shape (num, num_channels).
             The last block may be shorter than num.
         """
-        slp_time = self.time_delay or (1 / self.sample_freq) * num
+        interval = self.time_delay or (1 / self.sample_freq) * num
+        if self.speed > 0:
+            interval /= self.speed
+        else:
+            interval = 0.0
 
         if self.num_samples == 0:
             msg = 'no samples available'
             raise OSError(msg)
+        self.deadline_missed = False
+        self.deadline_misses = 0
+        self.max_delay = 0.0
+        blocks = self._read_ahead(num) if self.prefetch > 0 else self._read(num)
+        deadline = perf_counter()
         i = 0
-        while i < self.num_samples and self.collect_samples:
+        try:
+            for block in blocks:
+                if not self.collect_samples:
+                    break
+                yield block
+                i += num
+                if not interval or i >= self.num_samples:
+                    continue
+                deadline += interval
+                wait = deadline - perf_counter()
+                if wait > 0:
+                    sleep(wait)
+                else:
+                    self.deadline_misses += 1
+                    self.deadline_missed = True
+                    self.max_delay = max(self.max_delay, -wait)
+        finally:
+            blocks.close()
+
+    def _read(self, num):
+        """Read the blocks from the data when they are requested."""
+        for i in range(0, self.num_samples, num):
             yield self.data[i : i + num]
-            sleep(slp_time)
-            i += num
+
+    def _read_rows(self, num):
+        """Return the number of rows per read-ahead chunk."""
+        chunks = getattr(self.data, 'chunkshape', None) or getattr(self.data, 'chunks', None)
+        align = int(np.lcm(int(chunks[0]) if chunks else 1, num))
+        return -(-max(self.read_size, 1) // align) * align
+
+    def _read_ahead(self, num):
+        """Serve the blocks as slices of chunks that are read in a background thread."""
+        chunks = Queue(maxsize=self.prefetch)
+        stop = Event()
+        args = (self._read_rows(num), num, chunks, stop)
+        thread = Thread(target=self._fill, args=args, name='TimeSamplesPhantom prefetch', daemon=True)
+        thread.start()
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    return
+                if isinstance(chunk, Exception):
+                    raise chunk
+                for j in range(0, chunk.shape[0], num):
+                    yield chunk[j : j + num]
+        finally:
+            # the reading thread checks the event while it waits for a free slot
+            stop.set()
+            thread.join()
+
+    def _fill(self, rows, num, chunks, stop):
+        """Read the data chunk-wise into the queue until it ends or stop is set."""
+        # the last block may extend beyond num_samples as in _read
+        end = -(-self.num_samples // num) * num
+        try:
+            for i in range(0, self.num_samples, rows):
+                # copy to read the data here, slices of arrays or memory maps are views
+                chunk = np.array(self.data[i : min(i + rows, end)], copy=True)
+                while not stop.is_set():
+                    try:
+                        chunks.put(chunk, timeout=0.1)
+                        break
+                    except Full:
+                        continue
+                if stop.is_set():
+                    return
+            item = None
+        except Exception as exception:  # noqa: BLE001
+            item = exception  # raised in the consuming thread
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return
+            except Full:
+                continue
 
 
 class TimeOutPresenter(ac.TimeOut, BasePresenter):
@@ -152,6 +351,63 @@ class TimeOutPresenter(ac.TimeOut, BasePresenter):
             yield temp
 
 
+class _SlidingWindowStats:
+    """
+    Per-channel mean, variance and in-range counts of the last values.
+
+    The window is a ring buffer of size rows that is initially filled with
+    zeros. New rows replace the oldest ones and the statistics are updated
+    incrementally (Welford-style) from the replaced and the new rows only,
+    in one vectorised step per call of :meth:`push`. They are recomputed
+    from the ring buffer once per turn to avoid the accumulation of rounding
+    errors.
+    """
+
+    def __init__(self, size, num_channels, low, high):
+        self.size = size
+        self.values = np.zeros((size, num_channels))
+        self.pos = 0
+        self.mean = np.zeros(num_channels)
+        self.m2 = np.zeros(num_channels)
+        self.set_range(low, high)
+
+    def set_range(self, low, high):
+        """Set the open range (low, high) of the in-range counts and recount."""
+        self.low, self.high = low, high
+        self.count = self.inside(self.values).sum(0)
+
+    def inside(self, x):
+        """Return a mask of the values of x inside the open range."""
+        return np.logical_and(x > self.low, x < self.high)
+
+    def push(self, rows):
+        """Replace the oldest rows of the window by rows of shape (n, num_channels).
+
+        Only the last size rows are relevant if n exceeds the window size.
+        """
+        rows = rows[-self.size :]
+        num = rows.shape[0]
+        index = (self.pos + np.arange(num)) % self.size
+        old = self.values[index]
+        # sums of squares around the previous mean, shifted to the new mean
+        center = self.mean
+        mean = center + (rows.sum(0) - old.sum(0)) / self.size
+        self.m2 += ((rows - center) ** 2).sum(0) - ((old - center) ** 2).sum(0) - self.size * (mean - center) ** 2
+        self.mean = mean
+        self.count += self.inside(rows).sum(0) - self.inside(old).sum(0)
+        self.values[index] = rows
+        wrapped = self.pos + num >= self.size
+        self.pos = (self.pos + num) % self.size
+        if wrapped:
+            self.mean = self.values.mean(0)
+            self.m2 = ((self.values - self.mean) ** 2).sum(0)
+
+    @property
+    def std(self):
+        """Standard deviation of the window per channel."""
+        return np.sqrt(np.maximum(self.m2, 0) / self.size)
+
+
 @deprecated_alias({'name': 'file'})
 class CalibHelper(ac.TimeOut, BaseSpectacoular):
     """Calibrate individual source channels."""
@@ -187,6 +443,22 @@ class CalibHelper(ac.TimeOut, BaseSpectacoular):
         desc='magnitude difference between calibrating channel and remaining channels',
     )
 
+    #: detection mode; 'single' accepts a calibration value only if exactly
+    #: one channel is in the calibration window, 'multi' tracks all channels
+    #: in parallel, e.g. for several calibration devices in use at once.
+    mode = Enum('single', 'multi', desc='calibration detection mode')
+
+    #: maximum number of averaged blocks a channel is tracked in 'multi' mode
+    #: before it times out without a calibration value (0 for no limit).
+    #: A timed out channel is tracked again after its level left the window.
+    timeout = Int(0, desc='maximum number of blocks for tracking a channel')
+
+    #: per-channel state in 'multi' mode, an index into :attr:`states`.
+    channel_state = CArray(dtype=int, desc='per-channel calibration state')
+
+    #: names of the values of :attr:`channel_state`.
+    states: ClassVar[tuple[str, ...]] = ('idle', 'tracking', 'calibrated', 'timeout')
+
     # internal identifier
     digest = Property(depends_on=['source.digest', '__class__'])
 
@@ -196,6 +468,8 @@ class CalibHelper(ac.TimeOut, BaseSpectacoular):
         'buffer_size': NumericInput,
         'calibstd': NumericInput,
         'delta': NumericInput,
+        'mode': Select,
+        'timeout': NumericInput,
     }
 
     trait_widget_args: ClassVar[dict[str, dict[str, object]]] = {
@@ -204,6 +478,8 @@ class CalibHelper(ac.TimeOut, BaseSpectacoular):
         'buffer_size': {'disabled': False, 'mode': 'int'},
         'calibstd': {'disabled': False, 'mode': 'float'},
         'delta': {'disabled': False, 'mode': 'float'},
+        'mode': {'disabled': False},
+        'timeout': {'disabled': False, 'mode': 'int'},
     }
 
     def to_pa(self, level):
@@ -256,32 +532,63 @@ class CalibHelper(ac.TimeOut, BaseSpectacoular):
             The last block may be shorter than num.
         """
         self.adjust_calib_values()
-        nc = self.num_channels
         self.calibfactor = np.zeros(self.num_channels)
-        buffer = np.zeros((self.buffer_size, nc))
+        self.channel_state = np.full(self.num_channels, _IDLE)
+        size = self.buffer_size
+        window = (self.magnitude - self.delta, self.magnitude + self.delta)
+        stats = _SlidingWindowStats(size, self.num_channels, *window)
+        state = self.channel_state.copy()
+        age = np.zeros(self.num_channels, dtype=int)
         for temp in self.source.result(num):
-            ns = temp.shape[0]
-            bufferidx = self.buffer_size - ns
-            buffer[0:bufferidx] = buffer[-bufferidx:]  # copy remaining samples in front of next block
-            buffer[-ns:, :] = ac.L_p(temp)
-            calibmask = np.logical_and(
-                buffer > (self.magnitude - self.delta),
-                buffer < (self.magnitude + self.delta),
-            ).sum(0)
-            # print(calibmask)
-            if (calibmask.max() == self.buffer_size) and (calibmask.sum() == self.buffer_size):
-                idx = calibmask.argmax()
-                # print(buffer[:,idx].std())
-                if buffer[:, idx].std() < self.calibstd:
-                    calibdata = self.calibdata.copy()
-                    calibdata[idx, :] = [np.mean(buffer[:, idx]), self.magnitude]
-                    # self.calibdata[idx,:] = [mean(L_p(buffer[:,idx])), self.magnitude]
+            if window != (self.magnitude - self.delta, self.magnitude + self.delta):
+                window = (self.magnitude - self.delta, self.magnitude + self.delta)
+                stats.set_range(*window)
+            if size != self.buffer_size:
+                # the window starts anew, as at the start of the calibration
+                size = self.buffer_size
+                stats = _SlidingWindowStats(size, self.num_channels, *window)
+                age[:] = 0
+            # only the last buffer_size levels are relevant for the checks below
+            levels = ac.L_p(temp[-size:])
+            if self.mode == 'multi':
+                # the state machines advance with every level row
+                calibdata = self.calibdata.copy()
+                for level in levels:
+                    stats.push(level[np.newaxis])
+                    self._update_states(stats, stats.inside(level), state, age, calibdata)
+                if not np.array_equal(state, self.channel_state):
+                    self.channel_state = state.copy()
+                if not np.array_equal(calibdata, self.calibdata):
                     self.calibdata = calibdata
-
-            for i in np.arange(self.num_channels):
-                self.calibfactor[i] = self.to_pa(self.magnitude) / self.to_pa(float(self.calibdata[i, 0]))
+            else:
+                stats.push(levels)
+                # exactly one channel with all levels in the window
+                if stats.count.max() == size and stats.count.sum() == size:
+                    idx = stats.count.argmax()
+                    if stats.std[idx] < self.calibstd:
+                        calibdata = self.calibdata.copy()
+                        calibdata[idx, :] = [stats.mean[idx], self.magnitude]
+                        self.calibdata = calibdata
+            np.divide(self.to_pa(self.magnitude), self.to_pa(self.calibdata[:, 0]), out=self.calibfactor)
             yield temp
 
+    def _update_states(self, stats, inside, state, age, calibdata):
+        """Advance the per-channel state machines by one level row."""
+        # a channel returns to idle as soon as its level leaves the window
+        state[~inside] = _IDLE
+        age[~inside] = 0
+        state[inside & (state == _IDLE)] = _TRACKING
+        tracking = state == _TRACKING
+        age[tracking] += 1
+        ready = tracking & (age >= stats.size)
+        if ready.any():
+            done = ready & (stats.std < self.calibstd)
+            calibdata[done, 0] = stats.mean[done]
+            calibdata[done, 1] = self.magnitude
+            state[done] = _CALIBRATED
+        if self.timeout > 0:
+            state[(state == _TRACKING) & (age >= self.timeout)] = _TIMEOUT
+
 
 if ac.config.have_sounddevice:
     import sounddevice as sd
@@ -0,0 +1,361 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Acoular Development Team.
+# ------------------------------------------------------------------------------
+"""Tests for the Acoular extensions of the measurement app."""
+
+import acoular as ac
+from spectacoular.apps.measurement_app.acoular_future import process as future_process
+from spectacoular.apps.measurement_app.acoular_future import (
+    BeamformerFreqTime,
+    BeamformerTimeStream,
+    CSMInOut,
+    ProcessConsumer,
+    SampleFanOut,
+    SharedRing,
+    WriteH5Batched,
+    WriteH5Segmented,
+    find_segments,
+)
+from spectacoular.apps.measurement_app.acoular_future.fastFuncs import calcCSMmav, calcCSMmavBatch, unpackHermitian
+
+import multiprocessing as mp
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+import tables
+
+
+@pytest.mark.parametrize('dtype', [np.complex128, np.complex64])
+def test_calc_csm_mav_batch(dtype):
+    """Test that the batched kernel equals sequential updates of the scalar kernel."""
+    rng = np.random.default_rng(5)
+    spec = (rng.standard_normal((5, 33, 7)) + 1j * rng.standard_normal((5, 33, 7))).astype(dtype)
+    csm = (rng.standard_normal((33, 7, 7)) + 1j * rng.standard_normal((33, 7, 7))).astype(dtype)
+    expected = csm.copy()
+    for ft in spec:
+        calcCSMmav(expected, ft, 0.3)
+    calcCSMmavBatch(csm, spec, 0.3)
+    upper = np.triu_indices(7)
+    np.testing.assert_allclose(csm[:, *upper], expected[:, *upper], rtol=1e-5)
+
+
+@pytest.fixture
+def time_samples():
+    """Return white noise time samples."""
+    rng = np.random.default_rng(6)
+    return ac.TimeSamples(data=rng.standard_normal((8192, 4)), sample_freq=1000.0)
+
+
+def test_csm_in_out(time_samples):
+    """Test that one Hermitian CSM is yielded per num FFT blocks."""
+    csms = [csm.copy() for csm in CSMInOut(source=time_samples, block_size=256, num_threads=1).result(4)]
+    assert len(csms) == 8
+    assert csms[0].shape == (129, 4, 4)
+    np.testing.assert_allclose(csms[-1], csms[-1].conj().transpose(0, 2, 1))
+
+
+def test_csm_in_out_packed(time_samples):
+    """Test that the packed CSM holds the upper triangular matrix of the full CSM."""
+    full = CSMInOut(source=time_samples, block_size=256, num_threads=1)
+    packed = CSMInOut(source=time_samples, block_size=256, num_threads=1, csm_format='packed')
+    upper = np.triu_indices(4)
+    for csm, csm_packed in zip(full.result(4), packed.result(4), strict=True):
+        assert csm_packed.shape == (129, 10)
+        np.testing.assert_array_equal(csm[:, *upper], csm_packed)
+        csm_unpacked = unpackHermitian(csm_packed, np.empty_like(csm))
+        np.testing.assert_array_equal(csm_unpacked, csm)
+
+
+@pytest.mark.parametrize(('center_freqs', 'band_width'), [([100.0], 3), ([31.5, 250.0, 400.0], 3), ([200.0], 1)])
+def test_csm_in_out_bands(time_samples, center_freqs, band_width):
+    """Test that band CSMs computed from the lines inside the bands equal the synthesized full CSM."""
+    full = CSMInOut(source=time_samples, block_size=256)
+    bands = CSMInOut(source=time_samples, block_size=256, band_width=band_width, center_freqs=center_freqs)
+    np.testing.assert_array_equal(bands.fftfreq(), center_freqs)
+    for csm, csm_bands in zip(full.result(2), bands.result(2), strict=True):
+        assert csm_bands.shape == (len(center_freqs), 4, 4)
+        expected = ac.synthetic(csm, full.fftfreq(), center_freqs, band_width)
+        np.testing.assert_allclose(csm_bands, expected, rtol=1e-7, atol=1e-12)
+
+
+@pytest.mark.parametrize('change', [{'center_freq': 250.0}, {'center_freqs': [250.0, 400.0]}, {'band_width': 0}])
+def test_csm_in_out_band_change(time_samples, change):
+    """Test that changed bands take effect while the generator runs and the average starts anew."""
+    params = {'block_size': 256, 'band_width': 3, 'center_freq': 100.0}
+    bands = CSMInOut(source=time_samples, **params)
+    gen = bands.result(2)
+    next(gen)
+    next(gen)
+    bands.trait_set(**change)
+    rest = ac.TimeSamples(data=time_samples.data[1024:], sample_freq=time_samples.sample_freq)
+    expected = CSMInOut(source=rest, **{**params, **change})
+    for csm, csm_expected in zip(gen, expected.result(2), strict=True):
+        np.testing.assert_allclose(csm, csm_expected, rtol=1e-12)
+
+
+@pytest.mark.parametrize('r_diag', [True, False])
+@pytest.mark.parametrize('csm_format', ['full', 'packed'])
+@pytest.mark.parametrize('band_width', [0, 3])
+def test_beamformer_freq_time_streaming(time_samples, r_diag, csm_format, band_width):
+    """Test that the streaming path gives the same results as the beamformer for the active frequencies."""
+    rng = np.random.default_rng(7)
+    mg = ac.MicGeom(pos_total=rng.uniform(-0.5, 0.5, (3, 4)) * [[1], [1], [0]])
+    grid = ac.RectGrid(x_min=-0.2, x_max=0.2, y_min=-0.2, y_max=0.2, z=0.5, increment=0.1)
+    steer = ac.SteeringVector(grid=grid, mics=mg)
+    results = []
+    for streaming in (True, False):
+        csms = CSMInOut(
+            source=time_samples,
+            block_size=256,
+            csm_format=csm_format,
+            band_width=band_width,
+            center_freqs=[100.0, 200.0],
+            ind_low=5,
+            ind_high=40,
+        )
+        bb = ac.BeamformerBase(steer=steer, r_diag=r_diag, cached=False)
+        bt = BeamformerFreqTime(source=csms, beamformer=bb, steer=steer, streaming=streaming)
+        results.append([np.array(res[:]) for res in bt.result(4)])
+    assert len(results[0]) == len(results[1]) == 8
+    indices = csms.indices
+    streamed, expected = np.array(results[0])[:, indices], np.array(results[1])[:, indices]
+    np.testing.assert_allclose(streamed, expected, rtol=1e-6, atol=1e-6 * expected.max())
+
+
+@pytest.mark.parametrize('num_workers', [1, 3])
+@pytest.mark.parametrize('steer_type', ['classic', 'inverse', 'true level', 'true location'])
+def test_beamformer_time_stream(time_samples, num_workers, steer_type):
+    """Test that the streaming delay-and-sum gives the same output as BeamformerTime."""
+    rng = np.random.default_rng(8)
+    mg = ac.MicGeom(pos_total=rng.uniform(-0.5, 0.5, (3, 4)) * [[1], [1], [0]])
+    grid = ac.RectGrid(x_min=-0.4, x_max=0.4, y_min=-0.4, y_max=0.4, z=0.5, increment=0.1)
+    steer = ac.SteeringVector(grid=grid, mics=mg, steer_type=steer_type)
+    expected = np.concatenate(list(ac.BeamformerTime(source=time_samples, steer=steer).result(1000)))
+    bt = BeamformerTimeStream(source=time_samples, steer=steer, num_workers=num_workers, grid_chunk_size=20)
+    blocks = list(bt.result(1000))
+    assert [block.shape[0] for block in blocks[:-1]] == [1000] * (len(blocks) - 1)
+    result = np.concatenate(blocks)
+    assert result.shape == expected.shape
+    np.testing.assert_allclose(result, expected, rtol=1e-4, atol=1e-5 * abs(expected).max())
+
+
+class LargeBlocks(ac.InOut):
+    """Yields blocks of the source that are larger than requested, like a fan-out with its own block size."""
+
+    def result(self, num):
+        yield from self.source.result(3 * num)
+
+
+def test_beamformer_time_stream_large_blocks(time_samples):
+    """Test that source blocks larger than num give the same output."""
+    mg = ac.MicGeom(pos_total=np.random.default_rng(8).uniform(-0.5, 0.5, (3, 4)) * [[1], [1], [0]])
+    grid = ac.RectGrid(x_min=-0.4, x_max=0.4, y_min=-0.4, y_max=0.4, z=0.5, increment=0.1)
+    steer = ac.SteeringVector(grid=grid, mics=mg)
+    expected = np.concatenate(list(BeamformerTimeStream(source=time_samples, steer=steer).result(256)))
+    blocks = list(BeamformerTimeStream(source=LargeBlocks(source=time_samples), steer=steer).result(256))
+    assert all(block.shape[0] == 256 for block in blocks[:-1])
+    np.testing.assert_array_equal(np.concatenate(blocks), expected)
+
+
+def test_sample_fan_out(time_samples):
+    """Test that all consumers receive the same blocks and that lagging consumers drop blocks."""
+    fan_out = SampleFanOut(source=time_samples)
+    power, level, lagging = (ac.TimePower(source=fan_out) for _ in range(3))
+    fan_out.register_object(power, level)
+    fan_out.register_object(lagging, buffer_size=2, buffer_overflow_treatment='none')
+    gen_power, gen_level, gen_lagging = (obj.result(1024) for obj in (power, level, lagging))
+    np.testing.assert_array_equal(next(gen_lagging), time_samples.data[:1024] ** 2)
+    for block in gen_power:
+        np.testing.assert_array_equal(block, next(gen_level))
+    assert next(gen_level, None) is None
+    assert len(list(gen_lagging)) == 2
+    assert fan_out.dropped == {power: 0, level: 0, lagging: 5}
+    assert fan_out.buffer_stats(lagging) == {'unread': 0, 'max_unread': 2, 'max_lag': 2048, 'dropped': 5}
+    assert fan_out.buffer_stats(level)['max_unread'] == 1
+    fan_out.remove_object()
+    assert not fan_out.dropped
+
+
+def test_sample_fan_out_overflow(time_samples):
+    """Test that overflow treatment 'error' raises an error."""
+    fan_out = SampleFanOut(source=time_samples)
+    power, lagging = ac.TimePower(source=fan_out), ac.TimePower(source=fan_out)
+    fan_out.register_object(power)
+    fan_out.register_object(lagging, buffer_size=2)
+    with pytest.raises(OSError, match='Maximum size'):
+        list(power.result(1024))
+
+
+def test_sample_fan_out_share(time_samples):
+    """Test that sub-chains with the same digest are shared and computed only once."""
+    fan_out = SampleFanOut(source=time_samples)
+    shared = fan_out.share(ac.TimePower(source=fan_out))
+    assert fan_out.share(ac.TimePower(source=fan_out)) is shared
+    avg1, avg2 = ac.Average(source=shared, num_per_average=256), ac.Average(source=shared, num_per_average=512)
+    shared.register_object(avg1, avg2)
+    assert list(fan_out._cursors) == [shared.source]
+    res1, res2 = (np.concatenate(list(avg.result(4))) for avg in (avg1, avg2))
+    np.testing.assert_allclose(res1, (time_samples.data**2).reshape(32, 256, 4).mean(1))
+    np.testing.assert_allclose(res2, (time_samples.data**2).reshape(16, 512, 4).mean(1))
+    shared.remove_object()
+    assert not fan_out._cursors
+
+
+def test_shared_ring():
+    """Test that blocks and the end of the data pass a shared ring in order."""
+    ring = SharedRing(mp.get_context('spawn'), 2, 4, 3)
+    try:
+        block = np.arange(12.0).reshape(4, 3)
+        assert ring.put(block)
+        assert ring.put(block[:1])
+        assert not ring.put(block, timeout=0)
+        np.testing.assert_array_equal(ring.get(), block)
+        np.testing.assert_array_equal(ring.get(), block[:1])
+        assert ring.get(timeout=0) is None
+        assert ring.put()
+        with pytest.raises(EOFError):
+            ring.get()
+    finally:
+        ring.close(unlink=True)
+
+
+def test_process_consumer(time_samples):
+    """Test that a chain run in a consumer process gives the same output as in this process."""
+    fan_out = SampleFanOut(source=time_samples)
+    chain = ac.Average(source=ac.TimePower(source=fan_out), num_per_average=512)
+    consumer = ProcessConsumer(source=chain, feed=fan_out, block_size=512, num_slots=4)
+    fan_out.register_object(consumer)
+    result = np.concatenate(list(consumer.result(2)))
+    np.testing.assert_allclose(result, (time_samples.data**2).reshape(16, 512, 4).mean(1))
+    assert fan_out.buffer_stats(consumer)['dropped'] == 0
+
+
+@pytest.mark.parametrize(('num', 'num_slots'), [(100, 16), (128, 2), (3000, 16)])
+def test_process_consumer_reblock(time_samples, num, num_slots):
+    """Test that the chain gets blocks of num samples, independent of the block size of the feed.
+
+    With two slots, the chain yields more output blocks per input block than
+    the output ring holds, which must not block the feeding.
+    """
+    fan_out = SampleFanOut(source=time_samples)
+    consumer = ProcessConsumer(
+        source=ac.TimePower(source=fan_out), feed=fan_out, block_size=1024, num_slots=num_slots
+    )
+    fan_out.register_object(consumer)
+    blocks = list(consumer.result(num))
+    assert all(block.shape[0] == num for block in blocks[:-1])
+    np.testing.assert_allclose(np.concatenate(blocks), time_samples.data**2)
+
+
+def test_process_consumer_error(time_samples):
+    """Test that an error in the consumer process is raised with its traceback."""
+    fan_out = SampleFanOut(source=time_samples)
+    chain = ac.FiltOctave(source=fan_out, band=1000.0)  # above the Nyquist frequency
+    consumer = ProcessConsumer(source=chain, feed=fan_out, block_size=512, num_slots=4)
+    fan_out.register_object(consumer)
+    with pytest.raises(OSError, match='band frequency too high'):
+        list(consumer.result(512))
+
+
+def test_process_consumer_update(monkeypatch):
+    """Test that parameter changes are sent to the running consumer process instead of restarting it."""
+    started = []
+    init = future_process._ConsumerProcess.__init__
+
+    def counting_init(self, *args):
+        started.append(self)
+        init(self, *args)
+
+    monkeypatch.setattr(future_process._ConsumerProcess, '__init__', counting_init)
+    t = np.arange(64 * 512) / 8000.0
+    ts = ac.TimeSamples(data=np.sin(2 * np.pi * 250 * t)[:, np.newaxis], sample_freq=8000.0)
+    fan_out = SampleFanOut(source=ts)
+    filt = ac.FiltOctave(source=fan_out, band=250.0)
+    chain = ac.Average(source=ac.TimePower(source=filt), num_per_average=512)
+    consumer = ProcessConsumer(source=chain, feed=fan_out, block_size=512, num_slots=4)
+    fan_out.register_object(consumer)
+    result = []
+    for block in consumer.result(1):
+        result.append(block[0, 0])
+        if len(result) == 4:
+            filt.band = 2000.0  # the sine is outside of the new band
+    assert len(started) == 1
+    assert len(result) == 64
+    np.testing.assert_allclose(result[1:4], 0.5, rtol=0.1)
+    assert max(result[-16:]) < 0.01
+
+
+@pytest.mark.parametrize('compression', ['none', 'zlib', 'blosc'])
+def test_write_h5_batched(time_samples, tmp_path, compression):
+    """Test that the batched writer saves the requested samples in aligned chunks."""
+    writer = WriteH5Batched(
+        source=time_samples,
+        file=str(tmp_path / 'test.h5'),
+        chunk_size=512,
+        batch_size=1500,
+        compression=compression,
+        num_samples_write=5000,
+    )
+    assert writer.get_batch_size() == 1536
+    blocks = list(writer.result(1000))
+    assert len(blocks) == 5
+    with tables.open_file(writer.file) as f:
+        assert f.root.time_data.chunkshape == (512, 4)
+        np.testing.assert_array_equal(f.root.time_data[:], time_samples.data[:5000].astype(np.float32))
+    assert writer.bytes_written == 5000 * 4 * 4
+    assert writer.throughput > 0
+
+
+def test_write_h5_batched_close(time_samples, tmp_path):
+    """Test that the buffered samples are written if the generator is closed early."""
+    writer = WriteH5Batched(source=time_samples, file=str(tmp_path / 'test.h5'))
+    gen = writer.result(1000)
+    next(gen)
+    next(gen)
+    gen.close()
+    with tables.open_file(writer.file) as f:
+        np.testing.assert_array_equal(f.root.time_data[:], time_samples.data[:2000].astype(np.float32))
+
+
+def test_write_h5_segmented(time_samples, tmp_path):
+    """Test that segments are split without losing samples and that paused blocks are skipped."""
+    writer = WriteH5Segmented(
+        source=time_samples, file=str(tmp_path / 'rec.h5'), segment_duration=2.5, batch_size=1000, chunk_size=256
+    )
+    for i, _ in enumerate(writer.result(1000)):
+        writer.paused = i in (3, 4)  # pause blocks 4 and 5
+    assert [(s['start_sample'], s['num_samples']) for s in writer.segments] == [(0, 2500), (2500, 1500), (6000, 2192)]
+    segments = find_segments(writer.get_index_file())
+    assert [s['file'] for s in segments] == [writer.get_segment_file(i) for i in range(3)]
+    for segment in segments:
+        with tables.open_file(segment['file']) as f:
+            start = segment['start_sample']
+            expected = time_samples.data[start : start + segment['num_samples']].astype(np.float32)
+            np.testing.assert_array_equal(f.root.time_data[:], expected)
+    start = datetime.fromisoformat(segments[0]['start'])
+    assert find_segments(writer.get_index_file(), start + timedelta(seconds=3), start + timedelta(seconds=5)) == segments[1:2]
+
+
+def test_write_h5_segmented_bytes(time_samples, tmp_path):
+    """Test that the segment size is limited by the number of bytes."""
+    writer = WriteH5Segmented(source=time_samples, file=str(tmp_path / 'rec.h5'), segment_bytes=3000 * 4 * 4)
+    assert writer.get_segment_size() == 3000
+    list(writer.result(1024))
+    assert [s['num_samples'] for s in writer.segments] == [3000, 3000, 2192]
+    assert writer.bytes_written == 8192 * 4 * 4
+
+
+def test_write_h5_segmented_unlimited(time_samples, tmp_path):
+    """Test that without segment limit the data is written to the file itself."""
+    writer = WriteH5Segmented(source=time_samples, file=str(tmp_path / 'rec.h5'))
+    list(writer.result(1024))
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['rec.h5']
+    with tables.open_file(writer.file) as f:
+        np.testing.assert_array_equal(f.root.time_data[:], time_samples.data.astype(np.float32))
+    # a resume after a pause continues in a numbered segment listed in the index
+    writer.file = str(tmp_path / 'paused.h5')
+    for i, _ in enumerate(writer.result(1024)):
+        writer.paused = i == 3
+    files = [s['file'] for s in find_segments(writer.get_index_file())]
+    assert files == [str(tmp_path / 'paused.h5'), str(tmp_path / 'paused_0001.h5')]
@@ -0,0 +1,124 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Acoular Development Team.
+# ------------------------------------------------------------------------------
+"""Tests for the consumer classes of SpectAcoular."""
+
+import threading
+
+import acoular as ac
+import spectacoular as sp
+
+import numpy as np
+import pytest
+
+
+class DummyDoc:
+    """Run next-tick callbacks immediately instead of scheduling them."""
+
+    def add_next_tick_callback(self, callback):
+        """Execute ``callback`` right away."""
+        callback()
+
+
+@pytest.fixture
+def source():
+    """Return a small multichannel time signal source."""
+    rng = np.random.default_rng(1)
+    return ac.TimeSamples(data=rng.standard_normal((1000, 3)), sample_freq=100.0)
+
+
+def test_time_consumer_stream(source):
+    """Test that streaming keeps at most ``rollover`` rows."""
+    tc = sp.TimeConsumer(source=source, channels=[0, 2], num=100, down=8, rollover=30)
+    tc.consume(DummyDoc())
+    assert len(tc.ds.data['t']) == 30
+    assert tc.elapsed == pytest.approx(10.0)
+
+
+def test_time_consumer_ring_buffer(source):
+    """Test that the ring buffer keeps constant size and holds the newest samples."""
+    tc = sp.TimeConsumer(source=source, channels=[0, 2], num=100, down=8, rollover=30, ring_buffer=True)
+    tc.consume(DummyDoc())
+    t = tc.ds.data['t']
+    ch = tc.ds.data['timedata2']
+    assert t.shape == (30,)
+    assert ch.dtype == np.float32
+    assert np.isnan(ch[tc._index])  # gap between newest and oldest samples
+    valid = ~np.isnan(ch)
+    expected = source.data[:, 2][(t[valid] * source.sample_freq).round().astype(int)]
+    np.testing.assert_allclose(ch[valid], expected, rtol=1e-6)
+
+
+class DeferredDoc:
+    """Collect next-tick callbacks to run them later."""
+
+    def __init__(self):
+        self.callbacks = []
+
+    def add_next_tick_callback(self, callback):
+        """Store ``callback`` for a later call of :meth:`run`."""
+        self.callbacks.append(callback)
+
+    def run(self):
+        """Execute and remove all stored callbacks."""
+        while self.callbacks:
+            self.callbacks.pop(0)()
+
+
+@pytest.mark.parametrize(('treatment', 'first_sample'), [('drop_oldest', 700), ('drop_newest', 0)])
+def test_time_consumer_queue_overflow(source, treatment, first_sample):
+    """Test that overflowing blocks are dropped and pending blocks are coalesced."""
+    tc = sp.TimeConsumer(
+        source=source,
+        channels=[0],
+        num=100,
+        down=1,
+        rollover=1000,
+        queue_size=3,
+        overflow_treatment=treatment,
+    )
+    doc = DeferredDoc()
+    tc.consume(doc)
+    doc.run()
+    assert tc.dropped == 7
+    assert tc.coalesced == 2
+    assert len(tc.ds.data['t']) == 300
+    np.testing.assert_array_equal(tc.ds.data['timedata0'], source.data[first_sample : first_sample + 300, 0])
+
+
+def test_time_consumer_queue_block(source):
+    """Test that the blocking treatment delivers every block to the data source."""
+    tc = sp.TimeConsumer(source=source, channels=[1], num=100, down=1, rollover=1000, queue_size=2)
+    doc = DeferredDoc()
+    tc.thread = threading.Thread(target=tc.consume, args=[doc])
+    tc.thread.start()
+    while tc.thread.is_alive() or doc.callbacks:
+        doc.run()
+    tc.thread.join()
+    assert tc.dropped == 0
+    np.testing.assert_array_equal(tc.ds.data['timedata1'], source.data[:, 1])
+
+
+def test_time_consumer_m4(source):
+    """Test that M4 decimation keeps exact extrema across block boundaries."""
+    tc = sp.TimeConsumer(source=source, channels=[0, 1], num=64, down=10, rollover=1000, decimation='m4')
+    tc.consume(DummyDoc())
+    groups = source.data[:, :2].reshape(100, 10, 2)
+    for i, ch in enumerate(tc.ch_names()):
+        out = np.asarray(tc.ds.data[ch]).reshape(100, 4)
+        np.testing.assert_array_equal(out.min(1), groups[..., i].min(1))
+        np.testing.assert_array_equal(out.max(1), groups[..., i].max(1))
+        np.testing.assert_array_equal(out[:, 0], groups[:, 0, i])
+        np.testing.assert_array_equal(out[:, -1], groups[:, -1, i])
+    t = np.asarray(tc.ds.data['t'])
+    assert np.all(np.diff(t) > 0)
+    np.testing.assert_allclose(t[::4], np.arange(100) * 10 / source.sample_freq)
+
+
+def test_time_consumer_m4_without_consume(source):
+    """Test that M4 decimation works before consume and after a change of channels."""
+    tc = sp.TimeConsumer(source=source, channels=[0, 1], down=10, decimation='m4')
+    tc.data = source.data[:25]
+    assert tc.decimate_m4()['timedata1'].shape == (8,)
+    tc.channels = [2]
+    assert tc.decimate_m4()['timedata2'].shape == (8,)
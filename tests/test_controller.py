@@ -0,0 +1,143 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Acoular Development Team.
+# ------------------------------------------------------------------------------
+"""Tests for the controller functions of SpectAcoular."""
+
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+import spectacoular as sp
+
+import pytest
+from bokeh.document import Document
+from bokeh.models import Toggle
+from bokeh.server.callbacks import NextTickCallback, PeriodicCallback
+
+
+def run_next_tick_callbacks(doc):
+    """Execute the pending next tick callbacks of a document, as the Bokeh server would."""
+    for callback in list(doc.callbacks.session_callbacks):
+        if isinstance(callback, NextTickCallback):
+            doc.remove_next_tick_callback(callback)
+            callback.callback()
+
+
+@pytest.fixture
+def button():
+    """Return a toggle button attached to a document."""
+    button = Toggle(label='Calculate')
+    Document().add_root(button)
+    return button
+
+
+def test_calc_button_callback_sync(button):
+    """Test that the calculation runs within the callback without an executor."""
+    results = []
+    sp.set_calc_button_callback(lambda: 42, button, publish_func=results.append)
+    button.active = True
+    assert results == [42]
+    assert not button.active
+
+
+def test_calc_button_callback_executor(button):
+    """Test that the result of a background calculation is published on the next tick."""
+    results = []
+    release = threading.Event()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        sp.set_calc_button_callback(
+            lambda: release.wait(5) and 42, button, executor=executor, publish_func=results.append
+        )
+        button.active = True
+        doc = button.document
+        assert any(isinstance(cb, PeriodicCallback) for cb in doc.callbacks.session_callbacks)
+        assert results == []
+        release.set()
+    run_next_tick_callbacks(doc)
+    assert results == [42]
+    assert not button.active
+    assert button.label == 'Calculate'
+    assert not doc.callbacks.session_callbacks
+
+
+def test_calc_button_callback_cancel(button):
+    """Test that results of cancelled calculations are discarded."""
+    results = []
+    release = threading.Event()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        cancel = sp.set_calc_button_callback(
+            lambda: release.wait(5) and 42, button, executor=executor, publish_func=results.append
+        )
+        button.active = True
+        cancel()
+        release.set()
+    doc = button.document
+    run_next_tick_callbacks(doc)
+    run_next_tick_callbacks(doc)
+    assert results == []
+    assert not button.active
+    assert not doc.callbacks.session_callbacks
+
+
+def wait_for_next_tick_callback(doc, timeout=5):
+    """Wait until a background thread has added a next tick callback to the document."""
+    deadline = time.monotonic() + timeout
+    while not any(isinstance(cb, NextTickCallback) for cb in doc.callbacks.session_callbacks):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_calc_button_callback_cancel_event(button):
+    """Test that a calculation can stop early with the cancellation event."""
+    results = []
+    started = threading.Event()
+
+    def calc(cancel_event):
+        started.set()
+        assert cancel_event.wait(5)
+        raise CancelledError
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        cancel = sp.set_calc_button_callback(
+            calc, button, executor=executor, publish_func=results.append, pass_cancel_event=True
+        )
+        button.active = True
+        assert started.wait(5)
+        cancel()
+    doc = button.document
+    run_next_tick_callbacks(doc)
+    run_next_tick_callbacks(doc)
+    assert results == []
+    assert not button.active
+    assert not doc.callbacks.session_callbacks
+
+
+def test_calc_button_callback_coalesce(button):
+    """Test that only the latest request waits for a cancelled calculation that still runs."""
+    results = []
+    calls = []
+    release = threading.Event()
+
+    def calc():
+        calls.append(None)
+        release.wait(5)
+        return len(calls)
+
+    doc = button.document
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        cancel = sp.set_calc_button_callback(calc, button, executor=executor, publish_func=results.append)
+        button.active = True
+        for _ in range(3):
+            cancel()
+            run_next_tick_callbacks(doc)
+            assert not button.active
+            button.active = True
+        release.set()
+        wait_for_next_tick_callback(doc)
+        run_next_tick_callbacks(doc)  # the cancelled calculation ends and starts the latest one
+        wait_for_next_tick_callback(doc)
+        run_next_tick_callbacks(doc)
+    assert len(calls) == 2
+    assert results == [2]
+    assert not button.active
+    assert not doc.callbacks.session_callbacks
@@ -0,0 +1,206 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Acoular Development Team.
+# ------------------------------------------------------------------------------
+"""Tests for the presenter classes of SpectAcoular."""
+
+import threading
+from concurrent.futures import CancelledError
+
+import acoular as ac
+import spectacoular as sp
+
+import numpy as np
+import pytest
+from bokeh.models import ColumnDataSource
+
+
+@pytest.fixture
+def h5_source(tmp_path):
+    """Return a masked time samples source reading from a temporary file."""
+    rng = np.random.default_rng(2)
+    file = tmp_path / 'data.h5'
+    ac.WriteH5(source=ac.TimeSamples(data=rng.standard_normal((200_000, 4)), sample_freq=1000.0), file=file).save()
+    return sp.MaskedTimeSamples(file=file, start=1234, stop=198_765)
+
+
+def get_minmax(presenter):
+    """Return min and max values of all channels in the presenter's data source."""
+    ys = np.array([np.asarray(y) for y in presenter.cdsource.data['ys']])
+    return ys[:, ::2], ys[:, 1::2]
+
+
+@pytest.mark.parametrize('numsubsamples', [50, 500])
+def test_time_samples_presenter_pyramid(h5_source, tmp_path, monkeypatch, numsubsamples):
+    """Test that the pyramid keeps all peaks of the direct min/max reduction."""
+    monkeypatch.setattr(ac.config, 'global_caching', 'individual')
+    monkeypatch.setattr(ac.config, 'cache_dir', str(tmp_path / 'cache'))
+    kwargs = {'source': h5_source, 'channels': [1, 3], '_numsubsamples': numsubsamples}
+    direct = sp.TimeSamplesPresenter(**kwargs)
+    direct.update()
+    pyramid = sp.TimeSamplesPresenter(use_pyramid=True, pyramid_base=64, **kwargs)
+    pyramid.update()
+    dmin, dmax = get_minmax(direct)
+    pmin, pmax = get_minmax(pyramid)
+    assert np.all(pmin <= dmin + 1e-6)
+    assert np.all(pmax >= dmax - 1e-6)
+    np.testing.assert_allclose(pmax.max(1), dmax.max(1), rtol=1e-6)
+    assert list((tmp_path / 'cache').glob('*_pyramid/level*.npy'))
+
+
+@pytest.mark.parametrize('chunk_size', [1000, 5000, 2**18])
+def test_time_samples_presenter_chunked(h5_source, chunk_size):
+    """Test that chunked reads give the same min/max values as reading the whole span at once."""
+    kwargs = {'source': h5_source, 'channels': [0, 2], '_numsubsamples': 777}
+    full = sp.TimeSamplesPresenter(chunk_size=0, **kwargs)
+    full.update()
+    chunked = sp.TimeSamplesPresenter(chunk_size=chunk_size, **kwargs)
+    chunked.update()
+    sig = h5_source.data[h5_source.start : h5_source.start + h5_source.num_samples // 777 * 777, [0, 2]]
+    sig = sig.reshape(777, -1, 2)
+    fmin, fmax = get_minmax(full)
+    cmin, cmax = get_minmax(chunked)
+    np.testing.assert_array_equal(fmin, sig.min(1).T)
+    np.testing.assert_array_equal(fmax, sig.max(1).T)
+    np.testing.assert_array_equal(cmin, fmin)
+    np.testing.assert_array_equal(cmax, fmax)
+
+
+def test_time_samples_presenter_arrays(h5_source):
+    """Test that the presenter emits float32 arrays and one shared x array."""
+    presenter = sp.TimeSamplesPresenter(source=h5_source, channels=[0, 1, 3], _numsubsamples=500)
+    presenter.update()
+    xs, ys = presenter.cdsource.data['xs'], presenter.cdsource.data['ys']
+    assert len(xs) == len(ys) == 3
+    assert all(x is xs[0] for x in xs)
+    assert all(isinstance(y, np.ndarray) and y.dtype == np.float32 and y.shape == xs[0].shape for y in ys)
+
+
+def test_mic_geom_presenter_patch(monkeypatch):
+    """Test that toggling an invalid channel only patches the changed entries."""
+    rng = np.random.default_rng(3)
+    mg = ac.MicGeom(pos_total=rng.standard_normal((3, 64)))
+    presenter = sp.MicGeomPresenter(source=mg)
+    presenter.update()
+    x = presenter.cdsource.data['x']
+    patches = []
+    patch = ColumnDataSource.patch
+    monkeypatch.setattr(ColumnDataSource, 'patch', lambda cds, p: patches.append(p) or patch(cds, p))
+    mg.invalid_channels = [5, 6, 20]
+    presenter.update()
+    assert set(patches[0]) == {'xi', 'yi', 'zi'}
+    assert [s for s, _ in patches[0]['xi']] == [slice(5, 7), slice(20, 21)]
+    assert presenter.cdsource.data['x'] is x
+    assert np.isnan(presenter.cdsource.data['xi'][[5, 6, 20]]).all()
+    mg.invalid_channels = [6]
+    presenter.update()
+    assert [s for s, _ in patches[1]['yi']] == [slice(5, 6), slice(20, 21)]
+    np.testing.assert_array_equal(presenter.cdsource.data['yi'][[5, 20]], mg.pos_total[1, [5, 20]])
+    mg.pos_total = rng.standard_normal((3, 32))
+    presenter.update()
+    assert len(patches) == 2
+    assert len(presenter.cdsource.data['channels']) == 32
+
+
+@pytest.fixture
+def beamformer():
+    """Return a small beamformer with random microphone signals."""
+    rng = np.random.default_rng(4)
+    mg = ac.MicGeom(pos_total=rng.uniform(-0.5, 0.5, (3, 8)) * [[1], [1], [0]])
+    ts = ac.TimeSamples(data=rng.standard_normal((4096, 8)), sample_freq=16000.0)
+    grid = ac.RectGrid(x_min=-0.2, x_max=0.2, y_min=-0.2, y_max=0.2, z=0.5, increment=0.1)
+    ps = ac.PowerSpectra(source=ts, block_size=128, cached=False)
+    return ac.BeamformerBase(freq_data=ps, steer=ac.SteeringVector(grid=grid, mics=mg), cached=False)
+
+
+def test_beamformer_presenter_cache(beamformer, monkeypatch):
+    """Test that visited frequencies are served from the cache and the cache is invalidated."""
+    calls = []
+    synthetic = ac.BeamformerBase.synthetic
+    monkeypatch.setattr(ac.BeamformerBase, 'synthetic', lambda bb, *args: calls.append(args) or synthetic(bb, *args))
+    presenter = sp.BeamformerPresenter(source=beamformer, freq=2000.0, num=3)
+    presenter.update()
+    bfdata = presenter.cdsource.data['bfdata'][0]
+    presenter.freq = 4000.0
+    presenter.update()
+    presenter.freq = 2000.0
+    presenter.update()
+    assert len(calls) == 2
+    np.testing.assert_array_equal(presenter.cdsource.data['bfdata'][0], bfdata)
+    beamformer.r_diag = not beamformer.r_diag
+    presenter.update()
+    assert len(calls) == 3
+    # a budget smaller than one result disables caching
+    presenter.cache_size = 1e-4
+    presenter.update()
+    presenter.update()
+    assert len(calls) == 5
+    # a budget for a single result evicts the least recently used one
+    presenter.cache_size = 1.5 * sum(a.nbytes for a in presenter.calc()) / 2**20
+    presenter.freq = 4000.0
+    presenter.update()
+    presenter.freq = 2000.0
+    presenter.update()
+    assert len(calls) == 8
+    assert len(presenter._cache) == 1
+
+
+def test_beamformer_presenter_cache_source_change(beamformer, monkeypatch):
+    """Test that a result is not cached if the source changes during the calculation."""
+    synthetic = ac.BeamformerBase.synthetic
+
+    def changing_synthetic(bb, *args):
+        result = synthetic(bb, *args)
+        bb.r_diag = not bb.r_diag  # e.g. a widget change while calc runs in an executor
+        return result
+
+    monkeypatch.setattr(ac.BeamformerBase, 'synthetic', changing_synthetic)
+    presenter = sp.BeamformerPresenter(source=beamformer, freq=2000.0, num=3)
+    digest = beamformer.digest
+    presenter.calc()
+    assert beamformer.digest != digest
+    assert len(presenter._cache) == 0
+
+
+@pytest.mark.parametrize('precompute', [False, True])
+def test_beamformer_presenter_cancel(beamformer, monkeypatch, precompute):
+    """Test that a set cancellation event stops the calculation of the frequency lines."""
+    calc = ac.BeamformerBase._calc
+    event = threading.Event()
+    calculated = []
+
+    def cancelling_calc(bb, ind):
+        calculated.extend(ind)
+        calc(bb, ind)
+        event.set()  # e.g. a widget change while calc runs in an executor
+
+    monkeypatch.setattr(ac.BeamformerBase, '_calc', cancelling_calc)
+    presenter = sp.BeamformerPresenter(source=beamformer, freq=4000.0, num=1, precompute=precompute)
+    with pytest.raises(CancelledError):
+        presenter.calc(event)
+    assert 0 < len(calculated) <= 8
+    assert len(presenter._cache) == 0
+    assert presenter._cube_key is None
+    # without cancellation, the already calculated lines are reused
+    event.clear()
+    monkeypatch.setattr(ac.BeamformerBase, '_calc', calc)
+    presenter.calc(event)
+
+
+@pytest.mark.parametrize('num', [0, 3])
+def test_beamformer_presenter_precompute(beamformer, num):
+    """Test that the precomputed cube matches the band-wise synthetic results."""
+    presenter = sp.BeamformerPresenter(source=beamformer, num=num, precompute=True)
+    cube, freqs = presenter.calc_cube()
+    assert cube.dtype == np.float32
+    assert cube.shape == (len(freqs), 5, 5)
+    for band in (0, len(freqs) // 2, len(freqs) - 1):
+        np.testing.assert_allclose(cube[band], ac.L_p(beamformer.synthetic(freqs[band], num)).T, rtol=1e-5)
+    presenter.freq = freqs[1] * 1.01
+    presenter.update()
+    np.testing.assert_array_equal(presenter.cdsource.data['bfdata'][0], cube[1])
+    assert presenter.cube_cdsource.data['cube'][0].size == cube.size
+    np.testing.assert_array_equal(presenter.cube_cdsource.data['freqs'][0], freqs)
+    callback = presenter.get_freq_callback(title='{freq} Hz')
+    assert callback.args['title'] == '{freq} Hz'
+    assert 'pdata' in callback.code
+    assert presenter.get_widgets()['precompute'].active
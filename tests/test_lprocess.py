@@ -0,0 +1,250 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Acoular Development Team.
+# ------------------------------------------------------------------------------
+"""Tests for the live processing classes of SpectAcoular."""
+
+import threading
+import time
+
+import acoular as ac
+import spectacoular as sp
+
+import numpy as np
+import pytest
+
+
+def calib_reference(calib, levels):
+    """Return calibration values and factors of the full-buffer implementation."""
+    buffer = np.zeros((calib.buffer_size, levels.shape[1]))
+    calibdata = np.zeros((levels.shape[1], 2))
+    factors = []
+    for level in levels:
+        buffer[:-1] = buffer[1:]
+        buffer[-1] = level
+        calibmask = np.logical_and(
+            buffer > (calib.magnitude - calib.delta), buffer < (calib.magnitude + calib.delta)
+        ).sum(0)
+        if calibmask.max() == calib.buffer_size and calibmask.sum() == calib.buffer_size:
+            idx = calibmask.argmax()
+            if buffer[:, idx].std() < calib.calibstd:
+                calibdata[idx] = [buffer[:, idx].mean(), calib.magnitude]
+        factors.append(calib.to_pa(calib.magnitude) / calib.to_pa(calibdata[:, 0]))
+    return calibdata, np.array(factors)
+
+
+@pytest.mark.parametrize('buffer_size', [5, 20])
+def test_calib_helper(buffer_size):
+    """Test that the running statistics give the same calibration as the full buffer."""
+    rng = np.random.default_rng(9)
+    num_per_average, nblocks = 64, 120
+    data = 1e-3 * rng.standard_normal((num_per_average * nblocks, 3))
+    # calibrator with 114 dB (rms 10 Pa) and 113.8 dB on channels 1 and 2
+    t = np.arange(num_per_average * 50) / 1000.0
+    data[num_per_average * 10 : num_per_average * 60, 1] = 10 * np.sqrt(2) * np.sin(2 * np.pi * 125 * t)
+    data[num_per_average * 65 : num_per_average * 115, 2] = 9.77 * np.sqrt(2) * np.sin(2 * np.pi * 125 * t)
+    ts = ac.TimeSamples(data=data, sample_freq=1000.0)
+    avg = ac.Average(source=ac.TimePower(source=ts), num_per_average=num_per_average)
+    calib = sp.CalibHelper(source=avg, buffer_size=buffer_size)
+    factors = np.array([calib.calibfactor.copy() for _ in calib.result(1)])
+    levels = ac.L_p(np.concatenate(list(avg.result(1))))
+    calibdata, expected = calib_reference(calib, levels)
+    assert np.all(calibdata[1:, 1] == 114)
+    np.testing.assert_allclose(calib.calibdata, calibdata, rtol=1e-12)
+    np.testing.assert_allclose(factors, expected, rtol=1e-10)
+
+
+def test_sliding_window_stats():
+    """Test that blocks of rows update the statistics like the recomputation from the last rows."""
+    rng = np.random.default_rng(5)
+    stats = sp.lprocess._SlidingWindowStats(10, 3, 113.0, 115.0)
+    rows = np.zeros((10, 3))
+    for num in [1, 3, 7, 10, 25, 2, 9]:
+        block = 114 + rng.standard_normal((num, 3))
+        stats.push(block)
+        rows = np.concatenate((rows, block))[-10:]
+        np.testing.assert_allclose(stats.mean, rows.mean(0), rtol=1e-12)
+        np.testing.assert_allclose(stats.std, rows.std(0), rtol=1e-9)
+        np.testing.assert_array_equal(stats.count, stats.inside(rows).sum(0))
+
+
+def test_calib_helper_buffer_size_change():
+    """Test that a changed buffer size takes effect during the calibration."""
+    num_per_average = 64
+    data = 1e-3 * np.random.default_rng(7).standard_normal((num_per_average * 30, 2))
+    t = np.arange(num_per_average * 10) / 1000.0
+    data[num_per_average * 10 : num_per_average * 20, 1] = 10 * np.sqrt(2) * np.sin(2 * np.pi * 125 * t)
+    ts = ac.TimeSamples(data=data, sample_freq=1000.0)
+    avg = ac.Average(source=ac.TimePower(source=ts), num_per_average=num_per_average)
+    calib = sp.CalibHelper(source=avg, buffer_size=20)
+    for _ in calib.result(1):
+        pass
+    # the calibration tone is shorter than the buffer
+    assert np.all(calib.calibdata == 0)
+    gen = calib.result(1)
+    next(gen)
+    calib.buffer_size = 5
+    for _ in gen:
+        pass
+    assert calib.calibdata[1, 1] == 114
+    np.testing.assert_allclose(calib.calibdata[1, 0], 114, atol=0.05)
+
+
+def test_calib_helper_multi():
+    """Test the parallel calibration of several channels and the timeout."""
+    rng = np.random.default_rng(3)
+    num_per_average, nblocks = 64, 80
+    data = 1e-3 * rng.standard_normal((num_per_average * nblocks, 4))
+    tone = np.sqrt(2) * np.sin(2 * np.pi * 125 * np.arange(num_per_average * 40) / 1000.0)
+    # two calibration devices at the same time on channels 1 and 2
+    data[num_per_average * 10 : num_per_average * 50, 1] = 10 * tone
+    data[num_per_average * 15 : num_per_average * 55, 2] = 9.77 * tone
+    # fluctuating level inside the calibration window on channel 3
+    envelope = np.repeat(np.tile([5.0, 12.0], 20), num_per_average)
+    data[num_per_average * 20 : num_per_average * 60, 3] = envelope * tone
+    ts = ac.TimeSamples(data=data, sample_freq=1000.0)
+    avg = ac.Average(source=ac.TimePower(source=ts), num_per_average=num_per_average)
+
+    single = sp.CalibHelper(source=avg, buffer_size=10)
+    for _ in single.result(1):
+        pass
+    assert np.all(single.calibdata == 0)
+
+    multi = sp.CalibHelper(source=avg, buffer_size=10, mode='multi', timeout=20)
+    states = np.array([multi.channel_state.copy() for _ in multi.result(1)])
+    assert np.all(multi.calibdata[[0, 3]] == 0)
+    np.testing.assert_allclose(multi.calibdata[1:3, 0], [114, 113.8], atol=0.05)
+    assert np.all(multi.calibdata[1:3, 1] == 114)
+    tracking, calibrated, timeout = (multi.states.index(s) for s in ('tracking', 'calibrated', 'timeout'))
+    assert states[25, 1] == states[25, 2] == calibrated
+    assert states[25, 3] == tracking
+    assert states[45, 3] == timeout
+    # all channels are idle again after the calibration devices are removed
+    assert np.all(states[-1] == 0)
+
+
+class FakeClock:
+    """Clock that advances only by sleeping or simulated processing."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def perf_counter(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.mark.parametrize(('processing_time', 'missed'), [(0.01, False), (0.06, True)])
+def test_time_samples_phantom(monkeypatch, processing_time, missed):
+    """Test that the replay keeps its deadlines regardless of the processing time."""
+    clock = FakeClock()
+    monkeypatch.setattr(sp.lprocess, 'perf_counter', clock.perf_counter)
+    monkeypatch.setattr(sp.lprocess, 'sleep', clock.sleep)
+    data = np.arange(2000, dtype=float).reshape(-1, 2)
+    phantom = sp.TimeSamplesPhantom(data=data, sample_freq=1000.0, speed=2.0)
+    interval = 100 / 1000.0 / 2.0
+    blocks = []
+    delivered = []
+    for block in phantom.result(100):
+        delivered.append(clock.now)
+        blocks.append(block)
+        clock.now += processing_time
+    np.testing.assert_array_equal(np.concatenate(blocks), data)
+    nblocks = len(blocks)
+    assert phantom.deadline_missed == missed
+    if missed:
+        # no waiting, the delay grows by the excess processing time per block
+        assert phantom.deadline_misses == nblocks - 1
+        assert clock.sleeps == []
+        np.testing.assert_allclose(phantom.max_delay, (nblocks - 1) * (processing_time - interval))
+        np.testing.assert_allclose(delivered, np.arange(nblocks) * processing_time)
+    else:
+        # blocks are delivered at the deadlines, the processing time does not add up
+        assert phantom.deadline_misses == 0
+        assert phantom.max_delay == 0
+        np.testing.assert_allclose(clock.sleeps, interval - processing_time)
+        np.testing.assert_allclose(delivered, np.arange(nblocks) * interval)
+
+
+def test_time_samples_phantom_real_time():
+    """Test that the replay does not run faster than the requested speed."""
+    data = np.arange(2000, dtype=float).reshape(-1, 2)
+    phantom = sp.TimeSamplesPhantom(data=data, sample_freq=1000.0, speed=10.0)
+    start = time.perf_counter()
+    nblocks = sum(1 for _ in phantom.result(100))
+    # the first block is due immediately
+    assert time.perf_counter() - start >= (nblocks - 1) * 0.01
+
+
+@pytest.mark.parametrize('num', [64, 100])
+def test_time_samples_phantom_prefetch(tmp_path, num):
+    """Test that the prefetched blocks equal the blocks read from the file."""
+    data = np.random.default_rng(1).standard_normal((5000, 3))
+    file = tmp_path / 'phantom.h5'
+    ac.WriteH5(source=ac.TimeSamples(data=data, sample_freq=1000.0), file=file).save()
+    phantom = sp.TimeSamplesPhantom(file=file, speed=0.0)
+    expected = list(phantom.result(num))
+    phantom.prefetch = 2
+    phantom.read_size = 1000
+    rows = phantom._read_rows(num)
+    assert rows % num == 0
+    assert rows % phantom.data.chunkshape[0] == 0
+    blocks = list(phantom.result(num))
+    assert len(blocks) == len(expected)
+    for block, block_expected in zip(blocks, expected, strict=True):
+        np.testing.assert_array_equal(block, block_expected)
+    # stop the prefetching early
+    gen = phantom.result(num)
+    next(gen)
+    gen.close()
+    assert not any(thread.name == 'TimeSamplesPhantom prefetch' for thread in threading.enumerate())
+
+
+@pytest.mark.parametrize('mapped', [False, True])
+def test_time_samples_phantom_prefetch_copies(tmp_path, mapped):
+    """Test that the prefetched blocks are read ahead instead of being views of the data."""
+    data = np.random.default_rng(1).standard_normal((5000, 3))
+    if mapped:
+        h5py = pytest.importorskip('h5py')
+        file = tmp_path / 'contiguous.h5'
+        with h5py.File(file, 'w') as f:
+            f.create_dataset('time_data', data=data).attrs['sample_freq'] = 1000.0
+        phantom = sp.TimeSamplesPhantom(file=file, speed=0.0, prefetch=2)
+        assert phantom.memory_mapped
+    else:
+        phantom = sp.TimeSamplesPhantom(data=data, sample_freq=1000.0, speed=0.0, prefetch=2)
+    blocks = list(phantom.result(256))
+    np.testing.assert_array_equal(np.concatenate(blocks), data)
+    assert not any(np.shares_memory(block, phantom.data) for block in blocks)
+
+
+@pytest.mark.parametrize(('invalid_channels', 'views'), [([], True), ([1], False), ([0, 2, 3], True), ([1, 3], True)])
+def test_memmap_time_samples(tmp_path, invalid_channels, views):
+    """Test that the blocks equal those of MaskedTimeSamples and are views if mapped."""
+    h5py = pytest.importorskip('h5py')
+    data = np.random.default_rng(2).standard_normal((3000, 5))
+    file = tmp_path / 'contiguous.h5'
+    with h5py.File(file, 'w') as f:
+        f.create_dataset('time_data', data=data).attrs['sample_freq'] = 1000.0
+    ts = sp.MemmapTimeSamples(file=file, start=100, stop=2900, invalid_channels=invalid_channels)
+    assert ts.memory_mapped
+    assert isinstance(ts.data, np.memmap)
+    reference = ac.MaskedTimeSamples(data=data, start=100, stop=2900, invalid_channels=invalid_channels)
+    blocks = list(ts.result(256))
+    for block, block_expected in zip(blocks, reference.result(256), strict=True):
+        np.testing.assert_array_equal(block, block_expected)
+    # equally spaced valid channels are selected without copying
+    assert all(np.shares_memory(block, ts.data) for block in blocks) == views
+
+
+def test_memmap_time_samples_chunked(tmp_path):
+    """Test that chunked datasets are read as usual."""
+    data = np.random.default_rng(2).standard_normal((3000, 4))
+    file = tmp_path / 'chunked.h5'
+    ac.WriteH5(source=ac.TimeSamples(data=data, sample_freq=1000.0), file=file).save()
+    ts = sp.MemmapTimeSamples(file=file, invalid_channels=[2])
+    assert not ts.memory_mapped
+    np.testing.assert_array_equal(np.concatenate(list(ts.result(512))), data[:, [0, 1, 3]].astype(np.float32))
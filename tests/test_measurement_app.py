@@ -0,0 +1,83 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Acoular Development Team.
+# ------------------------------------------------------------------------------
+"""Tests for the threads of the measurement app."""
+
+import threading
+from threading import Event
+
+import acoular as ac
+from spectacoular.apps.measurement_app.acoular_future import BufferOverflowError, SampleFanOut
+from spectacoular.apps.measurement_app.threads import SamplesThread
+
+import numpy as np
+
+
+def test_samples_thread_metrics():
+    """Test that the metrics of a finished consumer thread cover all blocks."""
+    ts = ac.TimeSamples(data=np.ones((8192, 2)), sample_freq=1000.0)
+    fan_out = SampleFanOut(source=ts)
+    power = ac.TimePower(source=fan_out)
+    event = Event()
+    thread = SamplesThread(
+        gen=power.result(512),
+        splitter=fan_out,
+        register=power,
+        register_args={'buffer_size': 4, 'buffer_overflow_treatment': 'none'},
+        event=event,
+        name='power',
+    )
+    assert thread.metrics()['blocks'] == 0
+    thread.start()
+    thread.join()
+    assert event.is_set()
+    assert not fan_out.dropped
+    metrics = thread.metrics()
+    assert metrics['name'] == 'power'
+    assert metrics['blocks'] == 16
+    assert metrics['max_queue_depth'] == 1
+    assert metrics['max_lag'] == 512
+    assert metrics['dropped'] == metrics['overflowed'] == 0
+    assert metrics['elapsed'] > 0
+
+
+def test_samples_thread_overflow():
+    """Test that a buffer overflow ends the thread and is counted."""
+    ts = ac.TimeSamples(data=np.ones((8192, 2)), sample_freq=1000.0)
+    fan_out = SampleFanOut(source=ts)
+    power, lagging = ac.TimePower(source=fan_out), ac.TimePower(source=fan_out)
+    fan_out.register_object(lagging, buffer_size=2)
+    event = Event()
+    thread = SamplesThread(
+        gen=power.result(512), splitter=fan_out, register=power, register_args={}, event=event
+    )
+    thread.start()
+    thread.join()
+    assert event.is_set()
+    assert isinstance(thread.error, BufferOverflowError)
+    assert thread.metrics()['overflowed'] == 1
+    assert list(fan_out.dropped) == [lagging]
+
+
+def test_samples_thread_error(monkeypatch):
+    """Test that other errors are re-raised and not counted as overflow."""
+    ts = ac.TimeSamples(data=np.ones((8192, 2)), sample_freq=1000.0)
+    fan_out = SampleFanOut(source=ts)
+    power = ac.TimePower(source=fan_out)
+
+    def failing():
+        yield from power.result(512)
+        msg = 'No space left on device'
+        raise OSError(msg)
+
+    raised = []
+    monkeypatch.setattr(threading, 'excepthook', raised.append)
+    event = Event()
+    thread = SamplesThread(gen=failing(), splitter=fan_out, register=power, register_args={}, event=event)
+    thread.start()
+    thread.join()
+    assert event.is_set()
+    assert [args.exc_value for args in raised] == [thread.error]
+    assert str(thread.error) == 'No space left on device'
+    assert thread.metrics()['overflowed'] == 0
+    assert not fan_out.dropped